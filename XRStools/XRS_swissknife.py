@@ -66,7 +66,6 @@ import numbers
 import re
 import yaml
 import yaml.resolver
-import PyMca5.PyMcaIO.specfilewrapper as SpecIO
 import fabio
 from six import u
 
@@ -164,6 +163,8 @@ if nprocs>1:
 
 import os
 from XRStools import xrs_rois
+from XRStools import xrs_fileIO
+from XRStools import xrs_scheduler
 from XRStools import roifinder_and_gui
 from XRStools import xrs_scans
 from XRStools import xrs_read
@@ -742,8 +743,6 @@ def     sum_scans2maps(mydata):
     Scan_Variable = mydata["Scan_Variable"]
     Motor_Variable = mydata["Motor_Variable"]
 
-    
-    specfile = SpecIO.Specfile( specfile_name )
 
 
     dirname  = os.path.dirname(   specfile_name )   
@@ -756,28 +755,27 @@ def     sum_scans2maps(mydata):
     s1 = int(mydata["first_scan"])
     s2 = int(mydata["last_scan"])
 
-    roi_names = list(rois.keys())
-    roi_list = [  rois[k] for k in roi_names  ]
+    roi_obj = xrs_rois.roi_object()
+    roi_obj.red_rois = rois
+    roi_names = roi_obj.get_roi_keys()
     
-    for i in range(s1,s2+1):
-        # print " SCAN lettura " , i
-        scan = specfile.select(str(i))
-        scan_data = scan.data()
+    # all scans are read in one pass through the indexed SPEC file
+    spec_scans = xrs_fileIO.IndexedSpecReadMany( specfile_name, range(s1,s2+1) )
+
+    for scan_data, scan_motors, scan_counters, labels in spec_scans:
         
-        scan_themotor   =  scan.motorpos( Motor_Variable  )
-        scan_othermotors = [ scan.motorpos( name   )  for name in  scan.allmotors()  if name != Motor_Variable   ]
+        scan_themotor   =  scan_motors[ Motor_Variable  ]
+        scan_othermotors = [ scan_motors[ name   ]  for name in  scan_motors  if name != Motor_Variable   ]
 
-        othermotorsname = [name for name in  scan.allmotors()  if name != Motor_Variable]
+        othermotorsname = [name for name in  scan_motors  if name != Motor_Variable]
         
-        labels = scan.alllabels()
-        scan_variable = scan_data[ labels.index( Scan_Variable )   , :]
-        scan_ccdnos  = scan_data[ labels.index( "ccdno" )   , :].astype("i")
+        scan_variable = scan_data[ :, labels.index( Scan_Variable )   ]
+        scan_ccdnos  = scan_data[ :, labels.index( "ccdno" )   ].astype("i")
         signal = []
         for no in scan_ccdnos:
             print( " opening image ", os.path.join(   dirname   ,  "edf", basename+"_"+str(no)+".edf"))
             data = fabio.open(  os.path.join(   dirname   ,  "edf", basename+"_"+str(no)+".edf" )   ).data 
-            tok = [ (data[corner[0]:corner[0]+mask.shape[0],   corner[1]:corner[1]+mask.shape[1]]*mask).sum() for corner, mask in roi_list  ]
-            signal.append(tok)
+            signal.append( roi_obj.project( data, normalize=False ) )
             # print " OK "
 
 
@@ -984,8 +982,12 @@ def loadscan_2Dimages(mydata):
 
          # the following defaults to None
          recenterings : "recenterings.h5:/recenterings4rois"
+
+         workers : 4   # OPTIONAL, without MPI the scans are distributed over this many local processes
  
     #
+    Under MPI the scans are handed out one by one to the free processes and rank 0
+    collects the images and writes them.
     """
 
     roiaddress=None
@@ -1075,15 +1077,35 @@ def loadscan_2Dimages(mydata):
     for i in range(ninterval):
         todo_list = todo_list + list(range(    int(scan_interval[2*i]),  int(scan_interval[2*i+1])) ) #   *scan_interval[2*i :2*i+2])
 
-    mytodo = np.array_split(todo_list, nprocs) [myrank]
-    print( mytodo)
-    maxvalue = reader.loadscan_2Dimages( list(mytodo) ,scantype=energycolumn, isolateSpot = isolateSpot)
-    if nprocs>1:
-        maxvalue = comm.allreduce(maxvalue, op=MPI.MAX)
+    if  ('workers') in mydata :
+        workers = mydata['workers']
+    else:
+        workers = None
 
+    # the refinement of the recenterings is updated from scan to scan, it stays serial
     if is_by_refinement :
         if nprocs>1:
             raise Exception("When using recentering with refinement parallelism cannote be used")
+        workers = None
+
+    scheduler = xrs_scheduler.TaskScheduler( workers = workers )
+    results   = scheduler.map( _loadscan_2Dimages_task, todo_list, context = (reader, energycolumn, isolateSpot) )
+
+    if not scheduler.is_writer():
+        scheduler.barrier()
+        return
+
+    maxvalue = 0
+    reader.twoDimages = {}
+    reader.motorDict  = {}
+    for twoDimages, motorDict, scan_maxvalue, monitor_divider in results:
+        reader.twoDimages.update( twoDimages )
+        reader.motorDict.update( motorDict )
+        maxvalue = max( maxvalue, scan_maxvalue )
+        if monitor_divider != reader.monitor_divider:
+            reader.monitor_divider = monitor_divider  # the monitor column was missing in a scan
+
+    if is_by_refinement :
         if os.path.exists(recenterings_confirmed_filename):
             check_libre(  recenterings_confirmed_filename    , recenterings_confirmed_groupname       )
             print( " APRO IN MODO a ", recenterings_confirmed_filename)
@@ -1108,12 +1130,17 @@ def loadscan_2Dimages(mydata):
         save_also_roi = True
 
     
+    reader.save_state_hdf5( filename, groupname, comment = inputtext, myrank = 0, save_also_roi = save_also_roi  )# factor = 16000.0/maxvalue)
 
-    for iproc in range(nprocs):
-        comm.Barrier()
-        if iproc==myrank:
-            reader.save_state_hdf5( filename, groupname, comment = inputtext, myrank = myrank, save_also_roi = save_also_roi  )# factor = 16000.0/maxvalue)
+    scheduler.barrier()
 
+def _loadscan_2Dimages_task( context, number ):
+    """ Loads the images of a single scan, used by loadscan_2Dimages through the scheduler. """
+    reader, energycolumn, isolateSpot = context
+    reader.twoDimages = {}
+    reader.motorDict  = {}
+    maxvalue = reader.loadscan_2Dimages( [number] ,scantype=energycolumn, isolateSpot = isolateSpot)
+    return reader.twoDimages, reader.motorDict, maxvalue, reader.monitor_divider
  
 
 def loadscan_2Dimages_galaxies(mydata):
@@ -1314,8 +1341,13 @@ def extract_spectra(mydata):
         niterLip          : 100
         niter             : 500
         beta              : 0.0
+        tol               : 1.0e-6  # OPTIONAL, the fit stops when the relative change of the spectra goes below it
+        workers           : 4       # OPTIONAL, without MPI the ROIs are distributed over this many local processes
         target            : "extracted_spectra.h5:/spectra_scan_342"
         final_plot        : "PLOT"  # or "NOPLOT"
+
+    The ROIs are fitted in parallel, over the MPI ranks or over the local worker processes.
+    The time spent on each ROI is written, for each scan, in fit_time_<scan>.
     """
 
     target_filename , target_groupname  = split_hdf5_address( mydata["target"])    
@@ -1360,6 +1392,9 @@ def extract_spectra(mydata):
     else:
         zmargin = 0
 
+    tol     = mydata.get("tol", None)
+    workers = mydata.get("workers", None)
+
     h5frois = h5py.File(rois_file,"r" )
     h5rois  = h5frois[rois_groupname]["rois_definition/rois_dict"]    
     rois_keys_orig = filterRoiList(h5rois.keys(), strip=True)
@@ -1504,7 +1539,12 @@ def extract_spectra(mydata):
         ascan = myscans[0]
         enbyscan[ascan] = ENE0
         mysample_s = { mykey: sample_s[mykey] for mykey in myscans }
-        myres[ascan ] = fit_spectra.fit_spectra_main( references  , mysample_s , DE , beta,   niter, niterLip , slopeInfos,  discard_threshold = discard_threshold , threshold_fraction = threshold_fraction  )
+        myres[ascan ] = fit_spectra.fit_spectra_main( references  , mysample_s , DE , beta,   niter, niterLip , slopeInfos,  discard_threshold = discard_threshold , threshold_fraction = threshold_fraction,
+                                                      tol = tol, workers = workers  )
+        if myres[ascan ] is None:
+            ## not the writer rank
+            h5frois.close()
+            return
         
     filenametxt = target_filename.replace(".h5","") +"_"+  target_groupname.replace("/","_")    +".txt"
 
@@ -1541,13 +1581,16 @@ def extract_spectra(mydata):
             spvar = "spectraByLine_"+str(ene0_key)
             ervar = "errors_"+str(ene0_key)
             E0var = "E0_"+str(ene0_key)
+            tvar  = "fit_time_"+str(ene0_key)
             README += ("""energies_{key} : the energies fo scan {key} 
 spectraByLine_{key} : the spectra for scan {key}
 error_{key} : the errors fo scan {key}
 E0_{key} : the monocromator energy for scan {key}
+fit_time_{key} : the time (in seconds) spent on this ROI for scan {key}
             """).format(key=str(ene0_key))
 
-            for lab in [envar,spvar,ervar,E0var , "python_plot_spectra_byline" , "README", "python_plot_spectra_byfit" , "python_plot_convergency"  ]:
+            for lab in [envar,spvar,ervar,E0var,tvar , "python_plot_spectra_byline" , "README", "python_plot_spectra_byfit" , "python_plot_convergency" ,
+                        "spectraByFit_"+str(ene0_key), "fit_errList_"+str(ene0_key), "sintesi_"+str(ene0_key) ]:
                 if lab in h5k:
                     del h5k[lab]
             
@@ -1557,6 +1600,7 @@ E0_{key} : the monocromator energy for scan {key}
             h5k[spvar] = myres[ene0_key][k]["spectraByLine"]
             h5k[ervar] = myres[ene0_key][k]["errors"]
             h5k[E0var] = enbyscan[ene0_key]*1000
+            h5k[tvar]  = myres[ene0_key][k]["fit_time"]
 
             plot_string +=("ax.plot(self.%s  - self.%s  , self.spectraByLine_%s,label=\"spectra %f\")\n"
                            "ax.plot(self.%s  - self.%s  , 3*self.%s, label = \"3*sigma %f\")\n"
@@ -2566,6 +2610,13 @@ def superR_getVolume(mydata):
          beta                      :  1.0e-8
          eps                       : 0.000002
 
+         # optional
+         tol                       : 1.0e-4
+         warm_start_address        : "volume.hdf5:Volume"
+         zslab                     : 16
+         zoverlap                  : 2
+         workers                   : 4
+
     scalprods_address points to the scalDS, scalDD, scalSS scalar products
     calculated by superR_scal_deltaXimages.
     The volume will be written in file target_filename( which must not exist already),
@@ -2577,6 +2628,12 @@ def superR_getVolume(mydata):
        - niter : the number of fista cycles
        - beta : the factor of the Total Variation  penalisation term
        - eps  : a parameter for the convergence of the Chambolle-Pock TV denoising phase
+       - tol  : optional, the cycles stop when the relative change of the volume is below tol
+       - warm_start_address : optional, a volume ( for example a previous result ) to start from
+       - zslab : optional, the volume is reconstructed in independent slabs of zslab planes,
+         extended by zoverlap planes ( default 2 ) on both sides, which are distributed over
+         the MPI ranks or over workers local processes. This is an approximation
+         because the TV term couples the planes, increase zoverlap if slab borders are visible.
 
     """
 
@@ -2614,7 +2671,22 @@ def superR_getVolume(mydata):
         scalDS = nuovoDS
         scalDS.shape = DIMZ*debin[0], DIMY*debin[1], DIMX
     
-    Volume = superr.superr( scalDD, scalDS, scalSS, niter=niter, beta=beta)
+    solution = None
+    if 'warm_start_address' in mydata:
+        warm_filename, warm_groupname = split_hdf5_address(mydata['warm_start_address'])
+        h5f = h5py.File(warm_filename, "r")
+        solution = h5f[warm_groupname][:]
+        h5f.close()
+
+    Volume = superr.superr( scalDD, scalDS, scalSS, niter=niter, beta=beta, eps=eps,
+                            solution = solution,
+                            tol      = mydata.get('tol', None),
+                            zslab    = mydata.get('zslab', None),
+                            zoverlap = mydata.get('zoverlap', 2),
+                            workers  = mydata.get('workers', None))
+    if Volume is None:
+        # MPI rank which only computed slabs
+        return
 
     if os.path.exists(target_filename):
         h5 = h5py.File(target_filename,"a")
@@ -2694,6 +2766,10 @@ def superR_scal_deltaXimages(mydata):
          ## a     solution with dimensions  [ZDIM,YDIM,XDIM] 
          ## If given, will be used to balance analyzer factors
 
+         workers : 4
+         ## number of local processes over which the Z scans are distributed
+         ## when not running under MPI. Defaults to None ( serial )
+
     If nbin is given the dimensios of the superresolution axis, will be reduced or increased,
     by binning together the foil PSFs.
     What the program will produce, under *target_address* datagroup, is 
@@ -2828,12 +2904,6 @@ def superR_scal_deltaXimages(mydata):
     
     ZDIM = len(zscan_keys)
 
-    ## in case of parallelism the workload is splitted between processes
-    myrange = np.array_split( np.arange( ZDIM ), nprocs   )[myrank]
-
-    myZDIM =   len(myrange)
-
-
     YDIM = None
     rois_to_be_removed=[]
     for ro in roi_keys:
@@ -2854,61 +2924,67 @@ def superR_scal_deltaXimages(mydata):
     for ro in rois_to_be_removed:
         print ( " RIMUOVO ", ro )
         roi_keys.remove(ro)
+
+    h5f.close()
             
     if YDIM is None:
         return 
 
+    ## the work is distributed scan by scan (i.e. along Z) by the scheduler : under MPI the free processes
+    ## get the next scan and rank 0 collects and writes, otherwise an optional local pool of workers is used
+    if  ('workers') in mydata :
+        workers = mydata['workers']
+    else:
+        workers = None
+    scheduler = xrs_scheduler.TaskScheduler( workers = workers )
+
+    ## scalar products of the probes with themselves, one [XDIM,XDIM] matrix per roi
+    probes_SS = {}
+    for rk in roi_keys:
+        probes         = sonde [rk]
+        probes_SS[rk]  = np.tensordot( probes, probes, axes = [  [1,2], [1,2] ] ) 
+
+    ## rois whose probes have the same shape are stacked, so that each scan
+    ## is contracted with all of them at once
+    probe_groups = collections.OrderedDict()
+    for rk in roi_keys:
+        probe_groups.setdefault( sonde[rk].shape, [] ).append(rk)
+    probe_groups = [ ( rks, shape[1:], np.array( [ sonde[rk].reshape(XDIM,-1) for rk in rks ] ) )
+                     for shape, rks in probe_groups.items() ]
+
+    ## IF solution is given the balancing factors are only known when all the scans are done : each task
+    ## then leaves the contributions of its rois to the plane of scalDS in a scratch file, next to the target,
+    ## which is combined with the factors below. Keeping them in memory would cost the size of scalDS
+    ## times the number of rois
+    target_address = mydata["target_address"]
+    target_filename, target_groupname = split_hdf5_address(target_address)
+    if solution is not None:
+        scratch_pattern = target_filename + ".scal_deltaX_%04d.tmp"
+    else:
+        scratch_pattern = None
+
+    context = ( sample_filename, sample_groupname, zscan_keys, roi_keys, probe_groups, probes_SS, solution, XDIM, YDIM, scratch_pattern )
+    results = scheduler.map( _superR_scal_deltaX_task, range(ZDIM), context = context )
+
+    if not scheduler.is_writer():
+        scheduler.barrier()
+        return
+
     fattori = {} ## This is used for balancing. Will stay to 1.0 for all rois if solution is not given in input
     for i,rk in enumerate(roi_keys):
         fattori[rk] = 1.0
 
-    ## IF solution is given then balancing factors are calculated     
+    ## IF solution is given then balancing factors are calculated
     if solution is not None:
         for rk in roi_keys:
             ## This are scalars, so why am I using a np.array?
-            ##  I am doing that in prevision of mpi AllReduce with mpi4py
-            scal_dd=np.array([0.0],"d")    
+            ##  the contributions are summed in the order of the scans
             scal_ds = np.array([0.0],"d")
             scal_ss = np.array([0.0],"d")
-            
-            probes      = sonde [rk]
-            SS  =  np.tensordot( probes, probes, axes = [  [1,2], [1,2] ] ) 
-
-            for iz in range(myZDIM):
-                zkey = zscan_keys[myrange[iz] ]
-
-                m = np.array(h5[ zkey ][ rk ]["matrix"][:],"d")
-                msum = m.sum(axis=0)
-
-
-                probes = sonde [rk]
-                assert( probes.shape[1:] == m.shape[1:])
-                assert( XDIM == probes.shape[0] )
-                assert( YDIM == m.shape[0]      )
-
-                plane_contrib  = np.tensordot( m, probes, axes = [  [1,2], [1,2] ] ) 
-
-                scal_dd     += (m*m).sum()
-
-                print( "  zscan_keys " , zscan_keys)
-                keypos = zscan_keys.index( zkey)
-                
-                scal_ds[:] = scal_ds +  np.tensordot( plane_contrib , solution[keypos], axes = [  [0,1], [0,1] ] )
-                scal_ss[:] = scal_ss +  np.tensordot( np.tensordot(SS,solution[keypos],axes=[[1],[1]]) ,   solution[keypos],axes=[[0,1],[1,0]]) 
-
-            if nprocs>1:
-                comm.Allreduce([np.array(scal_ss), MPI.DOUBLE],
-                            [scal_ss, MPI.DOUBLE],
-                            op=MPI.SUM)
-                comm.Allreduce([np.array(scal_dd), MPI.DOUBLE],
-                            [scal_dd, MPI.DOUBLE],
-                            op=MPI.SUM)
-                comm.Allreduce([np.array(scal_ds), MPI.DOUBLE],
-                               [scal_ds, MPI.DOUBLE],
-                               op=MPI.SUM)
-                
-                comm.Barrier()
-            
+            for iz in range(ZDIM):
+                ds, ss = results[iz][4][rk]
+                scal_ds[:] = scal_ds +  ds
+                scal_ss[:] = scal_ss +  ss
             fattori[rk] = scal_ds/scal_ss
 
     ### Renormalising the overall strenght of all the factors        
@@ -2918,181 +2994,166 @@ def superR_scal_deltaXimages(mydata):
     for rk in roi_keys:
         fattori[rk] = fattori[rk]/np.sqrt( sum/len(roi_keys) )
 
-    ## These arrays below will contain, after summation and for each process,
-    ## the contribution of the process's workload
-    ## They will be mpi Reduced to get the final result
-    
-    scalDS = np.zeros( [myZDIM,YDIM,XDIM]  ,"d" )
+    ## These arrays below will contain, after summation, the contributions of all the scans
+    scalDS = np.zeros( [ZDIM,YDIM,XDIM]  ,"d" )
     scalDD = 0.0
     scalSS = np.zeros( [XDIM,XDIM]  ,"d" )
 
     for i,rk in enumerate(roi_keys):
-        if i%nprocs == myrank:
-            probes      = sonde [rk]
-            ## Consider that, below, factor is a factor which is applied to the probe to better adapt it to the sample strenght
-            ## variations from roi to roi.
-            scalSS[:]  =  scalSS[:] +   np.tensordot( probes, probes, axes = [  [1,2], [1,2] ] ) *fattori[rk]*fattori[rk]
-
-
-    doppio_filtro_done=0
-    for iz in range(myZDIM):
-        
-        ## each scan is at fixed Z and contains many ys. So we proceed along z
-        zkey = zscan_keys[myrange[iz] ]
-        print( " process %d analyzing scan : "%myrank , zkey)
-
-
-        my_roi_keys  = filterRoiList(h5[ zkey ].keys(),prefix="")
-        my_roi_keys = [str(t) for t in my_roi_keys]
-
-
-        ## The following piece of code makes sure that our roi_keys list
-        ## contains rois which can be found in the datas
-        if not doppio_filtro_done:
-            new_roi_keys=[]
-            for ok in roi_keys:
-                if ok not in my_roi_keys:
-                    print(" MANCA ", ok , end= {False:"", True:"\n"} [ok==roi_keys[-1]] )
-                    del integrated_images[ok]
-                else:
-                    new_roi_keys.append(ok)
-            doppio_filtro_done=1
-            roi_keys = new_roi_keys
-        
-        
+        ## Consider that, below, factor is a factor which is applied to the probe to better adapt it to the sample strenght
+        ## variations from roi to roi.
+        scalSS[:]  =  scalSS[:] +   probes_SS[rk] *fattori[rk]*fattori[rk]
+
+    for iz in range(ZDIM):
+        plane, plane_dd, msums, cornerposs, balance = results[iz]
+        if plane is None:
+            ## the rois contributions of this scan, summed with their factors
+            plane = np.zeros( [YDIM,XDIM]  ,"d" )
+            scratch = h5py.File( scratch_pattern % iz, "r" )
+            for rks, image_shape, probes in probe_groups:
+                for rk in rks:
+                    plane = plane + scratch[rk][:]*fattori[rk]
+            scratch.close()
+            os.remove( scratch_pattern % iz )
+        scalDS[iz] = plane
         for rk in roi_keys:
-            m = np.array(h5[ zkey ][ rk ]["matrix"][:],"d")
-            msum = m.sum(axis=0)
             if iz:
-                if msum.shape != integrated_images[rk][1].shape:
+                if msums[rk].shape != integrated_images[rk][1].shape:
                     msg =  " ERROR : the yscan elements have different shapes.\n selects homogeneous scans."
                     print( msg)
                     raise Exception( msg)
 
-            integrated_images[rk][1] = integrated_images[rk][1]+msum
-
-            cornerpos = np.array(h5 [ zkey ][ rk ]["cornerpos"][:])
-            integrated_images [rk][3] =  cornerpos
-
-
-            probes = sonde [rk]
-            assert( probes.shape[1:] == m.shape[1:])
-            assert( XDIM == probes.shape[0] )
-            assert( YDIM == m.shape[0]      )
-
-
-            ## At the end all boils down to these three lines of code. Note that they sum-up
-            ## contributions from all the rois alltogether
-            plane_contrib  = np.tensordot( m, probes, axes = [  [1,2], [1,2] ] ) 
-            scalDS[iz] =  scalDS[iz]+   plane_contrib*fattori[rk]
-
-            scalDD     += (m*m).sum()
-
-    ## sum-Reducing the final result 
-    if nprocs>1:
-        comm.Reduce([np.array(scalSS), MPI.DOUBLE],
-                    [scalSS, MPI.DOUBLE],
-                    op=MPI.SUM, root=0)
-
-        comm.Barrier()
+            integrated_images[rk][1] = integrated_images[rk][1]+msums[rk]
+            integrated_images [rk][3] =  cornerposs[rk]
+            scalDD     += plane_dd[rk]
 
+    ##  
+    ## ######################
 
+    ## All the remaining part is just writing            
+    h5f = h5py.File(target_filename,"a")
+        
+    if h5f.__contains__( target_groupname ):
+        del h5f[target_groupname]
+        h5f.close()
+        h5f = h5py.File(target_filename,"a")
                 
+    h5f.require_group(target_groupname )
+    h5  = h5f[target_groupname]
+    h5["scalSS"] = scalSS
+
+    h5.create_dataset("scalDS", ( ZDIM  ,  YDIM  ,   XDIM ), dtype='d')
+    h5.create_dataset("scalDD", ( 1, ), dtype='d')
+    h5["scalDS"][:]=scalDS
+    h5["scalDD"][:]=scalDD
+            
+    for n in  list(integrated_images.keys()):
+        print (" in key " , n)
+        B=integrated_images[n][1]
+        A=integrated_images[n][0]
+        # B=B.sum(axis=0)
+        pesiA = A.sum(axis=0)
+        pesiB = B.sum(axis=0)
+        ## print(" pesi ", pesiA, pesiB)
+        medieA = (np.arange(A.shape[0])[:,None]*A).sum(axis=0)/pesiA
+        medieB = (np.arange(B.shape[0])[:,None]*B).sum(axis=0)/pesiB
+
+        h5.require_group(n)
+        h5n=h5[n]
+        h5n["delta_poss"] = medieA
+        h5n["sample_poss"] = medieB
+
+        h5n["delta_integrated"  ] = integrated_images[n][0]
+        h5n["sample_integrated" ] = integrated_images[n][1]           
+        h5n["sample_integrated_weight"   ] = pesiB
+        if orig_delta_filename is not None:
+            corner_C = np.array(integrated_images[n][4])
+            corner_B = np.array(integrated_images[n][3])
+            diff     = corner_C-corner_B
+
+            C     = integrated_images[n][2]
+            pesiC = C.sum(axis=0)
+            medieC = (np.arange(C.shape[0])[:,None]*C).sum(axis=0)/pesiC
+            coords  = np.arange(len( medieC  )) + diff[1]
+            h5n["orig_delta_poss"             ] = np.array(  medieC+diff[0] )
+            h5n["orig_delta_poss_coord"       ] = np.array(  coords )
+
+            inset = integrated_images[n][2]  
+            tmp = np.zeros_like( integrated_images[n][1]     )
+            target = tmp [ diff[0]:diff[0]+  inset.shape[0], diff[1]:diff[1]+  inset.shape[1]]  
+            target[:] = inset[  :target.shape[0], :target.shape[1] ]
+            h5n["orig_delta_integrated" ] = tmp
+
+    h5.require_group("Mean_Poss")
+
+    h5f.flush()
     h5f.close()
 
-    ##  
-    ## ######################
+    scheduler.barrier()
 
+def _superR_scal_deltaX_task( context, iz ):
+    """ Contribution of the Z scan number iz to the scalar products of superR_scal_deltaXimages.
 
-    ## stuffs for checking (integrated_images)
-    if nprocs>1:    
-        for n in  list(integrated_images.keys()):
-            if myrank:
-                print( myrank, "A ",  integrated_images[n][0].dtype, integrated_images[n][0].shape)
-                comm.Reduce([integrated_images[n][0], MPI.DOUBLE], None, op=MPI.SUM, root=0)
-                print( myrank, "B ", integrated_images[n][1].dtype, integrated_images[n][1].shape)
-                comm.Reduce([integrated_images[n][1], MPI.DOUBLE], None, op=MPI.SUM, root=0)
-            else:
-                print( myrank, " A " , integrated_images[n][0].dtype, integrated_images[n][0].shape)
-                comm.Reduce(  [integrated_images[n][1], MPI.DOUBLE] , [integrated_images[n][0], MPI.DOUBLE],  op=MPI.SUM, root=0)
-                print( myrank, " B " , integrated_images[n][1].dtype, integrated_images[n][1].shape)
-                comm.Reduce(  [np.array(integrated_images[n][1]), MPI.DOUBLE], [integrated_images[n][1], MPI.DOUBLE],  op=MPI.SUM, root=0)
+    Returns the plane [YDIM,XDIM] of scalDS, the rois being summed, together with the data checks.
+    If a solution is given the plane is None : the contribution of each roi is written
+    to the scratch file scratch_pattern%iz, to be summed with the balancing factors, and
+    the last element gives, for each roi, the scalar products data*solution and
+    solution*solution used for these factors.
+    """
+    sample_filename, sample_groupname, zscan_keys, roi_keys, probe_groups, probes_SS, solution, XDIM, YDIM, scratch_pattern = context
 
-                
-    ## All the remaining part is just writing            
-    target_address = mydata["target_address"]
-    target_filename, target_groupname = split_hdf5_address(target_address)
+    ## each scan is at fixed Z and contains many ys.
+    zkey = zscan_keys[iz]
+    print( " analyzing scan : " , zkey)
 
-    for iproc in range(nprocs):
-        comm.barrier()
-        if iproc != myrank:
-            continue
-
-        h5f = h5py.File(target_filename,"a")
-        
-        if myrank==0:
-            if h5f.__contains__( target_groupname ):
-                del h5f[target_groupname]
-                h5f.close()
-                h5f = h5py.File(target_filename,"a")
-                
-            h5f.require_group(target_groupname )
-            h5  = h5f[target_groupname]
-            h5["scalSS"] = scalSS
-
-            h5.create_dataset("scalDS", ( ZDIM  ,  YDIM  ,   XDIM ), dtype='d')
-            h5.create_dataset("scalDD", ( 1, ), dtype='d')
-            h5["scalDS"][:]=0
-            h5["scalDD"][:]=0
-            
-            for n in  list(integrated_images.keys()):
-                print (" in key " , n)
-                B=integrated_images[n][1]
-                A=integrated_images[n][0]
-                # B=B.sum(axis=0)
-                pesiA = A.sum(axis=0)
-                pesiB = B.sum(axis=0)
-                ## print(" pesi ", pesiA, pesiB)
-                medieA = (np.arange(A.shape[0])[:,None]*A).sum(axis=0)/pesiA
-                medieB = (np.arange(B.shape[0])[:,None]*B).sum(axis=0)/pesiB
-
-                h5.require_group(n)
-                h5n=h5[n]
-                h5n["delta_poss"] = medieA
-                h5n["sample_poss"] = medieB
-
-                h5n["delta_integrated"  ] = integrated_images[n][0]
-                h5n["sample_integrated" ] = integrated_images[n][1]           
-                h5n["sample_integrated_weight"   ] = pesiB
-                if orig_delta_filename is not None:
-                    corner_C = np.array(integrated_images[n][4])
-                    corner_B = np.array(integrated_images[n][3])
-                    diff     = corner_C-corner_B
-
-                    C     = integrated_images[n][2]
-                    pesiC = C.sum(axis=0)
-                    medieC = (np.arange(C.shape[0])[:,None]*C).sum(axis=0)/pesiC
-                    coords  = np.arange(len( medieC  )) + diff[1]
-                    h5n["orig_delta_poss"             ] = np.array(  medieC+diff[0] )
-                    h5n["orig_delta_poss_coord"       ] = np.array(  coords )
-
-                    inset = integrated_images[n][2]  
-                    tmp = np.zeros_like( integrated_images[n][1]     )
-                    target = tmp [ diff[0]:diff[0]+  inset.shape[0], diff[1]:diff[1]+  inset.shape[1]]  
-                    target[:] = inset[  :target.shape[0], :target.shape[1] ]
-                    h5n["orig_delta_integrated" ] = tmp
-
-        h5f.require_group(target_groupname )
-        h5  = h5f[target_groupname]
-        
-        h5["scalDD"][:]                           +=  scalDD
-        h5["scalDS"][myrange[0]:myrange[-1]+1]    +=  scalDS
+    h5f = h5py.File(sample_filename,"r")
+    h5  = h5f[sample_groupname]
 
-        h5.require_group("Mean_Poss")
-        h5=h5["Mean_Poss"]
+    plane      = np.zeros( [YDIM,XDIM]  ,"d" )
+    plane_dd   = {}
+    msums      = {}
+    cornerposs = {}
+    balance    = None
+    if solution is not None:
+        plane   = None
+        balance = {}
+        scratch = h5py.File( scratch_pattern % iz, "w" )
+    for rks, image_shape, probes in probe_groups:
+        ## the rois of the group are read in one stack : the hdf5 library converts
+        ## to double chunk by chunk, without a full size copy in the stored type
+        stack = None
+        for i,rk in enumerate(rks):
+            dataset = h5[ zkey ][ rk ]["matrix"]
+            if stack is None:
+                stack = np.empty( (len(rks),)+dataset.shape, "d" )
+            assert( dataset.shape == stack.shape[1:] )
+            dataset.read_direct( stack[i] )
+            cornerposs[rk] = np.array(h5 [ zkey ][ rk ]["cornerpos"][:])
+
+        assert( XDIM == probes.shape[1] )
+        assert( YDIM == stack.shape[1]      )
+        assert( image_shape == stack.shape[2:] )
+
+        ## At the end all boils down to this line of code : for each roi the scalar
+        ## products of all the images with all the probes
+        plane_contribs = np.matmul( stack.reshape(len(rks), YDIM, -1), probes.transpose(0,2,1) )
+
+        for i,rk in enumerate(rks):
+            m = stack[i]
+            msums[rk]    = m.sum(axis=0)
+            plane_dd[rk] = (m*m).sum()
+            if solution is None:
+                plane    = plane +   plane_contribs[i]
+            else:
+                SS = probes_SS[rk]
+                balance[rk] = ( np.tensordot( plane_contribs[i] , solution[iz], axes = [  [0,1], [0,1] ] ),
+                                np.tensordot( np.tensordot(SS,solution[iz],axes=[[1],[1]]) ,   solution[iz],axes=[[0,1],[1,0]]) )
+                scratch[rk] = plane_contribs[i]
+    h5f.close()
+    if solution is not None:
+        scratch.close()
 
-        h5f.flush()
-        h5f.close()
+    return plane, plane_dd, msums, cornerposs, balance
 
 def XRSprediction( yamlData ):
     """ **prediction**
@@ -3,16 +3,29 @@ from __future__ import division
 from __future__ import print_function
 import numpy as np
 import scipy
+import scipy.sparse
 import math
 import sys
+import time
 from six.moves import range
 from six.moves import zip
 import pickle
+from XRStools import xrs_scheduler
+from XRStools import xrs_utilities
+fitspectra_cy = None
 if(sys.argv[0][-12:]!="sphinx-build"):
-    from XRStools import fitspectra_cy
-
-
-def Fista(solution   ,  problem,   niter, niterLip):
+    try:
+        from XRStools import fitspectra_cy
+    except ImportError:
+        print( " fitspectra_cy not available, using the numpy implementation of spectra_roi_by_line " )
+
+
+def Fista(solution   ,  problem,   niter, niterLip, tol=None):
+    """ Accelerated proximal gradient (FISTA) minimisation of problem.calculate_grad's
+    functional with a positivity constraint. abs(niter) iterations at most, niter<0 turns the
+    acceleration off (plain ISTA). If tol is given the iterations stop as soon as the relative
+    change of the solution goes below tol.
+    """
     # print " SHAPE " , solution.shape
     dim = solution.shape[0]
     err = 0.0
@@ -21,46 +34,38 @@ def Fista(solution   ,  problem,   niter, niterLip):
     Lip = math.sqrt( np.linalg.norm(grad)   )
     grad   = grad/ Lip
 
-    print( "CALCULATING LIPSCHITZ FACTOR ")
-    
     for i in range(niterLip):
         grad2,err2 = problem.calculate_grad(grad,  quadratic_only=1)
         Lip = math.sqrt( np.linalg.norm(grad2)   )
         grad   = grad2/ Lip
-        print( "LIP ", Lip)
+    print( "LIP ", Lip)
 
     Lip = Lip*1.05
     
     t=1.0
-    y      = solution
-    x_old  = solution
-
-    errList=[]
-    for i in range(1000):
-        grad, err = problem.calculate_grad(y)
-        print( "err " , err)
-        errList.append(err)
-        y = y-grad/Lip
-        y=np.maximum(y-beta/Lip,0)
-    return y,errList
+    solution = np.array(solution, "d")
+    y        = solution.copy()
+    x_old    = solution.copy()
 
     errList=[]
     for iter in range(abs(niter)):
         grad, err = problem.calculate_grad(y)
         errList.append(err)
-        solution =  y + grad/Lip
-        solution = np.maximum(solution-beta/Lip, 0)
+        solution = np.maximum( y - grad/Lip - beta/Lip, 0)
         tnew = ( 1+math.sqrt(1.0+4*t*t) )/2
-        y[:] = solution +(t-1)/tnew *( solution - x_old )
+        step = solution - x_old
+        y = solution +(t-1)/tnew * step
         t = tnew
         if niter<0:
             t=1
-        x_old[:] = solution
-        if iter%1 ==0:
-            # sys.stdout.write(" "*60+"\r"+("FISTA iter %d  errore est %e  mod_grad est  %e" % ( iter,  err, grad.std()) ))
-            sys.stdout.write(("FISTA iter %d  errore est %e  mod_grad est  %e\n" % ( iter,  err, grad.std()) ))
+        x_old = solution
+        change = np.linalg.norm(step) / max( np.linalg.norm(solution), np.finfo(solution.dtype).tiny )
+        if iter%100 ==0:
+            sys.stdout.write(("FISTA iter %d  errore est %e  mod_grad est  %e  change %e\n" % ( iter,  err, grad.std(), change) ))
             sys.stdout.flush()
-        print( " ")
+        if tol is not None and change < tol:
+            print( "FISTA converged at iter %d  errore est %e" % ( iter, err ) )
+            break
     return solution, errList
 
 
@@ -85,79 +90,89 @@ def     calculate_grad(problem, spettro,  quadratic_only=0):
     return grad, err
     
 
-def  fitta( DD_scal,  SS_scal,  SD_scal,    energie_spettro,  energie_for_SD     , spettro   , beta,   niter, niterLip  ):
-    
+def interpolation_operators( energie_spettro, energie_for_SD ):
+    """ The sparse (CSR) operators which interpolate linearly from the spectra grid energie_spettro
+    to the energies energie_for_SD (f2i) and back (i2f, the transposed).
+    """
     de = energie_spettro[1]-energie_spettro[0]
     e_min = energie_spettro[0]
     e_max = energie_spettro[-1]
     
     energie_for_SD_flat = np.array(energie_for_SD.flat)
-    SD_scal_flat        = np.array(SD_scal.flat)
-    
-    sparse_elements = []
-    for j in range(len(energie_for_SD_flat)):
-        eneSD =   energie_for_SD_flat[j]
-        assert(eneSD>e_min )
-        assert(eneSD<e_max )
-
-        i = int((eneSD-e_min)/de)
-        f = (eneSD-e_min)/de -i
-        
-        sparse_elements.append([ j,i  , (1-f)   ])
-        sparse_elements.append([ j,i+1,    f    ])
+    assert( np.all( energie_for_SD_flat > e_min ) )
+    assert( np.all( energie_for_SD_flat < e_max ) )
 
+    fpos = (energie_for_SD_flat-e_min)/de
+    i    = fpos.astype(int)
+    f    = fpos - i
 
-    J,I,F = np.array(sparse_elements).T
-        
-    f2i_coo =    scipy.sparse.coo_matrix( (F,(J,I)) , shape = [   energie_for_SD_flat.size   ,   spettro.size  ])   
-    i2f_coo =    scipy.sparse.coo_matrix( (F,(I,J)) , shape = [   spettro.size  , energie_for_SD_flat.size     ])
+    ## each row j has two elements : (1-f) at column i and f at column i+1
+    nrows   = energie_for_SD_flat.size
+    indptr  = np.arange( 0, 2*nrows+1, 2 )
+    indices = np.stack( [ i, i+1 ], axis=1 ).ravel()
+    F       = np.stack( [ 1-f, f ], axis=1 ).ravel()
+
+    f2i = scipy.sparse.csr_matrix( (F, indices, indptr) , shape = [   nrows   ,   energie_spettro.size  ])
+    i2f = f2i.T.tocsr()
+    return f2i, i2f
+
+def  fitta( DD_scal,  SS_scal,  SD_scal,    energie_spettro,  energie_for_SD     , spettro   , beta,   niter, niterLip, tol=None  ):
     
-    f2i = f2i_coo.tocsr() 
-    i2f = i2f_coo.tocsr() 
+    SD_scal_flat        = np.array(SD_scal.flat)
+    
+    f2i, i2f = interpolation_operators( energie_spettro, energie_for_SD )
 
     problem  = type('MyObject', (object,), {"calculate_grad":calculate_grad  ,  "f2i":f2i,"i2f":i2f, "SS_scal":SS_scal, "SD_scal":SD_scal,  "SD_scal_flat":SD_scal_flat, "DD_scal":DD_scal, "beta":beta })()
 
 
-    solution, errList = Fista(spettro   ,  problem,   niter, niterLip )
+    solution, errList = Fista(spettro   ,  problem,   niter, niterLip, tol=tol )
 
     ii = f2i.dot( solution  )
   
     return ii, solution, errList
     
 
-def fit_spectra_main( references  , sample_s , DE , beta,   niter, niterLip , slopeInfos  ,  discard_threshold = 0 , threshold_fraction = 0    ):
-    
+def fit_spectra_main( references  , sample_s , DE , beta,   niter, niterLip , slopeInfos  ,  discard_threshold = 0 , threshold_fraction = 0 , tol = None, workers = None   ):
+    """ Extracts the spectra of all ROIs. The ROIs are independent : they are distributed
+    with xrs_scheduler.TaskScheduler over the MPI ranks or, without MPI, over workers local processes.
+    Returns a dictionary ROI key -> results (None on the MPI ranks other than the writer).
+    """
     chiavi = list(references.keys())
-    res = {}
-    for k in chiavi :
-        ref = references[k]
-        SInfo  = slopeInfos[k]
-        data = []
-        for scan in sample_s.keys():
-            data.append(    sample_s[scan][k] )
-          
-        (sintesi, energie_spettro, spettro_byline, errors,
-         solution,   errList      )=  fit_spectra_roi( ref,  data, DE  , beta,   niter, niterLip  , SInfo ,  discard_threshold = discard_threshold , threshold_fraction = threshold_fraction )
-
-
-        res[k] = {"energies" : energie_spettro,
-                  "spectraByLine" : spettro_byline,
-                  "errors" : errors, 
-                  "spectraByFit": solution,
-                  "fit_errList": errList,
-                  "sintesi":sintesi 
-                  ##"spectra_byscalprod" : spectra_byscalprod
-                  
-        }
-    return res
+    context = ( references  , sample_s , DE , beta,   niter, niterLip , slopeInfos  ,  discard_threshold , threshold_fraction , tol )
 
+    scheduler = xrs_scheduler.TaskScheduler( workers = workers )
+    results   = scheduler.map( _fit_spectra_roi_task, chiavi, context )
+    if not scheduler.is_writer():
+        return None
+    return dict( zip( chiavi, results ) )
 
+def _fit_spectra_roi_task( context, k ):
+    references  , sample_s , DE , beta,   niter, niterLip , slopeInfos  ,  discard_threshold , threshold_fraction , tol = context
 
-def do_spettro_byscal(energie_spettro, spettro_byscal, SD_scal, energie_for_SD,  S_L1  ):
-    
-    byscal_sum = np.zeros_like(energie_spettro)
+    ref = references[k]
+    SInfo  = slopeInfos[k]
+    data = []
+    for scan in sample_s.keys():
+        data.append(    sample_s[scan][k] )
+
+    t_start = time.time()
+    (sintesi, energie_spettro, spettro_byline, errors,
+     solution,   errList      )=  fit_spectra_roi( ref,  data, DE  , beta,   niter, niterLip  , SInfo ,  discard_threshold = discard_threshold , threshold_fraction = threshold_fraction, tol = tol )
+
+    return   {"energies" : energie_spettro,
+              "spectraByLine" : spettro_byline,
+              "errors" : errors, 
+              "spectraByFit": solution,
+              "fit_errList": errList,
+              "sintesi":sintesi ,
+              "fit_time" : time.time() - t_start
+              ##"spectra_byscalprod" : spectra_byscalprod
+    }
 
 
+
+def do_spettro_byscal(energie_spettro, spettro_byscal, SD_scal, energie_for_SD,  S_L1  ):
+    
     Slong_L1 = np.zeros_like(SD_scal)
     Slong_L1[:,:] = Slong_L1[:,:]+S_L1[:,None]
 
@@ -171,24 +186,13 @@ def do_spettro_byscal(energie_spettro, spettro_byscal, SD_scal, energie_for_SD,
     energie_for_SD = np.array(energie_for_SD.flat)
     Slong_L1 = np.array(Slong_L1.flat)
     
-    for E,Scal,Sl1 in zip(  energie_for_SD  , SD_scal,  Slong_L1    ) :
-        fpos = NS*((  E-El)/(Eh-El))
-        if fpos>0 and fpos<NS-1:
-            ipos = int(fpos)
-            ipos1= ipos+1
-            f = fpos-ipos
-            
-            byscal_sum[ipos] +=   (1-f)*Sl1
-            byscal_sum[ipos1] +=   (f)*Sl1
-            
-            spettro_byscal[ipos] +=   (1-f)*Scal
-            spettro_byscal[ipos1] +=   (f)*Scal
-    
-    for i in range(len(spettro_byscal)) :
-        if byscal_sum[i]>0:
-            spettro_byscal[i] = spettro_byscal[i]/byscal_sum[i]
+    fpos = NS*((  energie_for_SD-El)/(Eh-El))
+    inside = (fpos>0) & (fpos<NS-1)
 
-def fit_spectra_roi( ref,  datas, user_de  , beta,   niter, niterLip  , SInfo ,  discard_threshold = 0 , threshold_fraction = 0  ):
+    byscal, byscal_sum = xrs_utilities.linear_deposit_average( fpos[inside], SD_scal[inside], Slong_L1[inside], NS )
+    spettro_byscal += byscal
+
+def fit_spectra_roi( ref,  datas, user_de  , beta,   niter, niterLip  , SInfo ,  discard_threshold = 0 , threshold_fraction = 0 , tol = None ):
     ##  reference scan energy ( the analyser energies, in an array_
     if ref is not None:
         enes_ref = ref.zscale
@@ -317,7 +321,7 @@ def fit_spectra_roi( ref,  datas, user_de  , beta,   niter, niterLip  , SInfo ,
 
 
 
-        usecython=1
+        usecython= fitspectra_cy is not None
         if usecython:
 
 
@@ -382,6 +386,21 @@ def fit_spectra_roi( ref,  datas, user_de  , beta,   niter, niterLip  , SInfo ,
 
             mask_npix = MASK.sum()
 
+            iy, ix = np.nonzero( MASK )  ## Mask is already taken into account, but needs to be passed.
+
+            ## Assigning an energy shift to the pixels
+            H0 = iy- ( hline + ix * slopeline)
+            pix_ii = H0 /DHoverDI
+
+            ## calculating the longitudinal position along the line ( to weight with the projected response_line_intensity)
+            if ref is not None   and  ref.line_infos.weight_by_response:
+                posx_inref = np.round(   (ix-( (ref.line_infos.Xintercept-CRX+ fNmiddle*ref.line_infos.Xslope ) + pix_ii * ref.line_infos.Xslope  )   )).astype(int)
+                has_freq   = (posx_inref>=0) & (posx_inref< len(response_line_intensity))
+                freqs      = response_line_intensity[ np.where( has_freq, posx_inref, 0 ) ].astype("d")
+            else:
+                has_freq   = np.ones( len(iy), bool )
+                freqs      = np.ones( len(iy), "d" )
+
             for iE , (ene , mm, deno) in enumerate(zip(enes_data,mms, denominator)):
         
                 
@@ -391,54 +410,19 @@ def fit_spectra_roi( ref,  datas, user_de  , beta,   niter, niterLip  , SInfo ,
                     if mm_npix > mask_npix*threshold_fraction:
                         continue
 
-
-
                 ## one energy, one 2D image from the stack, one value for the denominator
+                E     = ene - pix_ii *deltaEref
+                fipos = (E-mine)/de                        # the position in pixel units of the contribution to the spectra array (which starts from mine)
+                ipos  = fipos.astype(int)                  # the integer part of fipos
+                sel   = has_freq & (ipos>0) & (ipos < nsteps)   # If I am withing the range of the spectra
+                vals  = mm[iy[sel],ix[sel]]
+
+                ## distributing 100% to ipos if f=0 and 100% to ipos+1 if f=1, intensities weighted by the response
+                frequencies_sum += xrs_utilities.linear_deposit( fipos[sel], freqs[sel], nsteps+1 )
+                spettro_byline  += xrs_utilities.linear_deposit( fipos[sel], vals, nsteps+1 )
+                ## Calculating the error by hoping that the final result  be  gaussian
+                error_sum       += xrs_utilities.linear_deposit( fipos[sel], vals /deno, nsteps+1, power=2 )
 
-                # P_enes.append(ene)
-                # P_mms.append(mm)
-                # P_sp_e.append(   ene -(np.arange(mm.shape[0]) -hline)/DHoverDI  * deltaEref   )
-                # P_sp_s.append(  mm[:,int(CRX)]   )
-
-                for iy in range(mm.shape[0]):
-                    for ix in range(mm.shape[1]):
-                        # slow loop in python. You know why it is orribly slow.
-
-                        if not MASK[iy,ix]:
-                            ## Good. Mask is already taken into account
-                            ## But needs to be passed . Issue to be  followed
-                            continue
-
-                        ## Assigning an energy to the pixel
-                        H0 = iy- ( hline + ix * slopeline)
-                        ii = H0 /DHoverDI
-                        E = ene - ii *deltaEref    #   + DE_ref*0
-
-                        ## calculating the longitudinal position along the line ( to weight with the projected response_line_intensity)
-                        if ref is not None   and  ref.line_infos.weight_by_response:
-                            posx_inref =   int( round(   (ix-( (ref.line_infos.Xintercept-CRX+ fNmiddle*ref.line_infos.Xslope ) + ii * ref.line_infos.Xslope  )   )))
-                            if posx_inref>=0 and posx_inref< len(response_line_intensity):
-                                freq = response_line_intensity[posx_inref] # a weigthing factor
-                            else:
-                                freq = None
-                        else:
-                            freq = 1.0
-
-                        if   freq is not  None:                        
-                            fipos = (E-mine)/de                        # the position in pixel units of the contribution to the spectra array (which starts from mine)
-                            ipos  = int(fipos)                         # the integer part of fipos
-                            f = fipos - ipos                           # the fractional residu of fipos
-
-                            if ipos>0 and ipos < nsteps:              # If I am withing the range of the spectra
-                                frequencies_sum[ipos] += (1-f)* freq       # I distribute the contribution : 100% if f=0, to ipos , with the weigth given by response
-                                spettro_byline [ipos] += (1-f)* mm[iy,ix]  # Same thing : distributing intensity to spectro_..
-
-                                frequencies_sum[ipos+1] +=  f*freq         # Same thing as above, just 100% if f=1 because we are distributing to the upper pixel
-                                spettro_byline [ipos+1] +=  f* mm[iy,ix]
-
-                                ## Calculating the error by hoping that the final result  be  gaussian
-                                error_sum[ipos] += (1-f)*(1-f)* mm[iy,ix] /deno   # 
-                                error_sum[ipos+1] += f*f* mm[iy,ix] /deno   # 
 
             # ff = open("/tmp/sp.p","wb")
             # todump =  [P_enes, P_mms, P_sp_e, P_sp_s, P_MASK]
@@ -495,7 +479,7 @@ def fit_spectra_roi( ref,  datas, user_de  , beta,   niter, niterLip  , SInfo ,
         ##solution, errList = fitta( DD_scal,  SS_scal,  SD_scal,    energie_spettro,  energie_for_SD     , spettro    , beta,   niter, niterLip   )
 
 
-        ii, solution, errList = fitta( DD_scal,  SS_scal,  SD_scal,    energie_spettro,  energie_for_SD     , spettro    , beta,   niter, niterLip   )
+        ii, solution, errList = fitta( DD_scal,  SS_scal,  SD_scal,    energie_spettro,  energie_for_SD     , spettro    , beta,   niter, niterLip, tol = tol   )
 
         ii.shape = energie_for_SD.shape
         # print mm.shape
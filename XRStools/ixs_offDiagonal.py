@@ -377,6 +377,23 @@ class offDiagonal:
             dataset.errorMatrix  = errorMatrix
             self.offDiaDataSets.append(dataset)
 
+    def alignRockingCurves(self, method='pearson7', repeat=2, threshold=None):
+        """ **alignRockingCurves**
+        Aligns the data matrices of all ROIs (all offDiaDataSets) according to their
+        rocking curve monitors in one go (see xrs_scans.align_offDiaDataSets).
+
+        Args:
+          * method (str): 'pearson7', 'com' or 'cc' (as the alignRCmonitor, alignRCmonitor2
+            and alignRCmonitorCC methods of the offDiaDataSets).
+          * repeat (int): Number of further cross-correlation iterations ('cc' only).
+          * threshold (float): If given, detector errors (signals >= threshold) are
+            repaired first (see offDiaDataSet.filterDetErrors).
+        """
+        if threshold is not None:
+            for dataset in self.offDiaDataSets:
+                dataset.filterDetErrors(threshold)
+        xrs_scans.align_offDiaDataSets(self.offDiaDataSets, method=method, repeat=repeat)
+
     def getrawdata(self):
         """ **getrawdata**
         Iterates through all instances of the scan class and calls it's applyrois method
@@ -126,6 +126,16 @@ class MainWindow(Qt.QMainWindow) :
         self.plots_conf = {}
         self.emitter2plotC={}
 
+        self.worker = None
+        self.toreport = {}
+        self.progressBar = QtGui.QProgressBar()
+        self.pushButton_cancel = QtGui.QPushButton("Cancel")
+        self.pushButton_cancel.clicked.connect(self.cancelAcquisition)
+        self.statusBar().addPermanentWidget(self.progressBar)
+        self.statusBar().addPermanentWidget(self.pushButton_cancel)
+        self.progressBar.hide()
+        self.pushButton_cancel.hide()
+
         self.actionSave_Configuration.triggered.connect(self.saveConfiguration)
         self.actionLoad_Configuration.triggered.connect(self.loadConfiguration)
 
@@ -279,89 +289,110 @@ class MainWindow(Qt.QMainWindow) :
         file.close()
         
     def acquire(self):
+        """ starts integration and edge extraction in an acquisitionWorker thread.
+        The plot tabs are added one by one, as each subset is extracted.
+        """
+        if self.worker is not None and self.worker.isRunning():
+            return
+        
         print(" =============== LOADING============ ")
         selected_scans       =  self.getScansSelection()
         selected_subsets     =  self.getSubsetsSelection()
         selected_acquisition =  self.getLoadingSelection()
-            
+
         if not DEBUG:
             specfile_name , roifile_address =  self.getExperimentSelection()
             formulas, edges = self.getEdgesSelection()
-            if len(edges)!=1:
-                raise Exception(" So far only one edge can be processed")
-            element = list(edges.keys())[0]
-            if len(edges[element])!=1:
-                raise Exception(" So far only one edge can be processed")
-            else:
-                edge = edges[element][0]
-        
-            forms=[]
-            weights=[]
-            for f,ww in formulas:
-                forms.append(f)
-                weights.append(float(ww) )
-        
-            self.lw, roinums = integrate( specfile_name,  roifile_address,  selected_scans, selected_subsets, selected_acquisition  ) 
+            element, edge = get_single_edge(edges)
+            forms, weights = get_forms_weights(formulas)
+
+        self.toreport = {}
+        for plotC in self.plots:
+            vals = [ tok.text() for tok in plotC.inputs ]
+            dizio_rois = plotC.plot.getCurvesRoiDockWidget().getRois()
+            self.toreport[plotC.name]=[vals, dizio_rois ]
 
         for p in self.plots:
             self.tabWidget.removeTab( self.tabWidget.indexOf(p))
             p.deleteLater()
             del p
-
-                  
-        toreport = {}
-        for plotC in self.plots:
-            vals = [ tok.text() for tok in plotC.inputs ]
-            dizio_rois = plotC.plot.getCurvesRoiDockWidget().getRois()
-            toreport[plotC.name]=[vals, dizio_rois ]
         self.plots=[]
 
-
-        self.lw_ex_s = []
-        
-        for iplot,subset in enumerate(selected_subsets):
-
-            if not DEBUG:
-                scal = subset[0]
+        if DEBUG:
+            for iplot,subset in enumerate(selected_subsets):
                 name = subset[1]
-                nums = subset[2:]
-
-                nums = [ i for i in range(len(roinums)) if roinums[i] in nums ]
-
-                lw_ex = xrs_extraction.edge_extraction( self.lw,forms,weights,{element:[edge]})
-                lw_ex.analyzerAverage(nums, errorweighing=False)
-                y = np.maximum(1.0e-10 , lw_ex.avsignals)
-
-
-                print("   INITIALISATION y, ", y)
-                
-                plotC = plotContainer(lw_ex.eloss, y, name, lw_ex, element, edge )
-                plotC.controller=self
-                self.plots.append(plotC)
-                self.tabWidget.addTab(plotC, name)
-
-                if name in toreport:
-                    vals, dizio = toreport[name]
-                    for tok,v in zip(plotC.inputs, vals):
-                        tok.setText(v)
-                    plotC.plot.getCurvesRoiDockWidget().setRois(dizio)
-                
-                self.consume_plots_definitions()
-
-                
-            else:
-                scal = subset[0]
-                name = subset[1]
-                nums = subset[2:]
                 saved = np.load("debug%d.npy"%iplot)
                 eloss, y = saved
 
                 plotC = plotContainer(eloss, y, name)
                 self.plots.append(plotC)
                 self.tabWidget.addTab(plotC, name)
-                
+            return
+
+        self.lw = None
+        self.worker = acquisitionWorker( specfile_name,  roifile_address,  selected_scans, selected_subsets, selected_acquisition,
+                                         forms, weights, element, edge)
+        self.worker.progress_signal.connect(self.on_acquisition_progress)
+        self.worker.integrated_signal.connect(self.on_integrated)
+        self.worker.subset_signal.connect(self.on_subset_extracted)
+        self.worker.error_signal.connect(self.on_acquisition_error)
+        self.worker.finished.connect(self.on_acquisition_finished)
+
+        self.acquisition.pushButton.setEnabled(False)
+        self.progressBar.setRange(0, self.worker.nsteps)
+        self.progressBar.setValue(0)
+        self.progressBar.show()
+        self.pushButton_cancel.setEnabled(True)
+        self.pushButton_cancel.show()
+        self.worker.start()
+
+    def cancelAcquisition(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.pushButton_cancel.setEnabled(False)
+            self.statusBar().showMessage("cancelling after the current step ...")
+
+    def on_acquisition_progress(self, istep, nsteps, message):
+        self.progressBar.setValue(istep)
+        self.statusBar().showMessage(message)
+
+    def on_integrated(self, result):
+        self.lw, roinums = result
+
+    def on_subset_extracted(self, result):
+        name, lw_ex, element, edge = result
+        y = np.maximum(1.0e-10 , lw_ex.avsignals)
+
+        plotC = plotContainer(lw_ex.eloss, y, name, lw_ex, element, edge )
+        plotC.controller=self
+        self.plots.append(plotC)
+        self.tabWidget.addTab(plotC, name)
+
+        if name in self.toreport:
+            vals, dizio = self.toreport[name]
+            for tok,v in zip(plotC.inputs, vals):
+                tok.setText(v)
+            plotC.plot.getCurvesRoiDockWidget().setRois(dizio)
+
+        self.consume_plots_definitions()
+
+    def on_acquisition_error(self, message):
+        show_error_message(message)
+
+    def on_acquisition_finished(self):
+        self.acquisition.pushButton.setEnabled(True)
+        self.progressBar.hide()
+        self.pushButton_cancel.hide()
+        if self.worker.cancelled():
+            self.statusBar().showMessage("loading cancelled")
+        self.worker = None
+
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker.wait()
+        super(  MainWindow, self).closeEvent(event)
 
-                
     def saveAnalysis(self):
         prefix = str(self.acquisition.lineEdit_outputPrefix.text())
         for C in self.plots:
@@ -396,7 +427,48 @@ class MainWindow(Qt.QMainWindow) :
     def getEdgesSelection(self):
         return self.edges.get_selection()
        
-def integrate( specfile_name,  roifile_address,  selected_scans, selected_subsets, selected_acquisition  ) :
+class AcquisitionCancelled(Exception):
+    """ raised by integrate and extract_subsets when the cancelled callable returns True """
+    pass
+
+def check_progress(progress, cancelled, message):
+    if cancelled is not None and cancelled():
+        raise AcquisitionCancelled(message)
+    if progress is not None:
+        progress(message)
+
+def get_single_edge(edges):
+    if len(edges)!=1:
+        raise Exception(" So far only one edge can be processed")
+    element = list(edges.keys())[0]
+    if len(edges[element])!=1:
+        raise Exception(" So far only one edge can be processed")
+    return element, edges[element][0]
+
+def get_forms_weights(formulas):
+    forms=[]
+    weights=[]
+    for f,ww in formulas:
+        forms.append(f)
+        weights.append(float(ww) )
+    return forms, weights
+
+def integration_steps(selected_scans):
+    """ number of progress calls done by integrate """
+    return len(selected_scans) + 3
+
+def integrate( specfile_name,  roifile_address,  selected_scans, selected_subsets, selected_acquisition, progress=None, cancelled=None  ) :
+        """ **integrate**
+        Loads the selected scans and builds the spectra, without any GUI.
+
+        Args:
+          * progress  : if given, called as progress(message) at the start of each step
+                        (compensation factor, each group of scans, spectrum, angles)
+          * cancelled : if given, called before each step; if it returns True
+                        AcquisitionCancelled is raised
+
+        Returns the Hydra object and the sorted roi numbers.
+        """
         print(" SETTING PATH TO LW", specfile_name)
         assert( os.path.exists(specfile_name )   )
         if not os.path.isdir(specfile_name):
@@ -442,6 +514,7 @@ def integrate( specfile_name,  roifile_address,  selected_scans, selected_subset
         method, ref_scan, keep_elastic,   output_prefix  = selected_acquisition
         print(" CALCULATING COMPENSATION", ref_scan, method)
         print("DEBUG compensation factor ", ref_scan, method   ) 
+        check_progress(progress, cancelled, "compensation factor from scan %s" % ref_scan)
         lw.get_compensation_factor(ref_scan, method=method )
         
         print(" --------------------------------------------------------")
@@ -454,13 +527,16 @@ def integrate( specfile_name,  roifile_address,  selected_scans, selected_subset
             scan_ns = scan[1:]
             scan_name = scan[0]
             print("DEBUG  LOADING ", scan_name, scan_ns, method)
+            check_progress(progress, cancelled, "loading %s %s" % (scan_name, str(list(scan_ns))))
             lw.load_scan( scan_ns, method=method, direct=True, scan_type=scan_name) #  scaling = scaling)
 
 
         print(" DEBUG get spe ",  method, keep_elastic)
+        check_progress(progress, cancelled, "building the spectrum")
         lw.get_spectrum_new( method=method , include_elastic=keep_elastic)    
                         
 
+        check_progress(progress, cancelled, "setting detector angles")
         print(" SET detector angles")
         specfile = SpecIO.Specfile( specfile_name )
         
@@ -479,6 +555,71 @@ def integrate( specfile_name,  roifile_address,  selected_scans, selected_subset
         return lw, roinums
 
 
+def extract_subsets( lw, roinums, selected_subsets, forms, weights, element, edge, progress=None, cancelled=None):
+    """ **extract_subsets**
+    Generator over the analyzers subsets: yields name, lw_ex where lw_ex is the
+    edge_extraction object averaged over the subset analyzers.
+    progress and cancelled as for integrate, one step per subset.
+    """
+    for subset in selected_subsets:
+        if cancelled is not None and cancelled():
+            raise AcquisitionCancelled("extraction")
+        scal = subset[0]
+        name = subset[1]
+        nums = subset[2:]
+
+        nums = [ i for i in range(len(roinums)) if roinums[i] in nums ]
+
+        lw_ex = xrs_extraction.edge_extraction( lw,forms,weights,{element:[edge]})
+        lw_ex.analyzerAverage(nums, errorweighing=False)
+        check_progress(progress, None, "extracted subset %s" % name)
+        yield name, lw_ex
+
+
+class acquisitionWorker(QtCore.QThread):
+    """ runs integrate and extract_subsets out of the GUI thread.
+    Progress, the Hydra object and each extracted subset are sent by signals;
+    cancel() stops the work at the next step.
+    """
+    progress_signal   = QtCore.pyqtSignal(int, int, str)
+    integrated_signal = QtCore.pyqtSignal(object)
+    subset_signal     = QtCore.pyqtSignal(object)
+    error_signal      = QtCore.pyqtSignal(str)
+
+    def __init__(self, specfile_name,  roifile_address,  selected_scans, selected_subsets, selected_acquisition,
+                 forms, weights, element, edge, parent=None):
+        super( acquisitionWorker, self).__init__(parent)
+        self.integrate_args = [specfile_name,  roifile_address,  selected_scans, selected_subsets, selected_acquisition]
+        self.selected_subsets = selected_subsets
+        self.forms, self.weights = forms, weights
+        self.element, self.edge = element, edge
+        self.nsteps = integration_steps(selected_scans) + len(selected_subsets)
+        self.istep = 0
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def cancelled(self):
+        return self._cancelled
+
+    def progress(self, message):
+        self.istep += 1
+        self.progress_signal.emit(self.istep, self.nsteps, message)
+
+    def run(self):
+        try:
+            lw, roinums = integrate( *self.integrate_args, progress=self.progress, cancelled=self.cancelled)
+            self.integrated_signal.emit((lw, roinums))
+            for name, lw_ex in extract_subsets( lw, roinums, self.selected_subsets, self.forms, self.weights,
+                                                self.element, self.edge, progress=self.progress, cancelled=self.cancelled):
+                self.subset_signal.emit((name, lw_ex, self.element, self.edge))
+        except AcquisitionCancelled:
+            print(" LOADING CANCELLED ")
+        except:
+            self.error_signal.emit(traceback.format_exc())
+
+
 
 class MyPlot1D(Plot1D):
     def __init__(self, parent=None):
@@ -900,40 +1041,21 @@ def batch( filename):
 
     selected_edges_d = d["selected_edges"]
     formula, edges = selected_edges_d["formula"] , selected_edges_d["edges"]
-    if len(edges)!=1:
-        raise Exception(" So far only one edge can be processed")
-    element = list(edges.keys())[0]
-    if len(edges[element])!=1:
-        raise Exception(" So far only one edge can be processed")
-    else:
-        edge = edges[element][0]
-        
-    forms=[]
-    weights=[]
-    for f,ww in formula:
-        forms.append(f)
-        weights.append(float(ww) )
+    element, edge = get_single_edge(edges)
+    forms, weights = get_forms_weights(formula)
 
 
     if "plots" in d:
         plots_def = d["plots"]
     else:
         plots_def = {}
-        
-    for iplot,subset in enumerate(selected_subsets):
-        scal = subset[0]
-        name = subset[1]
-        nums = subset[2:]
 
-        if name not in plots_def:
-            continue
+    subsets_to_fit = [ subset for subset in selected_subsets if subset[1] in plots_def ]
+        
+    for name, lw_ex in extract_subsets( lw, roinums, subsets_to_fit, forms, weights, element, edge):
 
         this_plot_def = plots_def [name]
         
-        nums = [ i for i in range(len(roinums)) if roinums[i] in nums ]        
-        lw_ex = xrs_extraction.edge_extraction( lw,forms,weights,{element:edge})
-        lw_ex.analyzerAverage(nums, errorweighing=False)
-        
         eloss = lw_ex.eloss
 
         
@@ -1030,6 +1152,9 @@ def excepthook(type, value, tracebackobj):
     errmsg = '%s: %s' % (str(type), str(value))
     sections = [separator, errmsg, separator, tbinfo]
     msg = '\n'.join(sections)
+    show_error_message(msg)
+
+def show_error_message(msg):
     msgBox = Qt.QMessageBox(None)
     msgBox.setText("An exception Occurred")
     msgBox.setInformativeText(msg)
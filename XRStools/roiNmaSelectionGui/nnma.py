@@ -41,6 +41,7 @@ except ImportError:
     is_sparse = lambda A: False
 
 import math
+import time
 
 
 __doc__ = """
@@ -66,6 +67,9 @@ This moudule provides the following functions:
     NMF, NMFKL, SNMF, RRI, ALS, GDCLS, GDCLS_L1, FNMAI, FNMAI_SPARSE,
     NNSC and FastHALS
 
+and the streamed engines StreamedHALS and StreamedNMF (see StreamedNNMA),
+which read Y by batches of rows and never form a dense m x n matrix.
+
 The common parameters when calling such a function are:
 
     input:
@@ -88,6 +92,11 @@ The common parameters when calling such a function are:
                              if integer: give all 'verbose' itetations some
                              output about current state of iterations
 
+            callback    --   if given, called after each iteration as
+                             callback(count, obj, delta_obj, seconds) with
+                             seconds the duration of the iteration; the
+                             iterations stop if it returns True
+
     output:
 
             A, X        --   result matrices of algorithm
@@ -433,7 +442,6 @@ def FastHALS_X_update(Y, YT, A, X, **param):
     V = dot(A.T, A)
     k = A.shape[1]
     for i in range(k):
-        print (" i ", i)
         xi = X[i,:]
         xi += W[:,i]-dot(X.T, V[:,i])
         xi[xi<0] = 0
@@ -460,11 +468,22 @@ def FastHALS_A_update(Y, YT, A, X, **param):
 
 class AlgorunnerTemplate(object):
 
-    def frob_dist(self, Y, A, X):
-        """ frobenius distance between Y and A X """
-        return np.linalg.norm(Y - np.dot(A,X))
-
-    def kl_divergence(self, Y, A, X):
+    def frob_dist(self, Y, A, X, nrm_Y2=None):
+        """ frobenius distance between Y and A X
+
+        || Y - A X ||^2 = || Y ||^2 - 2 <A, Y X^T> + <A^T A, X X^T>
+        so that neither A X nor the residual are formed.
+        nrm_Y2 (|| Y ||^2) is computed if not given.
+        """
+        if nrm_Y2 is None:
+            nrm_Y2 = frob_norm(Y)**2
+        YXT = np.asarray(dot(Y, X.T), dtype=np.float64)
+        ATA = np.dot(A.T, A).astype(np.float64)
+        XXT = np.dot(X, X.T).astype(np.float64)
+        d2  = nrm_Y2 - 2*(A*YXT).sum() + (ATA*XXT).sum()
+        return math.sqrt(max(d2, 0.0))
+
+    def kl_divergence(self, Y, A, X, nrm_Y2=None):
         """ kullbach leibler divergence D(Y | A X) """
         AXvec = np.dot(A, X).flatten()
         Yvec = flatten(Y)
@@ -507,8 +526,10 @@ class AlgorunnerTemplate(object):
     param_update = None  # default, may be overidden by method which
                          # adapts parametes from iteration to iteration
 
+    max_restarts = 3   # random restarts after a NaN/inf before giving up
+
     def __call__(self, Y, k, A=None, X=None, eps=1e-5,
-                 maxcount=1000, verbose=False, **param):
+                 maxcount=1000, verbose=False, callback=None, **param):
 
         """ basic template for NNMA iterations """
 
@@ -522,6 +543,7 @@ class AlgorunnerTemplate(object):
         A, X = self.init_factors(Y, k, A, X)
 
         count = 0
+        restarts = 0
         obj_old = 1e99
 
         param = param.copy()
@@ -531,21 +553,24 @@ class AlgorunnerTemplate(object):
         nrm_Y = frob_norm(Y)
 
         while True:
-            print ("count", count)
+            t_start = time.time()
             A, X = self.update(Y, YT, A, X, **param)
 
-            if np.any(np.isnan(A)) or np.any(np.isinf(A)) or \
-               np.any(np.isnan(X)) or np.any(np.isinf(X)):
+            if not (np.all(np.isfinite(A)) and np.all(np.isfinite(X))):
 
+                restarts += 1
+                if restarts > self.max_restarts:
+                    raise FloatingPointError("NNMA diverged: NaN or inf in the factors after %d restarts" % self.max_restarts)
                 if verbose:
                     print("RESTART")
                 A, X = self.init_factors(Y, k)
                 count = 0
-                raise " OK " 
+                obj_old = 1e99
+                continue
  
             count += 1
            # relative distance which is independeant to scaling of A
-            obj = self.dist(Y, A, X) / nrm_Y
+            obj = self.dist(Y, A, X, nrm_Y**2) / nrm_Y
 
             delta_obj = obj-obj_old
             if verbose:
@@ -553,6 +578,9 @@ class AlgorunnerTemplate(object):
                 if count % verbose == 0:
                     print("count=%6d obj=%E d_obj=%E" %(count, obj,
                                                         delta_obj))
+            if callback is not None:
+                if callback(count, obj, delta_obj, time.time()-t_start):
+                    break
 
             if count >= maxcount: break
             # delta_obj should be "almost negative" and small enough:
@@ -658,6 +686,160 @@ class RRI_(AlgorunnerTemplate):
         return A, X
 
 
+#
+# Streamed NNMA: Y is read by batches of rows, the algorithm only keeps
+# A (m x k), X (k x n) and the Gram matrices in memory
+#
+
+class StreamedNNMA(object):
+
+    """
+    NNMA  Y ~ A X  for large Y (e.g. a detector stack, frames x pixels).
+
+    Y may be any object with a shape and row slicing returning arrays
+    (numpy array or memmap, h5py dataset, ...). Each iteration is one pass
+    over Y by batches of batch_size rows:
+
+        - the rows of A belonging to the batch are updated (the update of
+          A is separable over the rows, so this is the exact full update),
+        - A^T Y and A^T A are accumulated,
+
+    then X is updated from A^T Y and A^T A. The objective comes from the
+    same Gram matrices:
+
+        || Y - A X ||^2 = || Y ||^2 - 2 <X, A^T Y> + <A^T A, X X^T>
+
+    so that neither A X nor the residual are ever formed.
+
+    rule is "hals" (FastHALS of Cichocki and Phan) or "mult" (Lee and Seung
+    multiplicative updates).
+
+    Call parameters as for the other algorithms (Y, k, A, X, eps, maxcount,
+    verbose, callback) plus:
+
+            batch_size  --   number of rows of Y per batch (default: all)
+
+            dtype       --   floating point type of A, X and of the
+                             products with Y (e.g. np.float32); the Gram
+                             matrices and the objective are accumulated
+                             in float64
+
+            seed        --   seed for the random start matrices
+    """
+
+    def __init__(self, rule="hals"):
+        if rule not in ("hals", "mult"):
+            raise ValueError("unknown update rule %s" % rule)
+        self.rule = rule
+
+    def batches(self, m, batch_size):
+        if not batch_size:
+            batch_size = m
+        for r0 in range(0, m, batch_size):
+            yield r0, min(r0+batch_size, m)
+
+    def update_A_rows(self, A, YXT, XXT):
+        if self.rule == "hals":
+            for i in range(A.shape[1]):
+                ai = A[:,i] + (YXT[:,i] - np.dot(A, XXT[:,i])) / max(XXT[i,i], 1e-30)
+                ai[ai<0] = 0
+                A[:,i] = ai
+        else:
+            A *= YXT / (1e-9 + np.dot(A, XXT))
+        return A
+
+    def update_X(self, X, ATY, ATA):
+        if self.rule == "hals":
+            for i in range(X.shape[0]):
+                xi = X[i,:] + (ATY[i,:] - np.dot(ATA[i,:], X)) / max(ATA[i,i], 1e-30)
+                xi[xi<0] = 0
+                X[i,:] = xi
+        else:
+            X *= ATY / (1e-9 + np.dot(ATA, X))
+        return X
+
+    def __call__(self, Y, k, A=None, X=None, eps=1e-5, maxcount=1000,
+                 verbose=False, callback=None, batch_size=None,
+                 dtype=np.float64, seed=None):
+
+        m, n = Y.shape
+
+        if k<1 or k>m or k>n:
+            raise ValueError("number k of components is invalid")
+
+        rng = np.random.RandomState(seed)
+        A = rng.rand(m, k).astype(dtype) if A is None else np.array(A, dtype=dtype)
+        X = rng.rand(k, n).astype(dtype) if X is None else np.array(X, dtype=dtype)
+
+        # first pass: || Y ||^2 and the scaling of the start matrices such
+        # that || Y - alpha A X ||_fro is minimized
+        nrm_Y2 = 0.0
+        YAX    = 0.0
+        for r0, r1 in self.batches(m, batch_size):
+            Yb = np.asarray(Y[r0:r1], dtype=dtype)
+            nrm_Y2 += np.einsum("ij,ij->", Yb, Yb, dtype=np.float64)
+            YAX    += np.einsum("ij,ij->", np.dot(Yb, X.T), A[r0:r1], dtype=np.float64)
+        AXAX  = (np.dot(A.T, A).astype(np.float64)*np.dot(X, X.T)).sum()
+        alpha = YAX/AXAX
+        if alpha > 0:
+            A /= math.sqrt(alpha)
+            X /= math.sqrt(alpha)
+        nrm_Y = math.sqrt(nrm_Y2)
+
+        count = 0
+        obj_old = 1e99
+        while True:
+            t_start = time.time()
+
+            XXT = np.dot(X, X.T)
+            ATY = np.zeros((k, n), np.float64)
+            ATA = np.zeros((k, k), np.float64)
+            for r0, r1 in self.batches(m, batch_size):
+                Yb = np.asarray(Y[r0:r1], dtype=dtype)
+                Ab = self.update_A_rows(A[r0:r1], np.dot(Yb, X.T), XXT)
+                A[r0:r1] = Ab
+                ATY += np.dot(Ab.T, Yb)
+                ATA += np.dot(Ab.T, Ab)
+
+            if self.rule == "hals":
+                # unit columns of A, the scale goes to X
+                scale = np.sqrt(np.diag(ATA)) + 1.0e-18
+                A   /= scale.astype(dtype)
+                X   *= scale[:,None].astype(dtype)
+                ATY /= scale[:,None]
+                ATA /= np.outer(scale, scale)
+
+            X = self.update_X(X, ATY.astype(dtype), ATA.astype(dtype))
+
+            if not (np.all(np.isfinite(A)) and np.all(np.isfinite(X))):
+                raise FloatingPointError("NNMA diverged: NaN or inf in the factors at iteration %d" % count)
+
+            count += 1
+            XXT = np.dot(X, X.T).astype(np.float64)
+            d2  = nrm_Y2 - 2*(X*ATY).sum() + (ATA*XXT).sum()
+            obj = math.sqrt(max(d2, 0.0)) / nrm_Y
+
+            delta_obj = obj-obj_old
+            if verbose:
+                if count % verbose == 0:
+                    print("count=%6d obj=%E d_obj=%E" %(count, obj,
+                                                        delta_obj))
+            if callback is not None:
+                if callback(count, obj, delta_obj, time.time()-t_start):
+                    break
+
+            if count >= maxcount: break
+            if -eps < delta_obj <= 1e-12:
+                break
+
+            obj_old = obj
+
+        if verbose:
+            print("FINISHED:")
+            print("count=%6d obj=%E d_obj=%E" %(count, obj, delta_obj))
+
+        return A, X,  obj, count, count < maxcount
+
 #
 # create  algorithms objects
 #
@@ -709,6 +891,11 @@ NNSC = FactorizedNNMA(GradA_step, X_mult_update_nnsc)
 # FastHALS from Cichocki and Phan
 FastHALS = FactorizedNNMA(FastHALS_A_update, FastHALS_X_update)
 
+# streamed versions of FastHALS and of the multiplicative updates, for data
+# which do not fit in memory
+StreamedHALS = StreamedNNMA("hals")
+StreamedNMF  = StreamedNNMA("mult")
+
 if __name__ == "__main__":
 
     # test all routines !
@@ -745,6 +932,18 @@ if __name__ == "__main__":
     run("FastHALS", FastHALS)
     run("SNMF", SNMF)
 
+    def run_batched(name, routine, batch_size, dtype):
+        print("run %12s batch_size=%d %s" % (name, batch_size, np.dtype(dtype).name),)
+        start = time.time()
+        X,Y,obj,count,converged = routine(A, 10, eps=5e-5, maxcount=1000,
+                                          batch_size=batch_size, dtype=dtype)
+        print("obj = %E  count=%5d  converged=%d  TIME=%.2f secs" % \
+                     (obj,count, converged, time.time()-start))
+
+    run_batched("StreamedHALS", StreamedHALS, 7, np.float64)
+    run_batched("StreamedHALS", StreamedHALS, 7, np.float32)
+    run_batched("StreamedNMF", StreamedNMF, 7, np.float64)
+
 
     if has_sparse:
         print("\nTEST WITH SPARSE MATRIX\n")
@@ -117,6 +117,15 @@ def IsMaximum( i,j,slope):
      return 0
   return 1
 
+def LocalMaxima(slope, Nmarge):
+  """ The points [i,j], in row major order, where no neighbour has a larger slope
+  ( the same as IsMaximum ), excluding a border of Nmarge pixels.
+  """
+  maxfits = maximum_filter(slope, size=3)
+  ismax = np.zeros(slope.shape, bool)
+  ismax[Nmarge:-Nmarge, Nmarge:-Nmarge] = np.equal(slope, maxfits)[Nmarge:-Nmarge, Nmarge:-Nmarge]
+  return np.transpose(np.nonzero(ismax)).tolist()
+
 def Canny(Ax,Ay):
   Angles = np.arctan2(    Ax, -Ay )
 
@@ -130,17 +139,7 @@ def Canny(Ax,Ay):
   MaximumRatio=100.0
   
 
-  # maxfits = maximum_filter(slope, size=3)
-  # indici = np.where(slope==maxfits)
-  # ListLocalMaxima=[ [i,j] for i,j in zip(indici[0], indici[1])   ]
-  
-  Ni=Ax.shape[0]
-  Nj=Ax.shape[1]
-  ListLocalMaxima=[]
-  for i in range( Nmarge, Ni-Nmarge):
-   for j in range( Nmarge, Nj-Nmarge):
-     if( IsMaximum( i,j,slope) ):
-        ListLocalMaxima.append( [i,j] )
+  ListLocalMaxima = LocalMaxima(slope, Nmarge)
 
   # print len(ListLocalMaxima)
   # raise
@@ -159,35 +158,43 @@ def Canny(Ax,Ay):
   EdgePoints[-Nmarge:,:]=-1
   EdgePoints[:,-Nmarge:]=-1
   StartPoints = ListLocalMaxima
+
+  # the tracing works point by point : python lists are much faster to index than arrays
+  EdgePoints = EdgePoints.tolist()
+  slope      = slope.tolist()
+  Angles     = Angles.astype(int).tolist()
+  # points visited by the current trace, reset after each trace
+  EdgePointsTmp = np.zeros(Ax.shape  ,bool).tolist()
   
   for starting in StartPoints:
-    EdgePointsTmp = np.zeros(Ax.shape  )  
     s0=starting[0]
     s1=starting[1]
-    pentevalue= slope[s0, s1 ]
-    if(EdgePoints[ s0, s1  ]==0):
+    pentevalue= slope[s0][ s1 ]
+    if(EdgePoints[ s0][ s1  ]==0):
       Edge=[]
       Edge.append( [s0,s1] ) 
+      visited=[]
       prendi=0
       traccia=0
       while(1):        
-        if( slope[s0, s1 ]/pentevalue < 1.0/MaximumRatio):
+        if( pentevalue and slope[s0][ s1 ]/pentevalue < 1.0/MaximumRatio):
           prendi=0
           traccia=1
           break  
-        EdgePointsTmp[ s0, s1  ]=1
-        direction = Angles[s0,s1]
+        EdgePointsTmp[ s0][ s1  ]=1
+        visited.append( (s0,s1) )
+        direction = Angles[s0][s1]
         ss =  [ steps[direction-1],  steps[direction],  steps[direction+1]]
         pttrs = [  [s0+ss[0][0],s1+ss[0][1]], [s0+ss[1][0],s1+ss[1][1]], [s0+ss[2][0],s1+ss[2][1]]  ]
-        values =  [ [slope[ pttrs[i][0], pttrs[i][1]  ],i]  for i in range(3)  ]
+        values =  [ [slope[ pttrs[i][0]][ pttrs[i][1]  ],i]  for i in range(3)  ]
         imax=    max(values)[1]           
         s0=pttrs[imax][0]
         s1=pttrs[imax][1]                
-        if(EdgePoints[ s0, s1  ]):
+        if(EdgePoints[ s0][ s1  ]):
           prendi=0
           traccia=1
           break        
-        if( EdgePointsTmp[ s0, s1  ] ):
+        if( EdgePointsTmp[ s0][ s1  ] ):
           prendi=1
           traccia=1
           Edge.reverse()
@@ -200,12 +207,14 @@ def Canny(Ax,Ay):
           break
         else:
           Edge.append( [s0,s1] ) 
+      for p in visited:
+        EdgePointsTmp[p[0]][p[1]]=0
       if(prendi):
         endpoints.append([s0,s1])
         EdgeList.append(Edge)
       if traccia:
         for p in Edge:
-          EdgePoints[p[0],p[1]]=1
+          EdgePoints[p[0]][p[1]]=1
   
 
   # values =  [ [len(edge),edge]  for edge  in  EdgeList]
@@ -231,17 +240,7 @@ def Canny_lines(Ax,Ay):
   MaximumRatio=10000.0
   
 
-  # maxfits = maximum_filter(slope, size=3)
-  # indici = np.where(slope==maxfits)
-  # ListLocalMaxima=[ [i,j] for i,j in zip(indici[0], indici[1])   ]
-  
-  Ni=Ax.shape[0]
-  Nj=Ax.shape[1]
-  ListLocalMaxima=[]
-  for i in range( Nmarge, Ni-Nmarge):
-   for j in range( Nmarge, Nj-Nmarge):
-     if( IsMaximum( i,j,slope) ):
-        ListLocalMaxima.append( [i,j] )
+  ListLocalMaxima = LocalMaxima(slope, Nmarge)
 
   # print len(ListLocalMaxima)
   # raise
@@ -259,33 +258,38 @@ def Canny_lines(Ax,Ay):
   EdgePoints[-Nmarge:,:]=-1
   EdgePoints[:,-Nmarge:]=-1
   StartPoints = ListLocalMaxima
+
+  # the tracing works point by point : python lists are much faster to index than arrays
+  EdgePoints = EdgePoints.tolist()
+  slope      = slope.tolist()
+  Angles     = Angles.astype(int).tolist()
+  steps      = dict( (k, v.tolist()) for k,v in steps.items() )
+  # points visited by the current trace, reset after each trace
+  EdgePointsTmp = np.zeros(Ax.shape  ,bool).tolist()
   
 
   stack = []
   for starting in StartPoints:
     s0=starting[0]
     s1=starting[1]
-    pentevalue= slope[s0, s1 ]
+    pentevalue= slope[s0][ s1 ]
     stack.append( [  (s0,  s1), pentevalue, 1    ] ) 
   
 
   while len(stack):
-    starting, pentevalue, direction_fact = stack[-1]
-    stack=stack[:-1]
+    starting, pentevalue, direction_fact = stack.pop()
     
-    print( " inizio da ", starting)
-    EdgePointsTmp = np.zeros(Ax.shape  )  
     s0=starting[0]
     s1=starting[1]
-    pentevalue= slope[s0, s1 ]
-    if(EdgePoints[ s0, s1  ]==0):
+    pentevalue= slope[s0][ s1 ]
+    if(EdgePoints[ s0][ s1  ]==0):
       Edge=[]
       Edge.append( [s0,s1] ) 
+      visited=[]
       prendi=0
       traccia=0
       while(1):   
-        print( s0,s1)
-        if( slope[s0, s1 ]/pentevalue < 1.0/MaximumRatio):
+        if( pentevalue and slope[s0][ s1 ]/pentevalue < 1.0/MaximumRatio):
 
           if direction_fact==1  :
             prendi=0
@@ -298,15 +302,16 @@ def Canny_lines(Ax,Ay):
             traccia=1
             print( " troppo debole finisco")
           break  
-        EdgePointsTmp[ s0, s1  ]=1
-        direction = Angles[s0,s1]
-        ss =  np.array([ steps[direction-1],  steps[direction],  steps[direction+1]])*direction_fact
+        EdgePointsTmp[ s0][ s1  ]=1
+        visited.append( (s0,s1) )
+        direction = Angles[s0][s1]
+        ss =  [ [ d*direction_fact for d in steps[direction+k] ] for k in (-1,0,1) ]
         pttrs = [  [s0+ss[0][0],s1+ss[0][1]], [s0+ss[1][0],s1+ss[1][1]], [s0+ss[2][0],s1+ss[2][1]]  ]
-        values =  [ [slope[ pttrs[i][0], pttrs[i][1]  ],i]  for i in range(3)  ]
+        values =  [ [slope[ pttrs[i][0]][ pttrs[i][1]  ],i]  for i in range(3)  ]
         imax=    max(values)[1]           
         s0=pttrs[imax][0]
         s1=pttrs[imax][1]                
-        if(EdgePoints[ s0, s1  ]):
+        if(EdgePoints[ s0][ s1  ]):
           print( " scontro vecchio in ", s0, s1)
           if direction_fact==-1:
             Edge=Edge[:-10]
@@ -314,7 +319,6 @@ def Canny_lines(Ax,Ay):
             traccia=1
             break
           else:
-            EdgePointsTmp[:]=0
             prendi=0
             traccia=0
             if  len(Edge)>10:
@@ -324,7 +328,7 @@ def Canny_lines(Ax,Ay):
 
 
             
-        if( EdgePointsTmp[ s0, s1  ] ):
+        if( EdgePointsTmp[ s0][ s1  ] ):
           print( " scontro nuovo ")
           prendi=1
           traccia=1
@@ -337,14 +341,15 @@ def Canny_lines(Ax,Ay):
           Edge = [[s0,s1]]+newedge
           break
         else:
-          print( " continup ")
           Edge.append( [s0,s1] ) 
+      for p in visited:
+        EdgePointsTmp[p[0]][p[1]]=0
       if(prendi):
         endpoints.append([s0,s1])
         EdgeList.append(Edge)
       if traccia:
         for p in Edge:
-          EdgePoints[p[0],p[1]]=1
+          EdgePoints[p[0]][p[1]]=1
   
 
   # values =  [ [len(edge),edge]  for edge  in  EdgeList]
@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 import shelve
 from matplotlib.path import Path
 from . import xrs_utilities, xrs_rois, xrs_scans, roiSelectionWidget, math_functions 
+from . import xrs_scheduler
 from matplotlib.widgets import Cursor, Button
 from scipy.ndimage import measurements
 from scipy import signal
@@ -739,7 +740,7 @@ class roi_finder:
         self.roi_obj.masks          = xrs_rois.convert_roi_matrix_to_masks(self.roi_obj.roi_matrix)
         self.roi_obj.number_of_rois = int(np.amax(self.roi_obj.roi_matrix))
 
-    def refine_pw_rois(self, roi_obj, pw_data, n_components=2, method='nnma', cov_thresh=-1):
+    def refine_pw_rois(self, roi_obj, pw_data, n_components=2, method='nnma', cov_thresh=-1, component=None, workers=None):
         """**refine_pw_rois**
 
         Use decomposition of pixelwise data for each ROI to find which of the pixels holds
@@ -750,88 +751,15 @@ class roi_finder:
           * pw_data       (list): List containing one 2D numpy array per ROI holding pixel-wise signals.
           * n_components   (int): Number of components in the decomposition.
           * method      (string): Keyword describing which decomposition to be used ('pca', 'ica', 'nnma').
+          * cov_thresh (int or float): Threshold policy, see pw_covariance_cutoff, the user clicks
+            the threshold if negative.
+          * component (int or str): Component resembling the sample spectrum, 'auto' to take the one
+            following best the summed ROI signal, the user clicks it if None.
+          * workers        (int): Number of local processes for the decompositions (see xrs_scheduler).
         """
-        # check if available method is used
-        avail_methods = ['pca','ica','nnma']
-        if not method in avail_methods:
-            print('Please use one of the following methods: ' + str(avail_methods) + '!')
+        if not self._refine_red_rois(roi_obj.red_rois, pw_data, n_components, method, cov_thresh, component, workers):
             return
 
-        # check if scikit learn is available
-        try:
-            from sklearn.decomposition import FastICA, PCA, ProjectedGradientNMF
-        except ImportError:
-            raise ImportError('Please install the scikit-learn package to use this feature.')
-            return
-
-        counter = 0
-        new_rois = {}
-        for data, key in zip(pw_data, sorted(roi_obj.red_rois)): # go through each matrix (one per ROI)
-
-            # decompose data, choose method
-            if method == 'nnma': # non negative matrix factorisation
-                nnm = ProjectedGradientNMF(n_components=n_components)
-                N   = nnm.fit_transform(data)
-            elif method == 'pca': # principal component analysis
-                pca = PCA(n_components=n_components)
-                N = pca.fit_transform(data)
-            elif method == 'ica': # independent component analysis
-                ica = FastICA(n_components=n_components)
-                N = ica.fit_transform(data)
-            else:
-                print('No method: \'' + method + '\' available. Will stop here.' )
-
-            # let user decide which component belongs to the data:
-            user_choise = 0
-            plt.cla()
-            title_txt = 'Click component that resembles the sample spectrum for ROI %02d'%(counter+1) + '.'
-            plt.title(title_txt)
-            legendstr = []
-            for ii in range(n_components):
-                plt.plot(N[:,ii])
-                legendstr.append('Component No. %01d' %ii)
-            plt.legend(legendstr)
-            plt.xlabel('points along scan')
-            plt.ylabel('intensity [arb. units]')
-            user_input = np.array(plt.ginput(1,timeout=-1)[0])
-
-            # which curve was chosen
-            nearest_points = [(np.abs(N[:,ii]-user_input[1])).argmin() for ii in range(n_components)]
-            user_choice = (np.abs(nearest_points-user_input[0])).argmin()
-
-            # find covariance for all pixels with user choice
-            covariance = np.array([])
-            for ii in range(len(data[0,:])):
-                covariance = np.append(covariance, np.cov(data[:,ii],N[:,user_choice])[0,0])
-
-            # plot covariance, let user choose the the cutoff in y direction
-            plt.cla()
-            title_txt = 'Click to define a y-threshold for ROI %02d'%(counter+1) + '.'
-            plt.title(title_txt)
-            plt.plot(covariance,'-o')
-            plt.xlabel('pixels in ROI')
-            plt.ylabel('covariance [arb. units]')
-            if cov_thresh < 0:
-                user_cutoff = np.array(plt.ginput(1,timeout=-1)[0])
-            elif cov_thresh>0 and isinstance(cov_thresh,int):
-                if len(covariance) < cov_thresh:
-                    print('ROI has fewer pixels than cov_thresh, will break here.')
-                    return
-                else:
-                    user_cutoff = np.array([0.0, np.sort(covariance)[-cov_thresh]])
-            else:
-                print('Please provide cov_thresh as positive integer!')
-
-            # find the ROI indices above the cutoff, reassign ROI indices
-            inds = covariance >= user_cutoff[1]
-            #print('inds is ', inds)
-            ravel_roi        = roi_obj.red_rois[key][1].ravel()
-            ravel_roi[~inds] = 0.0
-            roi_obj.red_rois[key][1] = np.reshape(ravel_roi, (roi_obj.red_rois[key][1].shape))
-
-            # end loop
-            counter += 1
-
         # reassign ROI object
         self.roi_obj.roi_matrix     = xrs_rois.convert_redmatrix_to_matrix(roi_obj.red_rois, np.zeros(self.roi_obj.input_image.shape))
         self.roi_obj.indices        = xrs_rois.convert_matrix_rois_to_inds(self.roi_obj.roi_matrix)
@@ -840,9 +768,10 @@ class roi_finder:
         self.roi_obj.y_indices      = xrs_rois.convert_inds_to_yinds(self.roi_obj.indices)
         self.roi_obj.masks          = xrs_rois.convert_roi_matrix_to_masks(self.roi_obj.roi_matrix)
         self.roi_obj.number_of_rois = int(np.amax(self.roi_obj.roi_matrix))
+        self.roi_obj.invalidate_cache()
 
 
-    def refine_rois_MF(self, hydra_obj, scan_numbers, n_components=2, method='nnma', cov_thresh=-1):
+    def refine_rois_MF(self, hydra_obj, scan_numbers, n_components=2, method='nnma', cov_thresh=-1, component=None, workers=None):
         """**refine_rois_MF**
 
         Use decomposition of pixelwise data for each ROI to find which of the pixels holds
@@ -853,22 +782,12 @@ class roi_finder:
           * scan_numbers (int or list): Scan numbers of scans to be used in the refinement.
           * n_components         (int): Number of components in the decomposition.
           * method            (string): Keyword describing which decomposition to be used ('pca', 'ica', 'nnma').
+          * cov_thresh  (int or float): Threshold policy, see pw_covariance_cutoff, the user clicks
+            the threshold if negative.
+          * component     (int or str): Component resembling the sample spectrum, 'auto' to take the one
+            following best the summed ROI signal, the user clicks it if None.
+          * workers              (int): Number of local processes for the decompositions (see xrs_scheduler).
         """
-        # check if available method is used
-        if not method in ['pca','ica','nnma']:
-            print('Please use one of the following methods: ' + str(avail_methods) + '!')
-            return
-
-        # check if scikit learn is available
-        try:
-            from sklearn.decomposition import FastICA, PCA, ProjectedGradientNMF
-        except ImportError:
-            from sklearn.decomposition import FastICA, PCA
-            from sklearn.decomposition import NMF as ProjectedGradientNMF
-        except:
-            raise ImportError('Please install the scikit-learn package to use this feature.')
-            return
-
         # make scan_numbers itarable
         if isinstance(scan_numbers,list):
             scannums = scan_numbers
@@ -879,73 +798,8 @@ class roi_finder:
         hydra_obj.load_scan(scannums, direct=False)
         pw_data = hydra_obj.get_pw_matrices( scannums, method='pixel' )
 
-        counter = 0
-        new_rois = {}
-        for data, key in zip(pw_data, sorted(self.roi_obj.red_rois)): # go through each matrix (one per ROI)
-
-            # decompose data, choose method
-            if method == 'nnma': # non negative matrix factorisation
-                nnm = ProjectedGradientNMF(n_components=n_components)
-                N   = nnm.fit_transform(data)
-            elif method == 'pca': # principal component analysis
-                pca = PCA(n_components=n_components)
-                N = pca.fit_transform(data)
-            elif method == 'ica': # independent component analysis
-                ica = FastICA(n_components=n_components)
-                N = ica.fit_transform(data)
-            else:
-                print('No method: \'' + method + '\' available. Will stop here.' )
-
-            # let user decide which component belongs to the data:
-            user_choise = 0
-            plt.cla()
-            title_txt = 'Click component that resembles the sample spectrum for ROI %02d'%(counter+1) + '.'
-            plt.title(title_txt)
-            legendstr = []
-            for ii in range(n_components):
-                plt.plot(N[:,ii])
-                legendstr.append('Component No. %01d' %ii)
-            plt.legend(legendstr)
-            plt.xlabel('points along scan')
-            plt.ylabel('intensity [arb. units]')
-            user_input = np.array(plt.ginput(1,timeout=-1)[0])
-
-            # which curve was chosen
-            nearest_points = [(np.abs(N[:,ii]-user_input[1])).argmin() for ii in range(n_components)]
-            user_choice = (np.abs(nearest_points-user_input[0])).argmin()
-
-            # find covariance for all pixels with user choice
-            covariance = np.array([])
-            for ii in range(len(data[0,:])):
-                covariance = np.append(covariance, np.cov(data[:,ii],N[:,user_choice])[0,0])
-
-            # plot covariance, let user choose the the cutoff in y direction
-            plt.cla()
-            title_txt = 'Click to define a y-threshold for ROI %02d'%(counter+1) + '.'
-            plt.title(title_txt)
-            plt.plot(covariance,'-o')
-            plt.xlabel('pixels in ROI')
-            plt.ylabel('covariance [arb. units]')
-            if cov_thresh < 0:
-                user_cutoff = np.array(plt.ginput(1,timeout=-1)[0])
-            elif cov_thresh>0 and isinstance(cov_thresh,int):
-                if len(covariance) < cov_thresh:
-                    print('ROI has fewer pixels than cov_thresh, will break here.')
-                    return
-                else:
-                    user_cutoff = np.array([0.0, np.sort(covariance)[-cov_thresh]])
-            else:
-                print('Please provide cov_thresh as positive integer!')
-
-            # find the ROI indices above the cutoff, reassign ROI indices
-            inds = covariance >= user_cutoff[1]
-            #print('inds is ', inds)
-            ravel_roi        = self.roi_obj.red_rois[key][1].ravel()
-            ravel_roi[~inds] = 0.0
-            self.roi_obj.red_rois[key][1] = np.reshape(ravel_roi, (self.roi_obj.red_rois[key][1].shape))
-
-            # end loop
-            counter += 1
+        if not self._refine_red_rois(self.roi_obj.red_rois, pw_data, n_components, method, cov_thresh, component, workers):
+            return
 
         # reassign ROI object
         self.roi_obj.roi_matrix     = xrs_rois.convert_redmatrix_to_matrix(self.roi_obj.red_rois, np.zeros(self.roi_obj.input_image.shape))
@@ -957,6 +811,76 @@ class roi_finder:
         self.roi_obj.number_of_rois = int(np.amax(self.roi_obj.roi_matrix))
         # compact the new red_rois
         self.roi_obj.red_rois       = xrs_rois.convert_matrix_to_redmatrix(self.roi_obj.roi_matrix, labelformat= 'ROI%02d')
+        self.roi_obj.invalidate_cache()
+
+    def _refine_red_rois(self, red_rois, pw_data, n_components, method, cov_thresh, component, workers):
+        """ Common engine of refine_pw_rois and refine_rois_MF : the pixels of each ROI in red_rois
+        whose covariance with the sample component falls below the threshold are removed.
+        Returns False if nothing could be done.
+        """
+        # check if available method is used
+        avail_methods = ['pca','ica','nnma']
+        if not method in avail_methods:
+            print('Please use one of the following methods: ' + str(avail_methods) + '!')
+            return False
+        if cov_thresh >= 0 and not pw_covariance_cutoff_valid(cov_thresh):
+            print('Please provide cov_thresh as positive integer or as a fraction between 0 and 1!')
+            return False
+
+        # all the decompositions first, they are independent from each other
+        pw_data   = list(pw_data)
+        scheduler = xrs_scheduler.TaskScheduler( workers=workers )
+        decompositions = scheduler.bcast( scheduler.map( _decompose_pw_task, pw_data, (n_components, method) ) )
+
+        for counter, (data, N, key) in enumerate(zip(pw_data, decompositions, sorted(red_rois))): # go through each matrix (one per ROI)
+
+            if component is None:
+                # let user decide which component belongs to the data:
+                plt.cla()
+                title_txt = 'Click component that resembles the sample spectrum for ROI %02d'%(counter+1) + '.'
+                plt.title(title_txt)
+                legendstr = []
+                for ii in range(n_components):
+                    plt.plot(N[:,ii])
+                    legendstr.append('Component No. %01d' %ii)
+                plt.legend(legendstr)
+                plt.xlabel('points along scan')
+                plt.ylabel('intensity [arb. units]')
+                user_input = np.array(plt.ginput(1,timeout=-1)[0])
+
+                # which curve was chosen
+                nearest_points = [(np.abs(N[:,ii]-user_input[1])).argmin() for ii in range(n_components)]
+                user_choice = (np.abs(nearest_points-user_input[0])).argmin()
+            elif component == 'auto':
+                user_choice = pw_sample_component(data, N)
+            else:
+                user_choice = component
+
+            # find covariance for all pixels with user choice
+            covariance = pw_covariances(data, N[:,user_choice])
+
+            if cov_thresh < 0:
+                # plot covariance, let user choose the the cutoff in y direction
+                plt.cla()
+                title_txt = 'Click to define a y-threshold for ROI %02d'%(counter+1) + '.'
+                plt.title(title_txt)
+                plt.plot(covariance,'-o')
+                plt.xlabel('pixels in ROI')
+                plt.ylabel('covariance [arb. units]')
+                cutoff = np.array(plt.ginput(1,timeout=-1)[0])[1]
+            else:
+                if isinstance(cov_thresh,int) and len(covariance) < cov_thresh:
+                    print('ROI has fewer pixels than cov_thresh, will break here.')
+                    return False
+                cutoff = pw_covariance_cutoff(covariance, cov_thresh)
+
+            # find the ROI indices above the cutoff, reassign ROI indices
+            inds = covariance >= cutoff
+            ravel_roi        = red_rois[key][1].ravel()
+            ravel_roi[~inds] = 0.0
+            red_rois[key][1] = np.reshape(ravel_roi, (red_rois[key][1].shape))
+
+        return True
 
     def find_pw_rois(self,roi_obj,pw_data,save_dataset=False):
         """
@@ -2897,3 +2821,69 @@ def define_polygon_roi(image_shape,verbose=False):
 
     return roi
 
+
+def decompose_pw_data(data, n_components=2, method='nnma'):
+    """
+    Decomposes the pixel-wise signals of a ROI (one column per pixel) with scikit-learn,
+    method being 'nnma' (non negative matrix factorisation), 'pca' or 'ica'.
+    Returns the components along the scan, one per column.
+    """
+    # check if scikit learn is available
+    try:
+        from sklearn.decomposition import FastICA, PCA
+        try:
+            from sklearn.decomposition import ProjectedGradientNMF
+        except ImportError:
+            from sklearn.decomposition import NMF as ProjectedGradientNMF
+    except ImportError:
+        raise ImportError('Please install the scikit-learn package to use this feature.')
+
+    if method == 'nnma': # non negative matrix factorisation
+        nnm = ProjectedGradientNMF(n_components=n_components)
+        return nnm.fit_transform(data)
+    elif method == 'pca': # principal component analysis
+        pca = PCA(n_components=n_components)
+        return pca.fit_transform(data)
+    elif method == 'ica': # independent component analysis
+        ica = FastICA(n_components=n_components)
+        return ica.fit_transform(data)
+    raise ValueError('No method: \'' + method + '\' available.')
+
+def _decompose_pw_task(context, data):
+    n_components, method = context
+    return decompose_pw_data(data, n_components, method)
+
+def pw_covariances(data, component):
+    """
+    Covariance of the signal of each pixel (columns of data) with component,
+    the same as np.cov(data[:,ii], component)[0,1] for all the pixels at once.
+    """
+    data      = np.asarray(data, dtype=float)
+    component = np.asarray(component, dtype=float)
+    return ( component - component.mean() ).dot( data - data.mean(axis=0) ) / ( len(component) - 1 )
+
+def pw_sample_component(data, N):
+    """
+    Index of the component (column of N) having the largest correlation
+    with the signal summed over all the pixels of the ROI.
+    """
+    total = np.asarray(data, dtype=float).sum(axis=1)
+    total = total - total.mean()
+    dev   = N - N.mean(axis=0)
+    norms = np.sqrt( (dev*dev).sum(axis=0) * total.dot(total) )
+    corr  = total.dot(dev) / np.where(norms > 0, norms, 1.0)
+    return int(np.argmax(corr))
+
+def pw_covariance_cutoff_valid(cov_thresh):
+    return ( isinstance(cov_thresh,int) and cov_thresh > 0 ) or \
+           ( isinstance(cov_thresh,float) and 0.0 < cov_thresh < 1.0 )
+
+def pw_covariance_cutoff(covariance, cov_thresh):
+    """
+    Threshold policy for the non-interactive ROI refinement : a positive integer
+    keeps the cov_thresh pixels with the largest covariance, a float between 0 and 1
+    keeps the pixels whose covariance is at least cov_thresh times the largest one.
+    """
+    if isinstance(cov_thresh,int):
+        return np.sort(covariance)[-cov_thresh]
+    return cov_thresh*np.amax(covariance)
@@ -4,7 +4,9 @@ from __future__ import print_function
 import numpy as np
 import h5py
 import math
+import time
 from six.moves import range
+from . import xrs_scheduler
 myrank=0
 try:
     import skimage.restoration
@@ -126,7 +128,6 @@ def _denoise_tv_chambolle_nd(image, weight=0.1, eps=2.e-4, n_iter_max=200,
 
     ndim = image.ndim
     p = np.zeros((image.ndim, ) + image.shape, dtype=image.dtype)
-    g = np.zeros_like(p)
     d = np.zeros_like(image)
     i = 0
     while i < n_iter_max:
@@ -155,21 +156,26 @@ def _denoise_tv_chambolle_nd(image, weight=0.1, eps=2.e-4, n_iter_max=200,
 
         E = (d ** 2).sum()
 
-        # g stores the gradients of out along each axis
-        # e.g. g[0] is the first order finite difference along axis 0
-        slices_g = [slice(None), ] * (ndim + 1)
+        # the gradients of out along each axis (first order finite differences)
+        # are computed twice instead of being stored, to save memory
+        slices_g = [slice(None), ] * ndim
+        norm = np.zeros_like(out)
         for ax in range(ndim):
-            slices_g[ax+1] = slice(0, -1)
-            slices_g[0] = ax
-            g[tuple(slices_g)] = np.diff(out, axis=ax)
-            slices_g[ax+1] = slice(None)
+            slices_g[ax] = slice(0, -1)
+            norm[tuple(slices_g)] += np.diff(out, axis=ax) ** 2
+            slices_g[ax] = slice(None)
 
-        norm = np.sqrt((g ** 2).sum(axis=0))[np.newaxis, ...]
+        norm = np.sqrt(norm)[np.newaxis, ...]
         E += weight * norm.sum()
         tau = 1. / (2.*ndim)
         norm *= tau / weight
         norm += 1.
-        p -= tau * g
+        slices_p = [slice(None), ] * (ndim + 1)
+        for ax in range(ndim):
+            slices_p[ax+1] = slice(0, -1)
+            slices_p[0] = ax
+            p[tuple(slices_p)] -= tau * np.diff(out, axis=ax)
+            slices_p[ax+1] = slice(None)
         p /= norm
         E /= float(image.size)
         if i == 0:
@@ -183,16 +189,34 @@ def _denoise_tv_chambolle_nd(image, weight=0.1, eps=2.e-4, n_iter_max=200,
         i += 1
     return out
     
-def superr( scalDD, scalDS, scalSS, niter=15, beta=1.0e-8):
+def superr( scalDD, scalDS, scalSS, niter=15, beta=1.0e-8, eps=0.000002, solution=None, tol=None,
+            zslab=None, zoverlap=2, workers=None):
     """ 
     -    scalDS  which is  an array  [ZDIM,YDIM,XDIM]  , type "d" .
     -    scalDD  which is the total sum of the squared datas.
     -    scalSS  which is an array [XDIM,XDIM]  , type "d" .
+    -    solution : optional volume [ZDIM,YDIM,XDIM] to start from (warm start).
+    -    tol : if given, the iterations stop once the relative change of the volume is below tol.
+    -    zslab : if given, the volume is reconstructed in slabs of zslab Z planes
+         which are processed independently (in parallel, see xrs_scheduler.TaskScheduler).
+         The data term is separable in Z, the TV term is not : each slab is extended by
+         zoverlap planes on both sides, which are discarded afterwards.
+    -    workers : number of local processes for the slabs (when not running under MPI).
+
+    Returns the volume (None on the MPI ranks other than the writer, when using slabs).
     """
     ZDIM,YDIM,XDIM = scalDS.shape
-    Volume = np.zeros( [ZDIM,YDIM,XDIM]  ,"f" )
     assert( scalSS.shape == (XDIM,XDIM))
 
+    if solution is None:
+        Volume = np.zeros( [ZDIM,YDIM,XDIM]  ,"f" )
+    else:
+        assert( solution.shape == (ZDIM,YDIM,XDIM))
+        Volume = np.array( solution, "f" )
+
+    Lip = lipschitz( scalSS )
+    if myrank==0:
+        print( "LIP ", Lip)
 
     scalSS = scalSS.astype("f")
     scalDS = scalDS.astype("f")
@@ -200,11 +224,39 @@ def superr( scalDD, scalDS, scalSS, niter=15, beta=1.0e-8):
 
     print( "  SHAPES ", scalDS.shape, scalSS.shape )
 
-    
-    Fista (  scalDD, scalDS, scalSS, Volume,niter=niter, beta=beta)
-    
+    if zslab is None or zslab >= ZDIM:
+        Fista (  scalDD, scalDS, scalSS, Volume,niter=niter, beta=beta, eps=eps, tol=tol, Lip=Lip)
+        return Volume
+
+    slabs = []
+    for z0 in range(0, ZDIM, zslab):
+        z1 = min( z0+zslab, ZDIM )
+        slabs.append( ( z0, z1, max( z0-zoverlap, 0 ), min( z1+zoverlap, ZDIM ) ) )
+
+    scheduler = xrs_scheduler.TaskScheduler( workers=workers )
+    context   = ( scalDS, scalSS, Volume, niter, beta, eps, tol, Lip )
+    results   = scheduler.map( _superr_slab_task, slabs, context )
+    if not scheduler.is_writer():
+        return None
+    for (z0, z1, zlo, zhi), slab_volume in zip( slabs, results ):
+        Volume[z0:z1] = slab_volume
     return Volume
 
+def _superr_slab_task( context, slab ):
+    scalDS, scalSS, Volume, niter, beta, eps, tol, Lip = context
+    z0, z1, zlo, zhi = slab
+    solution = np.array( Volume[zlo:zhi] )
+    # scalDD only shifts the reported error, it is left out for the slabs
+    Fista( 0.0, scalDS[zlo:zhi], scalSS, solution, niter=niter, beta=beta, eps=eps, tol=tol, Lip=Lip,
+           label="slab %d-%d " % (z0, z1) )
+    return solution[z0-zlo:z1-zlo]
+
+def lipschitz( scalSS ):
+    """ Lipschitz constant of the gradient of the data term, i.e. the spectral norm of scalSS
+    (with the same safety margin as the former power iteration estimate).
+    """
+    return np.linalg.norm( np.array( scalSS, "d" ), 2 )*1.2
+
 def calculate_grad( scalDD, scalDS , scalSS,   solution, grad) :
     grad [:]  = np.tensordot(  solution, scalSS, axes=[[-1],[-1]])
     err  = (grad*solution).sum()
@@ -214,56 +266,45 @@ def calculate_grad( scalDD, scalDS , scalSS,   solution, grad) :
         grad [:] -= scalDS
     return err/2
     
-def    Fista( scalDD, scalDS , scalSS,  solution      , niter=500, beta=0.1 ):
-
+def    Fista( scalDD, scalDS , scalSS,  solution      , niter=500, beta=0.1, eps=0.000002, tol=None, Lip=None, label="" ):
 
     grad   = np.zeros_like(solution)
-    grad2  = np.zeros_like(solution)
     x_old  = np.zeros_like(solution)
     y      = np.zeros_like(solution)
 
-    err = 0.0
-    err=calculate_grad( scalDD, scalDS , scalSS,   solution, grad) 
-    for i in range(20):
-        
-        calculate_grad(None, None , scalSS,   grad, grad2)
-        Lip = math.sqrt( np.linalg.norm(grad2/100000.0)   )*100000
-        grad[:]  = grad2/ Lip
-        if myrank==0:
-            print( "LIP ", Lip)
-    Lip = Lip*1.2
+    if Lip is None:
+        Lip = lipschitz( scalSS )
 
     t=1.0
     y[:] = solution
     x_old[:] = solution
     for iter in range(abs(niter)):
+        t_start = time.time()
         err = calculate_grad(scalDD, scalDS , scalSS,   y, grad) 
+        grad_std = grad.std()
 
         solution[:] =  y - grad/Lip
         
         # solution[:]=skimage.restoration.denoise_tv_chambolle(solution, weight=beta, eps=0.000002) 
-        solution[:]=_denoise_tv_chambolle_nd(solution, weight=beta, eps=0.000002, positivity=True)
+        solution[:]=_denoise_tv_chambolle_nd(solution, weight=beta, eps=eps, positivity=True)
 
 
         ## solution[:] = np.maximum(solution, 0)
 
         tnew = ( 1+math.sqrt(1.0+4*t*t) )/2
 
-
-        y[:] = solution +(t-1)/tnew *( solution - x_old )
+        # grad is reused to store the step
+        np.subtract( solution, x_old, out=grad )
+        y[:] = solution +(t-1)/tnew * grad
         t = tnew
         if niter<0:
             t=1
         x_old[:] = solution
-        if myrank==0:
-            print( " errore est %e  mod_grad est  %e\n" % (  err, grad.std()) )
-
-
-
-
-
-
-
-
-
 
+        change = np.linalg.norm( grad ) / max( np.linalg.norm( solution ), np.finfo( solution.dtype ).tiny )
+        if myrank==0:
+            print( " %serrore est %e  mod_grad est  %e  change %e  time %.3f s\n" % ( label, err, grad_std, change, time.time()-t_start ) )
+        if tol is not None and change < tol:
+            if myrank==0:
+                print( " %sconverged after %d iterations" % ( label, iter+1 ) )
+            break
@@ -39,17 +39,25 @@ __contact__ = "christoph.sahle@esrf.fr"
 __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 
+import os
+import hashlib
 import numpy as np
 from . import xrs_utilities
 from . import xrs_fileIO
 
 from scipy import interpolate, integrate, constants, optimize
 from re import findall
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 # default valence energy cutoff value 
 VAL_CUTOFF_DEFAULT = 20.0
 
+# number of energy loss profiles kept in memory (see elossProfile)
+ELOSS_PROFILE_MEMO_SIZE = 1024
+
+# number of multi-angle energy loss profiles kept in memory (see elossProfiles), these are large
+ELOSS_PROFILES_MEMO_SIZE = 8
+
 
 def list_duplicates(seq):
     tally = defaultdict(list)
@@ -194,34 +202,18 @@ class AtomProfile:
             print('Unsupported type for twotheta argument')
             return
 
-        # do the conversion for the first tth to get the size/shape of things
-        enScale, J_total, C_total, V_total, q, J_shell, C_shell, V_shell = elossProfile(self.element,self.filename,E0,self.twotheta[0],correctasym,valence_cutoff)
-        # save eloss scale
-        self.eloss     = enScale
+        # convert everything to eloss scale (all angles at once, on the eloss scale of the first angle)
+        enScale, J_total, C_total, V_total, q, J_shell, C_shell, V_shell = elossProfiles(self.element,self.filename,E0,self.twotheta,correctasym,valence_cutoff)
 
-        # prepare output
-        self.C_total = np.zeros((len(enScale),len(self.twotheta)))
-        self.J_total = np.zeros((len(enScale),len(self.twotheta)))
-        self.V_total = np.zeros((len(enScale),len(self.twotheta)))
-        self.q_vals  = np.zeros((len(enScale),len(self.twotheta)))
-        for key in C_shell:
-            self.CperShell[key] = np.zeros((len(enScale),len(self.twotheta)))
-            self.JperShell[key] = np.zeros((len(enScale),len(self.twotheta)))
-            self.VperShell[key] = np.zeros((len(enScale),len(self.twotheta)))
-            
-        # convert everything to eloss scale
-        for tth,ii in zip(self.twotheta,list(range(len(self.twotheta)))):
-            enScale, J_total, C_total, V_total, q, J_shell, C_shell, V_shell = elossProfile(self.element,self.filename,E0,tth,correctasym,valence_cutoff)
-        
-            # save the results (all shell dicts have the same keys)
-            self.C_total[:,ii] = np.interp(self.eloss,enScale,C_total)*self.stoichiometry
-            self.J_total[:,ii] = np.interp(self.eloss,enScale,J_total)*self.stoichiometry
-            self.V_total[:,ii] = np.interp(self.eloss,enScale,V_total)*self.stoichiometry
-            self.q_vals[:,ii]  = np.interp(self.eloss,enScale,q)
-            for key in self.CperShell:
-                self.CperShell[key][:,ii] = np.interp(self.eloss,enScale,C_shell[key])
-                self.JperShell[key][:,ii] = np.interp(self.eloss,enScale,C_shell[key])
-                self.VperShell[key][:,ii] = np.interp(self.eloss,enScale,C_shell[key])
+        # save the results
+        self.eloss     = enScale
+        self.C_total   = C_total*self.stoichiometry
+        self.J_total   = J_total*self.stoichiometry
+        self.V_total   = V_total*self.stoichiometry
+        self.q_vals    = q
+        self.CperShell = C_shell
+        self.JperShell = J_shell
+        self.VperShell = V_shell
 
     def absorptionCorrectProfiles(self, alpha, thickness, geometry='transmission'):
         """
@@ -367,7 +359,7 @@ class FormulaProfile:
 
         # reset self.twotheta
         self.twotheta = []
-        if isinstance(twotheta, list):
+        if isinstance(twotheta, list) or isinstance(twotheta, np.ndarray):
             self.twotheta.extend(twotheta)
         elif isinstance(twotheta, float):
             self.twotheta.append(twotheta)
@@ -388,11 +380,10 @@ class FormulaProfile:
         # add up all AtomProfiles
         for key in self.AtomProfiles:
             AP = self.AtomProfiles[key]
-            for ii in range(len(self.twotheta)):
-                self.C_total[:,ii] += np.interp(self.eloss,AP.eloss,AP.C_total[:,ii])*AP.get_stoichiometry()
-                self.J_total[:,ii] += np.interp(self.eloss,AP.eloss,AP.J_total[:,ii])*AP.get_stoichiometry()
-                self.V_total[:,ii] += np.interp(self.eloss,AP.eloss,AP.V_total[:,ii])*AP.get_stoichiometry()
-                self.q_vals[:,ii]  = np.interp(self.eloss,AP.eloss,AP.q_vals[:,ii])
+            self.C_total += xrs_utilities.interp_columns(self.eloss,AP.eloss,AP.C_total)*AP.get_stoichiometry()
+            self.J_total += xrs_utilities.interp_columns(self.eloss,AP.eloss,AP.J_total)*AP.get_stoichiometry()
+            self.V_total += xrs_utilities.interp_columns(self.eloss,AP.eloss,AP.V_total)*AP.get_stoichiometry()
+            self.q_vals   = xrs_utilities.interp_columns(self.eloss,AP.eloss,AP.q_vals)
  
     def get_correctecProfiles(self, densities, alpha, beta, samthick ):
         pass
@@ -442,7 +433,7 @@ class HFProfile:
 
         # reset self.twotheta
         self.twotheta = []
-        if isinstance(twotheta, list):
+        if isinstance(twotheta, list) or isinstance(twotheta, np.ndarray):
             self.twotheta.extend(twotheta)
         elif isinstance(twotheta, float):
             self.twotheta.append(twotheta)
@@ -465,11 +456,10 @@ class HFProfile:
         # add up all Compton Profiles from the sub-units
         for key,jj in zip(self.FormulaProfiles,list(range(len(self.twotheta)))):
             FP = self.FormulaProfiles[key]
-            for ii in range(len(self.twotheta)):
-                self.C_total[:,ii] += np.interp(self.eloss,FP.eloss,FP.C_total[:,ii])*FP.get_stoichWeight()
-                self.J_total[:,ii] += np.interp(self.eloss,FP.eloss,FP.J_total[:,ii])*FP.get_stoichWeight()
-                self.V_total[:,ii] += np.interp(self.eloss,FP.eloss,FP.V_total[:,ii])*FP.get_stoichWeight()
-                self.q_vals[:,ii] = np.interp(self.eloss,FP.eloss,FP.q_vals[:,ii])
+            self.C_total += xrs_utilities.interp_columns(self.eloss,FP.eloss,FP.C_total)*FP.get_stoichWeight()
+            self.J_total += xrs_utilities.interp_columns(self.eloss,FP.eloss,FP.J_total)*FP.get_stoichWeight()
+            self.V_total += xrs_utilities.interp_columns(self.eloss,FP.eloss,FP.V_total)*FP.get_stoichWeight()
+            self.q_vals   = xrs_utilities.interp_columns(self.eloss,FP.eloss,FP.q_vals)
 
 
 class ComptonProfiles:
@@ -517,7 +507,8 @@ def PzProfile(element,filename):
 
     Reads in tabulated HF Compton profiles from the Biggs paper,
     interpolates them, and normalizes them to the # of electrons 
-    in the shell.
+    in the shell. The interpolated profiles are computed once per element
+    and kept in the compiled Biggs database (see xrs_fileIO.BiggsDatabase).
 
     Args:
         * element (string):  element symbol (e.g. 'Si', 'Al', etc.)
@@ -531,6 +522,21 @@ def PzProfile(element,filename):
       * occupation_num (list): number of electrons in the according shells
 
     """
+    database = xrs_fileIO.get_biggs_database(filename)
+    profile  = database.get_profile(element)
+    if profile is None:
+        CP_profile, binding_energies, occupation_num, shell_names = _interpolatePzProfile(element,filename)
+        database.put_profile(element, CP_profile, {'binding_energies':binding_energies, \
+                             'occupation_num':occupation_num, 'shell_names':shell_names})
+        profile = database.get_profile(element)
+
+    # return copies, the profiles are modified by the callers
+    CP_profile, lists = profile
+    binding_energies  = [float(energy) for energy in lists['binding_energies']]
+    occupation_num    = [float(value) for value in lists['occupation_num']]
+    return CP_profile.copy(), binding_energies, occupation_num, list(lists['shell_names'])
+
+def _interpolatePzProfile(element,filename):
     # load Biggs data, mirror at pz = 0.0
     CP_tab, occupation_num, binding_energies, shell_names = xrs_fileIO.readbiggsdata(filename,element)
     pz_tab = np.append(-1.0*np.flipud(CP_tab[1::,0]),CP_tab[:,0])
@@ -560,6 +566,12 @@ def PzProfile(element,filename):
 
     return CP_profile, binding_energies, occupation_num, shell_names
 
+_eloss_profile_memo  = OrderedDict()
+_eloss_profiles_memo = OrderedDict()
+_eloss_scale_memo    = OrderedDict()
+_pz2e1_spline_memo   = OrderedDict()
+_hr_terms_memo       = {}
+
 def elossProfile(element,filename,E0,tth,correctasym=None,valence_cutoff=20.0):
     """Returns HF Compton profiles on energy loss scale.
 
@@ -567,6 +579,7 @@ def elossProfile(element,filename,E0,tth,correctasym=None,valence_cutoff=20.0):
     and converts them onto energy loss scale. The profiles are cut
     at the respective electron binding energies and are normalized
     to the f-sum rule (i.e. S(q,w) is in units of [1/eV]).
+    The last ELOSS_PROFILE_MEMO_SIZE results are kept in memory.
 
     Args:
       * element (string): element symbol.
@@ -587,20 +600,71 @@ def elossProfile(element,filename,E0,tth,correctasym=None,valence_cutoff=20.0):
       * V_shell (dict of np.arrays): same as J_shell for valence contribution
 
     """
+    key = (os.path.abspath(filename), element, float(E0), float(tth), _asym_key(correctasym), float(valence_cutoff))
+    result = _memo_get(_eloss_profile_memo, key, lambda: _elossProfile(element,filename,E0,tth,correctasym,valence_cutoff))
+
+    # return copies, so that the memo cannot be altered by the caller
+    enScale, J_total, C_total, V_total, q, J_shell, C_shell, V_shell = result
+    return enScale.copy(), J_total.copy(), C_total.copy(), V_total.copy(), q.copy(), \
+           dict( (name, J_shell[name].copy()) for name in J_shell ), \
+           dict( (name, C_shell[name].copy()) for name in C_shell ), \
+           dict( (name, V_shell[name].copy()) for name in V_shell )
+
+def _asym_key(correctasym):
+    if correctasym is None:
+        return None
+    return tuple(np.ravel(correctasym).tolist())
+
+def _memo_get(memo, key, compute, size=ELOSS_PROFILE_MEMO_SIZE):
+    # least recently used memo of at most size entries
+    if key in memo:
+        result = memo.pop(key)
+    else:
+        result = compute()
+        while len(memo) >= size:
+            memo.popitem(last=False)
+    memo[key] = result
+    return result
+
+def _pz2e1_spline(E0,tth):
+    # the pz -> incident energy spline only depends on E0 and tth, not on the element
+    return _memo_get(_pz2e1_spline_memo, (float(E0), float(tth)), lambda: xrs_utilities.pz2e1_spline(E0,tth))
+
+def _pz2eloss(E0,twotheta,pz):
+    # energy loss scales (one row per scattering angle), most elements share the same pz scale
+    def compute():
+        enScale = np.zeros((len(twotheta),len(pz)))
+        for ii in range(len(twotheta)):
+            enScale[ii] = (np.flipud(_pz2e1_spline(E0,twotheta[ii])(pz))-E0)*1.0e3
+        return enScale
+    key = (float(E0), tuple(twotheta.tolist()), hashlib.sha1(np.ascontiguousarray(pz)).hexdigest())
+    return _memo_get(_eloss_scale_memo, key, compute, ELOSS_PROFILES_MEMO_SIZE)
+
+def _HRterms(element,filename,CP_profile,occupation_num):
+    # the q independent terms of the HR correction are computed once per element
+    key = (os.path.abspath(filename), element)
+    if key not in _hr_terms_memo:
+        _hr_terms_memo[key] = HRterms(CP_profile, occupation_num)
+    else:
+        HRterms_merge2p(CP_profile, occupation_num)
+    return _hr_terms_memo[key]
+
+def _elossProfile(element,filename,E0,tth,correctasym=None,valence_cutoff=20.0):
     # read in the Biggs data
     CP_profile, binding_energies, occupation_num, shell_names = PzProfile(element,filename)
 
     # convert pz to energy loss scale
-    enScale = ((np.flipud(xrs_utilities.pz2e1(E0,CP_profile[:,0],tth))-E0)*1.0e3)
+    enScale = ((np.flipud(_pz2e1_spline(E0,tth)(CP_profile[:,0]))-E0)*1.0e3)
 
     # define the momentum transfer
     q = xrs_utilities.momtrans_au(enScale/1000.0 + E0, E0, tth)
 
     # calculate asymmetry after Holm and Ribberfors for filles 1s and 2p shells
     # if correctasym == True
-    asymmetry = np.flipud(HRcorrect(CP_profile, occupation_num, q))
-    if correctasym:
-        CP_profile[:,1:4] = CP_profile[:1:4] + asymmetry * correctasym
+    asymmetry = np.flipud(HRasymmetry(_HRterms(element,filename,CP_profile,occupation_num), q))
+    if correctasym is not None:
+        ncolumns = asymmetry.shape[1]
+        CP_profile[:,1:ncolumns+1] = CP_profile[:,1:ncolumns+1] + asymmetry * _asym_factors(correctasym,ncolumns)
 
     # discard profiles, q, and enScale for energy losses smaller than zero
     HF_profile = CP_profile[np.nonzero(enScale.T>=0.0)[0],:]
@@ -655,6 +719,150 @@ def elossProfile(element,filename,E0,tth,correctasym=None,valence_cutoff=20.0):
 
     return enScale, J_total, C_total, V_total, q, J_shell, C_shell, V_shell
 
+def _asym_factors(correctasym,ncolumns):
+    # one scaling factor per corrected shell (1s, 2s, 2p)
+    factors = np.ravel(np.array(correctasym,dtype=float))
+    if len(factors) == 1:
+        return np.repeat(factors,ncolumns)
+    return factors[:ncolumns]
+
+def elossProfiles(element,filename,E0,twotheta,correctasym=None,valence_cutoff=20.0):
+    """Returns HF Compton profiles on energy loss scale for several scattering angles.
+
+    Same as elossProfile, but all scattering angles are treated at once: the
+    profiles are computed as 2D arrays (one column per scattering angle) and
+    resampled in one go onto the energy loss scale of the first angle.
+
+    Args:
+      * element (string): element symbol.
+      * filename (string): absolute path and filename to tabulated Compton profiles.
+      * E0 (float): analyzer energy in [keV].
+      * twotheta (list or np.array): scattering angles two theta in [deg].
+      * correctasym (np.array): vector of scaling factors to be applied.
+      * valence_cutoff (float): energy value below which edges are considered as valence
+
+    Returns:
+      * enScale (np.array): energy loss scale in [eV] (of the first scattering angle)
+      * J_total (np.array): total S(q,w) in [1/eV] (len(enScale) x len(twotheta))
+      * C_total (np.array): core contribution to S(q,w) in [1/eV]
+      * V_total (np.array): valence contribution to S(q,w) in [1/eV], the valence is defined by valence_cutoff
+      * q (np.array): momentum transfer in [a.u]
+      * J_shell (dict of np.arrays): dictionary of contributions for each shell, the key are defines as in Biggs table.
+      * C_shell (dict of np.arrays): same as J_shell for core contribution
+      * V_shell (dict of np.arrays): same as J_shell for valence contribution
+
+    """
+    twotheta = np.ravel(np.array(twotheta,dtype=float))
+    key = (os.path.abspath(filename), element, float(E0), tuple(twotheta.tolist()), _asym_key(correctasym), float(valence_cutoff))
+    result = _memo_get(_eloss_profiles_memo, key, lambda: _elossProfiles(element,filename,E0,twotheta,correctasym,valence_cutoff), \
+                       ELOSS_PROFILES_MEMO_SIZE)
+
+    # return copies, so that the memo cannot be altered by the caller
+    enScale, J_total, C_total, V_total, q, J_shell, C_shell, V_shell = result
+    return enScale.copy(), J_total.copy(), C_total.copy(), V_total.copy(), q.copy(), \
+           dict( (name, J_shell[name].copy()) for name in J_shell ), \
+           dict( (name, C_shell[name].copy()) for name in C_shell ), \
+           dict( (name, V_shell[name].copy()) for name in V_shell )
+
+def _elossProfiles(element,filename,E0,twotheta,correctasym=None,valence_cutoff=20.0):
+    ntth = len(twotheta)
+
+    # read in the Biggs data
+    CP_profile, binding_energies, occupation_num, shell_names = PzProfile(element,filename)
+
+    # convert pz to energy loss scale (internally one row per scattering angle)
+    enScale = _pz2eloss(E0,twotheta,CP_profile[:,0])
+
+    # define the momentum transfer
+    q = xrs_utilities.momtrans_au(enScale/1000.0 + E0, E0, twotheta[:,None])
+
+    # asymmetry after Holm and Ribberfors for filled 1s, 2s and 2p shells
+    terms = _HRterms(element,filename,CP_profile,occupation_num)
+    asymmetry = {}
+    if correctasym is not None:
+        factors = _asym_factors(correctasym,terms[0])
+        for column, j1, j0 in terms[2]:
+            asymmetry[column] = np.fliplr(j1/q*j0) * factors[column]
+
+    # only energy losses >= 0 are kept (a contiguous range of each angle),
+    # points without energy loss >= 0 for any angle are dropped right away
+    valid = enScale >= 0.0
+    start = np.min(np.argmax(valid,axis=1))
+    valid, enScale, q, CP_profile = valid[:,start:], enScale[:,start:], q[:,start:], CP_profile[start:]
+    for column in asymmetry:
+        asymmetry[column] = asymmetry[column][:,start:]
+    first    = np.argmax(valid,axis=1)
+    last     = enScale.shape[1] - np.argmax(valid[:,::-1],axis=1)
+    segments = valid[:,1:] & valid[:,:-1]
+    enMax    = enScale[np.arange(ntth),last-1]
+
+    # convert J(pz) to S(q,w) via J(pz)=N_electrons*hartree*q*S(q,w) and
+    # normalize using the f-sum rule (sum(S(q,w)*w)=f)
+    hartree  = 1.0/constants.physical_constants['electron volt-hartree relationship'][0]
+    enScaleH = enScale/hartree # eloss in a.u.
+    dH       = np.diff(enScaleH,axis=1)/2.0
+    q2       = (q**2.0)/2.0
+
+    J_total = np.zeros(enScale.shape)
+    V_total = np.zeros(enScale.shape)
+    shells  = []
+    names   = [name for name in shell_names if 'Shell' in name]
+    for n in range(len(binding_energies)):
+        # discard profiles for energy losses below according binding energies
+        above = valid & (enScale >= binding_energies[n])
+        if n in asymmetry:
+            profile = np.where(above, CP_profile[:,n+1] + asymmetry[n], 0.0)
+        else:
+            profile = np.where(above, CP_profile[:,n+1], 0.0)
+
+        # normalize to one then multiply by N_el*q**2.0/2.0
+        weighted = profile*enScaleH
+        with np.errstate(divide='ignore', invalid='ignore'):
+            norm = np.sum(np.where(segments, dH*(weighted[:,1:]+weighted[:,:-1]), 0.0),axis=1)
+            profile *= q2
+            profile *= (occupation_num[n]/norm)[:,None]
+
+        # sum up (only shells with edges within the energy loss range)
+        profile[binding_energies[n] >= enMax] = 0.0
+        J_total += profile
+        valence = binding_energies[n] < valence_cutoff
+        if valence:
+            V_total += profile
+        if n < len(names):
+            shells.append((names[n], profile, valence))
+
+    # convert back to [1/eV]
+    J_total /= hartree
+    V_total /= hartree
+
+    # resample all quantities of each angle at once onto the energy loss scale of the first angle
+    eloss  = enScale[0,first[0]:last[0]]
+    result = np.zeros((4+3*len(shells),ntth,len(eloss)))
+    for ii in range(ntth):
+        rows    = slice(first[ii],last[ii])
+        columns = np.zeros((last[ii]-first[ii],4+3*len(shells)))
+        columns[:,0] = J_total[ii,rows]
+        columns[:,1] = J_total[ii,rows]-V_total[ii,rows]
+        columns[:,2] = V_total[ii,rows]
+        columns[:,3] = q[ii,rows]
+        for jj, (name, profile, valence) in enumerate(shells):
+            columns[:,4+3*jj] = profile[ii,rows]
+            if valence:
+                columns[:,6+3*jj] = profile[ii,rows]
+            else:
+                columns[:,5+3*jj] = profile[ii,rows]
+        result[:,ii,:] = xrs_utilities.interp_columns(eloss,enScale[ii,rows],columns).T
+
+    # back to one column per scattering angle
+    result = [quantity.T for quantity in result]
+    J_total, C_total, V_total, q = result[0], result[1], result[2], result[3]
+    J_shell, C_shell, V_shell = {}, {}, {}
+    for jj, (name, profile, valence) in enumerate(shells):
+        J_shell[name] = result[4+3*jj]
+        C_shell[name] = result[5+3*jj]
+        V_shell[name] = result[6+3*jj]
+    return eloss, J_total, C_total, V_total, q, J_shell, C_shell, V_shell
+
 
 def mapShellNames(shell_str,atomicNumber):
     """
@@ -730,18 +938,42 @@ def HRcorrect(pzprofile,occupation,q):
     Returns:
        * asymmetry (np.array):  asymmetries to be added to the raw profiles (normalized to the number of electrons on pz scale)
     """
-    # prepare output matrix
-    if len(occupation) == 1:
-        asymmetry = np.zeros((len(pzprofile[:,0]),1))
-    elif len(occupation) == 2:
-        asymmetry = np.zeros((len(pzprofile[:,0]),2))
-    elif len(occupation) >= 3:
-        asymmetry = np.zeros((len(pzprofile[:,0]),3))
+    return HRasymmetry(HRterms(pzprofile,occupation),q)
+
+def HRasymmetry(terms,q):
+    """ Returns the Holm and Ribberfors asymmetries for momentum transfer q
+    from the q independent terms returned by HRterms.
+    """
+    ncolumns, length, shell_terms = terms
+    asymmetry = np.zeros((length,ncolumns))
+    for column, j1, j0 in shell_terms:
+        asymmetry[:,column] = j1/q*j0
+    return asymmetry
 
+def HRterms_merge2p(pzprofile,occupation):
+    """ Merges spin-orbit split 2p profiles (in place) as needed for the Holm and Ribberfors correction. """
     # take care for the cases where 2p levels have spin-orbit split taken into account in the Biggs table
     if len(occupation)>3 and occupation[2]==2 and occupation[3]==4:
         pzprofile[:,3] = pzprofile[:,3] + pzprofile[:,4]
         occupation[2] = 6
+
+def HRterms(pzprofile,occupation):
+    """ Returns the q independent parts of the Holm and Ribberfors correction
+    (see HRcorrect): the number of columns of the asymmetry matrix, its length and a
+    list of (column, j1*q, j0) for the filled 1s, 2s, and 2p shells. The fits of the
+    gamma values are the expensive part, so the result can be reused for all q.
+    As HRcorrect, it merges spin-orbit split 2p profiles in pzprofile and occupation.
+    """
+    # prepare output matrix
+    if len(occupation) == 1:
+        ncolumns = 1
+    elif len(occupation) == 2:
+        ncolumns = 2
+    elif len(occupation) >= 3:
+        ncolumns = 3
+    shell_terms = []
+
+    HRterms_merge2p(pzprofile,occupation)
     
     # 1s 
     if occupation[0] < 2:
@@ -754,8 +986,7 @@ def HRcorrect(pzprofile,occupation,q):
         # calculate j0 and j1
         j0 = occupation[0]*8.0*gamma1s**5.0/3.0/np.pi/((gamma1s**2.0+pzprofile[:,0]**2.0)**3.0)
         j1 = 2.0*gamma1s*np.arctan2(pzprofile[:,0],gamma1s)-3.0/2.0*pzprofile[:,0] 
-        j1 = j1/q*j0
-        asymmetry[:,0] = j1
+        shell_terms.append((0,j1,j0))
     # 2s
     if len(occupation)>1:
         if occupation[1] < 2:
@@ -768,8 +999,7 @@ def HRcorrect(pzprofile,occupation,q):
             # calculate j0 and j1
             j0 = occupation[1]*(gamma2s**4.0-10.0*gamma2s**2.0*pzprofile[:,0]**2.0+40.0*pzprofile[:,0]**4.0)*128.0*gamma2s**5.0/15.0/np.pi/(gamma2s**2.0 + 4.0*pzprofile[:,0]**2.0)**5.0
             j1 = 2.0*gamma2s*np.arctan2(2.0*pzprofile[:,0],gamma2s)-5.0/4.0*(gamma2s**4.0+48.0*pzprofile[:,0]**4.0)/(gamma2s**4.0-10.0*gamma2s**2.0*pzprofile[:,0]**2.0+40.0*pzprofile[:,0]**4.0)*pzprofile[:,0] 
-            j1 = j1/q*j0
-            asymmetry[:,1] = j1
+            shell_terms.append((1,j1,j0))
     # 2p
     if len(occupation)>2:
         if occupation[2] < 6:
@@ -783,9 +1013,8 @@ def HRcorrect(pzprofile,occupation,q):
             # calculate j0 and j1
             j0 = 2.0*(gamma2p**2.0+20.0*pzprofile[:,0]**2.0)*64.0*gamma2p**7.0/5.0/np.pi/(gamma2p**2.0+4.0*pzprofile[:,0]**2.0)**5.0
             j1 = 2.0*gamma2p*np.arctan2(2.0*pzprofile[:,0],gamma2p)-2.0/3.0*pzprofile[:,0]*(10.0*gamma2p**2.0+60.0*pzprofile[:,0]**2.0)/(gamma2p**2.0+20.0*pzprofile[:,0]**2.0)
-            j1 = j1/q*j0
-            asymmetry[:,2] = j1
-    return asymmetry
+            shell_terms.append((2,j1,j0))
+    return ncolumns, len(pzprofile[:,0]), shell_terms
 
 
 
@@ -12,10 +12,12 @@ from copy import deepcopy
 import numpy as np
 import array as arr
 
+import itertools
 from itertools import groupby
 from scipy.integrate import trapz
 from scipy.interpolate import interp1d
 from scipy import constants
+from scipy.spatial import cKDTree
 
 import sys
 
@@ -1077,15 +1079,13 @@ class xyzBox:
                       * counter_name  (str): Attribute namer under which  the result should be saved.
 
             """
-            for atom in self.xyzAtoms:
-                    if atom.name == name1:
-                            cou = 0
-                            atoms_2 = self.get_atoms_by_name(name2)
-                            for atom_2 in atoms_2:
-                                    dist = getDistancePBC_arb( atom, atom_2, self.lattice, self.lattice_inv )
-                                    if dist >= cutoff_low and dist <= cutoff_high:
-                                            cou += 1
-                            setattr(atom, counter_name, cou)
+            atoms_1 = self.get_atoms_by_name(name1)
+            atoms_2 = self.get_atoms_by_name(name2)
+            ii, jj, dists = find_neighbor_pairs( _atom_coordinates(atoms_1), _atom_coordinates(atoms_2), cutoff_high,
+                                                 lattice=self.lattice, lattice_inv=self.lattice_inv )
+            counts = np.bincount( ii[dists >= cutoff_low], minlength=len(atoms_1) )
+            for atom, cou in zip(atoms_1, counts):
+                    setattr(atom, counter_name, int(cou))
 
     def count_hbonds( self, Roocut=3.6, Rohcut=2.4, Aoooh=30.0, counter_name='num_H_bonds', counter_name2='H_bond_angles'):
             """ **count_hbonds**
@@ -1097,15 +1097,22 @@ class xyzBox:
             h_atoms  = self.get_atoms_by_name('H')
             h2o_mols = find_H2O_molecules_PBC_arb( o_atoms, h_atoms, self.lattice, self.lattice_inv )
 
-            for mol1 in h2o_mols:
+            # only molecules with their oxygens closer than Roocut can be H-bonded,
+            # count_HBonds_pbc_arb returns (0, 0, 0) for all the others
+            mol_o_coords = _atom_coordinates( [ mol.get_atoms_by_name('O')[0] for mol in h2o_mols ] )
+            ii, jj, dists = find_neighbor_pairs( mol_o_coords, mol_o_coords, Roocut*(1.0+1.0e-9),
+                                                 lattice=self.lattice, lattice_inv=self.lattice_inv )
+            bounds = _group_pairs( ii, len(h2o_mols) )
+
+            for imol, mol1 in enumerate(h2o_mols):
                     don = 0
                     acc = 0
-                    angles = []
-                    for mol2 in h2o_mols:
-                            d, a, ang = count_HBonds_pbc_arb( mol1, mol2, self.lattice, self.lattice_inv, Roocut=Roocut, Rohcut=Rohcut, Aoooh=Aoooh )
+                    angles = [0]*len(h2o_mols)
+                    for jmol in jj[bounds[imol]:bounds[imol+1]]:
+                            d, a, ang = count_HBonds_pbc_arb( mol1, h2o_mols[jmol], self.lattice, self.lattice_inv, Roocut=Roocut, Rohcut=Rohcut, Aoooh=Aoooh )
                             don += d
                             acc += a
-                            angles.append(ang)
+                            angles[jmol] = ang
                     the_o_atom = mol1.get_atoms_by_name('O')[0]
                     angles = np.array(angles)
                     setattr(the_o_atom, counter_name, (don, acc))
@@ -1137,15 +1144,12 @@ class xyzBox:
     def count_contact_pairs( self, name_1, name_2, cutoff, counter_name='contact_pair'):
             atoms_1 = self.get_atoms_by_name(name_1)
             atoms_2 = self.get_atoms_by_name(name_2)
+            ii, jj, dists = find_neighbor_pairs( _atom_coordinates(atoms_1), _atom_coordinates(atoms_2), cutoff,
+                                                 lattice=self.lattice, lattice_inv=self.lattice_inv )
+            counts = np.bincount( ii, minlength=len(atoms_1) )
 
-            for atom1 in atoms_1:
-                    contact_pair = []
-                    contact_pair.append(atom1)
-                    for atom2 in atoms_2:
-                            dist = getDistancePBC_arb(atom1, atom2, self.lattice, self.lattice_inv )
-                            if dist <= cutoff:
-                                    contact_pair.append(atom2)
-                    if len(contact_pair) == 2:
+            for atom1, cou in zip(atoms_1, counts):
+                    if cou == 1:
                             setattr(atom1, counter_name, 1)
                     else:
                             setattr(atom1, counter_name, 0)
@@ -1170,22 +1174,30 @@ class xyzBox:
             o_atoms = self.get_atoms_by_name('O')
             h_atoms = self.get_atoms_by_name('H')
             hydroniums = []
-            for o_atom in o_atoms:
+            oh_pairs = self._find_pairs( o_atoms, h_atoms, OH_cutoff )
+            for o_atom, mol_h_atoms in zip(o_atoms, oh_pairs):
                     molecule = []
                     molecule.append( o_atom )
-                    for h_atom in h_atoms:
-                            if np.any(self.lattice) and np.any(self.lattice_inv):
-                                    oh_dist = getDistancePBC_arb( o_atom, h_atom, self.lattice, self.lattice_inv )
-                            elif np.any(self.boxLength):
-                                    oh_dist = getDistancePbc( o_atom, h_atom, self.boxLength )
-                            else:
-                                    oh_dist = np.linalg.norm( o_atom.coordinates - h_atom.coordinates )
-                            if oh_dist <= OH_cutoff:
-                                    molecule.append( h_atom )
+                    molecule.extend( mol_h_atoms )
                     if len(molecule) == 4:
                             hydroniums.append( xyzMolecule(molecule) )
             return hydroniums
 
+    def _find_pairs( self, atoms1, atoms2, cutoff ):
+            """ For each atom of atoms1, the list of atoms of atoms2 within cutoff (PBC as
+            given by the lattice or by the box length, if any).
+            """
+            coords1 = _atom_coordinates(atoms1)
+            coords2 = _atom_coordinates(atoms2)
+            if np.any(self.lattice) and np.any(self.lattice_inv):
+                    ii, jj, dists = find_neighbor_pairs( coords1, coords2, cutoff, lattice=self.lattice, lattice_inv=self.lattice_inv )
+            elif np.any(self.boxLength):
+                    ii, jj, dists = find_neighbor_pairs( coords1, coords2, cutoff, boxLength=self.boxLength )
+            else:
+                    ii, jj, dists = find_neighbor_pairs( coords1, coords2, cutoff )
+            bounds = _group_pairs( ii, len(atoms1) )
+            return [ [ atoms2[j] for j in jj[bounds[i]:bounds[i+1]] ] for i in range(len(atoms1)) ]
+
     def find_tmao_molecules_arb(self, CH_cut=1.2, CN_cut=1.6, NO_cut=1.5, CC_cut=2.5 ):
         """ **find_tmao_molecules**
         Returns a list of TMAO molecules.
@@ -1196,26 +1208,20 @@ class xyzBox:
         c_atoms = self.get_atoms_by_name('C')
         n_atoms = self.get_atoms_by_name('N')
         tmao_mols = []
+        nc_pairs = self._find_pairs( n_atoms, c_atoms, CN_cut )
+        no_pairs = self._find_pairs( n_atoms, o_atoms, NO_cut )
+        ch_pairs = self._find_pairs( c_atoms, h_atoms, CN_cut )
         #
-        for n_atom in n_atoms:
+        for n_atom, mol_c_atoms, mol_o_atoms in zip(n_atoms, nc_pairs, no_pairs):
             molecule = []
             molecule.append( n_atom )
             # find all C atoms
-            for c_atom in c_atoms:
-                cn_dist = getDistancePBC_arb( n_atom, c_atom, self.lattice, self.lattice_inv )
-                if cn_dist <= CN_cut:
-                    molecule.append(c_atom)
+            molecule.extend( mol_c_atoms )
             # find the O atom
-            for o_atom in o_atoms:
-                on_dist = getDistancePBC_arb( n_atom, o_atom, self.lattice, self.lattice_inv )
-                if on_dist <= NO_cut:
-                    molecule.append(o_atom)
+            molecule.extend( mol_o_atoms )
             # find the H atoms
-            for c_atom in c_atoms:
-                for h_atom in h_atoms:
-                    ch_dist = getDistancePBC_arb( c_atom, h_atom, self.lattice, self.lattice_inv )
-                    if ch_dist <= CN_cut:
-                        molecule.append(h_atom)
+            for c_h_atoms in ch_pairs:
+                molecule.extend( c_h_atoms )
             # check if molecule is complete
             if len(molecule) == 14:
                     tmao_mols.append(xyzMolecule(molecule))
@@ -1232,28 +1238,20 @@ class xyzBox:
         c_atoms = self.get_atoms_by_name('C')
         n_atoms = self.get_atoms_by_name('N')
         urea_mols = []
+        co_pairs = self._find_pairs( c_atoms, o_atoms, CO_cut )
+        cn_pairs = self._find_pairs( c_atoms, n_atoms, CN_cut )
+        nh_pairs = dict( zip( [id(n_atom) for n_atom in n_atoms], self._find_pairs( n_atoms, h_atoms, NH_cut ) ) )
         #
-        for c_atom in c_atoms:
+        for c_atom, mol_o_atoms, mol_n_atoms in zip(c_atoms, co_pairs, cn_pairs):
             molecule = []
             molecule.append( c_atom )
             # find the O atom
-            for o_atom in o_atoms:
-                oc_dist = getDistancePBC_arb( c_atom, o_atom, self.lattice, self.lattice_inv )
-                if oc_dist <= CO_cut:
-                    molecule.append(o_atom)
+            molecule.extend( mol_o_atoms )
             # find the N atoms
-            mol_n_atoms = []
-            for n_atom in n_atoms:
-                nc_dist = getDistancePBC_arb( c_atom, n_atom, self.lattice, self.lattice_inv )
-                if nc_dist <= CN_cut:
-                    molecule.append(n_atom)
-                    mol_n_atoms.append(n_atom)
+            molecule.extend( mol_n_atoms )
             # find the H atoms
             for n_atom in mol_n_atoms:
-                for h_atom in h_atoms:
-                    nh_dist = getDistancePBC_arb( n_atom, h_atom, self.lattice, self.lattice_inv )
-                    if nh_dist <= NH_cut:
-                        molecule.append(h_atom)
+                molecule.extend( nh_pairs[id(n_atom)] )
             # check if molecule is complete
             if len(molecule) == 8:
                     urea_mols.append(xyzMolecule(molecule))
@@ -1268,18 +1266,11 @@ class xyzBox:
             o_atoms = self.get_atoms_by_name('O')
             h_atoms = self.get_atoms_by_name('H')
             hydroxides = []
-            for o_atom in o_atoms:
+            oh_pairs = self._find_pairs( o_atoms, h_atoms, OH_cutoff )
+            for o_atom, mol_h_atoms in zip(o_atoms, oh_pairs):
                     molecule = []
                     molecule.append( o_atom )
-                    for h_atom in h_atoms:
-                            if np.any(self.lattice) and np.any(self.lattice_inv):
-                                    oh_dist = getDistancePBC_arb( o_atom, h_atom, self.lattice, self.lattice_inv )
-                            elif np.any(self.boxLength):
-                                    oh_dist = getDistancePbc( o_atom, h_atom, self.boxLength )
-                            else:
-                                    oh_dist = np.linalg.norm( o_atom.coordinates - h_atom.coordinates )
-                            if oh_dist <= OH_cutoff:
-                                    molecule.append( h_atom )
+                    molecule.extend( mol_h_atoms )
                     if len(molecule) == 2:
                         hydroxides.append( xyzMolecule(molecule) )
             return hydroxides
@@ -1297,7 +1288,7 @@ class xyzBox:
                 The distance between the two atoms.
 
             """
-            return np.linalg.norm( getDistVectorPBC_arb(atom1, atom2, self.lattice, self.lattice_inv) )
+            return getDistancePBC_arb(atom1, atom2, self.lattice, self.lattice_inv)
 
     def getDistVectorPBC_arb(self, atom1, atom2):
         """ **getDistVectorPBC_arb**
@@ -1313,9 +1304,7 @@ class xyzBox:
             The distance vector between the two atoms (np.array).
 
         """
-        dist_vec = np.array(atom2.coordinates) - np.array(atom1.coordinates)
-        dist_vec -= np.dot(self.lattice, np.round(np.dot(self.lattice_inv,dist_vec)))
-        return dist_vec
+        return getDistVectorPBC_arb(atom1, atom2, self.lattice, self.lattice_inv)
 
 
 
@@ -1389,34 +1378,24 @@ class xyzTrajectory:
 
 
 def calculateRIJhist(atoms,boxLength,DELR=0.01,MAXBIN=1000):
-    HIST = np.zeros(MAXBIN+1)
-    for ii in range(len(atoms)-1):
-        for jj in range(ii+1,len(atoms)):
-            RIJ = getDistancePbc(atoms[ii],atoms[jj],boxLength)
-            BIN = int(RIJ/DELR) + 1
-            if BIN <= MAXBIN:
-                HIST[BIN] = HIST[BIN] + 2
-    return HIST
+    coords = _atom_coordinates(atoms)
+    ii, jj, RIJ = find_neighbor_pairs( coords, coords, MAXBIN*DELR*(1.0+1.0e-9), boxLength=boxLength )
+    return _RIJhist( RIJ[ii<jj], DELR, MAXBIN, 2 )
 
 def calculateRIJhist_arb(atoms1, atoms2, lattice, lattice_inv,DELR=0.01,MAXBIN=1000):
-    HIST = np.zeros(MAXBIN+1)
-    for ii in range(len(atoms1)):
-        for jj in range(len(atoms2)):
-            RIJ = getDistancePBC_arb( atoms1[ii], atoms2[jj], lattice, lattice_inv )
-            BIN = int(RIJ/DELR) + 1
-            if BIN <= MAXBIN:
-                HIST[BIN] = HIST[BIN] + 2
-    return HIST
+    ii, jj, RIJ = find_neighbor_pairs( _atom_coordinates(atoms1), _atom_coordinates(atoms2), MAXBIN*DELR*(1.0+1.0e-9),
+                                       lattice=lattice, lattice_inv=lattice_inv )
+    return _RIJhist( RIJ, DELR, MAXBIN, 2 )
 
 def calculateRIJhist2_arb( atoms1, atoms2, lattice, lattice_inv, DELR=0.01, MAXBIN=1000 ):
-    HIST = np.zeros(MAXBIN+1)
-    for ii in range(len(atoms1)):
-        for jj in range(len(atoms2)):
-            RIJ = getDistancePBC_arb( atoms1[ii], atoms2[jj], lattice, lattice_inv )
-            BIN = int(RIJ/DELR) + 1
-            if BIN <= MAXBIN:
-                HIST[BIN] = HIST[BIN] + 1
-    return HIST
+    ii, jj, RIJ = find_neighbor_pairs( _atom_coordinates(atoms1), _atom_coordinates(atoms2), MAXBIN*DELR*(1.0+1.0e-9),
+                                       lattice=lattice, lattice_inv=lattice_inv )
+    return _RIJhist( RIJ, DELR, MAXBIN, 1 )
+
+def _RIJhist( RIJ, DELR, MAXBIN, weight ):
+    BIN  = (RIJ/DELR).astype(int) + 1
+    BIN  = BIN[ BIN <= MAXBIN ]
+    return np.bincount( BIN, minlength=MAXBIN+1 ).astype(float)*weight
 
 
 
@@ -1545,7 +1524,19 @@ def getDistancePbc(atom1,atom2,boxLength):
     ydist -= boxLength*round(ydist/boxLength)
     zdist  = atom1.coordinates[2] - atom2.coordinates[2] 
     zdist -= boxLength*round(zdist/boxLength)
-    return np.sqrt(xdist**2.0 + ydist**2.0 + zdist**2.0)
+    return np.sqrt(xdist*xdist + ydist*ydist + zdist*zdist)
+
+def getDistancesPbc(coords1, coords2, boxLength):
+    """ **getDistancesPbc**
+
+    Vectorised getDistancePbc: distances between coords1 and coords2 (arrays of
+    xyz-coordinates along the last axis, broadcasted against each other) in a
+    cubic box, using the minimum image convention.
+
+    """
+    dist_vec = np.asarray(coords1, dtype=float) - np.asarray(coords2, dtype=float)
+    dist_vec = dist_vec - boxLength*np.round(dist_vec/boxLength)
+    return np.sqrt( dist_vec[...,0]*dist_vec[...,0] + dist_vec[...,1]*dist_vec[...,1] + dist_vec[...,2]*dist_vec[...,2] )
 
 def getDistancePBC_arb(atom1, atom2, lattice, lattice_inv):
     """ **getDistancePBC_arb**
@@ -1563,7 +1554,8 @@ def getDistancePBC_arb(atom1, atom2, lattice, lattice_inv):
         The distance between the two atoms.
 
     """
-    return np.linalg.norm(getDistVectorPBC_arb(atom1, atom2, lattice, lattice_inv))
+    xdist, ydist, zdist = _distVectorPBC_arb(atom1.coordinates, atom2.coordinates, lattice, lattice_inv)
+    return np.sqrt(xdist*xdist + ydist*ydist + zdist*zdist)
 
 def getDistVectorPBC_arb(atom1, atom2, lattice, lattice_inv):
     """ **getDistVectorPBC_arb**
@@ -1589,9 +1581,124 @@ def getDistVectorPBC_arb(atom1, atom2, lattice, lattice_inv):
 
     #red_dist = np.array(red_frac2) - np.array(red_frac1)
     #return np.dot(lattice, red_dist)
-    dist_vec = np.array(atom2.coordinates) - np.array(atom1.coordinates)
-    dist_vec -= np.dot(lattice, np.round(np.dot(lattice_inv,dist_vec)))
-    return dist_vec
+    return np.array(_distVectorPBC_arb(atom1.coordinates, atom2.coordinates, lattice, lattice_inv))
+
+def _distVectorPBC_arb(coords1, coords2, lattice, lattice_inv):
+    # single pair version of getDistVectorsPBC_arb on python floats, same
+    # operations in the same order (hence the same result), without the
+    # overhead of numpy for three numbers
+    lattice     = np.asarray(lattice, dtype=float).tolist()
+    lattice_inv = np.asarray(lattice_inv, dtype=float).tolist()
+    dist_vec = [ float(coords2[k]) - float(coords1[k]) for k in range(3) ]
+    shifts   = [ float(round( dist_vec[0]*row[0] + dist_vec[1]*row[1] + dist_vec[2]*row[2] )) for row in lattice_inv ]
+    return [ dist_vec[k] - ( lattice[k][0]*shifts[0] + lattice[k][1]*shifts[1] + lattice[k][2]*shifts[2] ) for k in range(3) ]
+
+def getDistVectorsPBC_arb(coords1, coords2, lattice, lattice_inv):
+    """ **getDistVectorsPBC_arb**
+
+    Vectorised getDistVectorPBC_arb: distance vectors from coords1 to coords2 (arrays
+    of xyz-coordinates along the last axis, broadcasted against each other) in an
+    arbitrary simulation box, using the minimum image convention.
+
+    The products with the lattice are written out component by component, so that
+    the result for a pair does not depend on how many pairs are computed at once.
+
+    """
+    lattice     = np.asarray(lattice, dtype=float)
+    lattice_inv = np.asarray(lattice_inv, dtype=float)
+    dist_vec = np.asarray(coords2, dtype=float) - np.asarray(coords1, dtype=float)
+    shifts   = [ np.round( dist_vec[...,0]*lattice_inv[k,0] + dist_vec[...,1]*lattice_inv[k,1] + dist_vec[...,2]*lattice_inv[k,2] ) \
+                 for k in range(3) ]
+    return np.stack( [ dist_vec[...,k] - ( lattice[k,0]*shifts[0] + lattice[k,1]*shifts[1] + lattice[k,2]*shifts[2] ) \
+                       for k in range(3) ], axis=-1 )
+
+def getDistancesPBC_arb(coords1, coords2, lattice, lattice_inv):
+    """ **getDistancesPBC_arb**
+
+    Vectorised getDistancePBC_arb: distances between coords1 and coords2 (arrays of
+    xyz-coordinates along the last axis) in an arbitrary simulation box, using the
+    minimum image convention.
+
+    """
+    dist_vec = getDistVectorsPBC_arb(coords1, coords2, lattice, lattice_inv)
+    return np.sqrt( dist_vec[...,0]*dist_vec[...,0] + dist_vec[...,1]*dist_vec[...,1] + dist_vec[...,2]*dist_vec[...,2] )
+
+def find_neighbor_pairs(coords1, coords2, cutoff, lattice=None, lattice_inv=None, boxLength=None):
+    """ **find_neighbor_pairs**
+
+    Finds all pairs of points of coords1 and coords2 that are not further apart than
+    cutoff, using the minimum image convention of getDistancePBC_arb (if lattice is
+    given) or of getDistancePbc (cubic box of length boxLength).
+
+    Candidates are searched with a scipy.spatial.cKDTree, periodic for cubic boxes and
+    holding the 27 neighbouring images of coords2 for arbitrary lattices. The distances
+    of the candidates are then computed exactly as the pairwise functions do, so that
+    counts and histograms do not change.
+
+    Args:
+        coords1 (np.array): Nx3 array of coordinates.
+        coords2 (np.array): Mx3 array of coordinates.
+        cutoff (float): Largest distance.
+        lattice (np.array): Array with lattice vectors as columns.
+        lattice_inv (np.array): Inverse of lattice.
+        boxLength (float): Length of a cubic box (used if no lattice is given).
+
+    Returns:
+        The indices into coords1 and coords2 of all pairs, sorted by the first and then
+        by the second index, and their distances.
+
+    """
+    coords1 = np.asarray(coords1, dtype=float).reshape(-1,3)
+    coords2 = np.asarray(coords2, dtype=float).reshape(-1,3)
+    N2      = len(coords2)
+    if not len(coords1) or not N2:
+        return np.zeros(0, int), np.zeros(0, int), np.zeros(0)
+
+    # the tree works with wrapped coordinates, which may change distances by rounding
+    radius = cutoff*(1.0+1.0e-9) + 1.0e-9
+
+    if lattice is not None:
+        lattice     = np.asarray(lattice, dtype=float)
+        lattice_inv = np.asarray(lattice_inv, dtype=float)
+        wrapped1 = np.dot( np.mod( np.dot(coords1, lattice_inv.T), 1.0 ), lattice.T )
+        wrapped2 = np.dot( np.mod( np.dot(coords2, lattice_inv.T), 1.0 ), lattice.T )
+        # the minimum image of a wrapped point is one of its 27 neighbouring images
+        vectors  = np.array( list(itertools.product([-1, 0, 1], repeat=3)), dtype=float )
+        images   = ( wrapped2[None,:,:] + np.dot(vectors, lattice.T)[:,None,:] ).reshape(-1,3)
+        pairs    = cKDTree(wrapped1).sparse_distance_matrix( cKDTree(images), radius, output_type='ndarray' )
+        # a pair can be found through several images
+        keys     = np.unique( pairs['i'].astype(np.int64)*N2 + pairs['j'] % N2 )
+    elif boxLength:
+        wrapped1 = np.mod(coords1, boxLength)
+        wrapped2 = np.mod(coords2, boxLength)
+        wrapped1[wrapped1 >= boxLength] = 0.0
+        wrapped2[wrapped2 >= boxLength] = 0.0
+        tree1    = cKDTree(wrapped1, boxsize=boxLength)
+        tree2    = cKDTree(wrapped2, boxsize=boxLength)
+        pairs    = tree1.sparse_distance_matrix( tree2, radius, output_type='ndarray' )
+        keys     = np.unique( pairs['i'].astype(np.int64)*N2 + pairs['j'] )
+    else:
+        pairs    = cKDTree(coords1).sparse_distance_matrix( cKDTree(coords2), radius, output_type='ndarray' )
+        keys     = np.unique( pairs['i'].astype(np.int64)*N2 + pairs['j'] )
+
+    inds1 = keys // N2
+    inds2 = keys %  N2
+    if lattice is not None:
+        dists = getDistancesPBC_arb( coords1[inds1], coords2[inds2], lattice, lattice_inv )
+    elif boxLength:
+        dists = getDistancesPbc( coords1[inds1], coords2[inds2], boxLength )
+    else:
+        dist_vec = coords1[inds1] - coords2[inds2]
+        dists    = np.sqrt( dist_vec[...,0]*dist_vec[...,0] + dist_vec[...,1]*dist_vec[...,1] + dist_vec[...,2]*dist_vec[...,2] )
+    keep = dists <= cutoff
+    return inds1[keep], inds2[keep], dists[keep]
+
+def _group_pairs(inds1, n):
+    """ Boundaries, in the sorted pair list, of the pairs of each of the n first points. """
+    return np.searchsorted(inds1, np.arange(n+1))
+
+def _atom_coordinates(atoms):
+    return np.array([atom.coordinates for atom in atoms], dtype=float).reshape(-1,3)
 
 def getDistance(atom1, atom2):
     return np.linalg.norm(atom2.getCoordinates()-atom2.getCoordinates())
@@ -1852,24 +1959,22 @@ def find_H2O_molecules(o_atoms,h_atoms,boxLength=None):
                 h2o_molecules.append(xyzMolecule([o_atom,h_atoms[order[0]],h_atoms[order[1]]]))
         return h2o_molecules
     else:
+        h_coords = _atom_coordinates(h_atoms)
         for o_atom in o_atoms:
-            ho_dists = []
-            for h_atom in h_atoms:
-                ho_dists.append(getDistancePbc(o_atom,h_atom,boxLength))
+            ho_dists = getDistancesPbc(o_atom.coordinates, h_coords, boxLength)
             order = np.argsort(ho_dists)
             h2o_molecules.append(xyzMolecule([o_atom,h_atoms[order[0]],h_atoms[order[1]]]))
         return h2o_molecules
 
 def find_H2O_molecules_PBC_arb( o_atoms, h_atoms, lattice, lattice_inv, OH_cutoff=1.5 ):
     h2o_molecules = []
-    for o_atom in o_atoms:
-        ho_dists = []
-        for h_atom in h_atoms:
-            ho_dists.append(getDistancePBC_arb(o_atom, h_atom, lattice, lattice_inv))
-        inds = np.where(np.array(ho_dists) <= OH_cutoff)[0]
+    io, ih, dists = find_neighbor_pairs( _atom_coordinates(o_atoms), _atom_coordinates(h_atoms), OH_cutoff,
+                                         lattice=lattice, lattice_inv=lattice_inv )
+    bounds = _group_pairs( io, len(o_atoms) )
+    for ii, o_atom in enumerate(o_atoms):
         molecule = []
         molecule.append(o_atom)
-        for ind in inds:
+        for ind in ih[bounds[ii]:bounds[ii+1]]:
             molecule.append(h_atoms[ind])
         h2o_molecules.append(xyzMolecule(molecule))
     return h2o_molecules
@@ -1930,11 +2035,9 @@ def count_OO_neighbors(list_of_o_atoms,Roocut,boxLength=None):
                     noo.append(len(np.where(np.logical_and(np.sort(np.array(dists))>0.0, np.sort(np.array(dists))<=Roocut))[0]))
             return noo
     else:
-        for atom1 in list_of_o_atoms:
-            dists = []
-            for atom2 in list_of_o_atoms:
-                dists.append(getDistancePbc(atom1,atom2,boxLength))
-            noo.append(len(np.where(np.logical_and(np.sort(np.array(dists))>0.0, np.sort(np.array(dists))<=Roocut))[0]))
+        coords = _atom_coordinates(list_of_o_atoms)
+        ii, jj, dists = find_neighbor_pairs( coords, coords, Roocut, boxLength=boxLength )
+        noo = np.bincount( ii[dists>0.0], minlength=len(list_of_o_atoms) ).tolist()
         return noo
 
 def count_OO_neighbors_pbc(list_of_o_atoms,Roocut,boxLength,numbershells=1):
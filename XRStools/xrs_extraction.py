@@ -91,16 +91,14 @@ class HF_dataset:
         self.HFProfile      = xrs_ComptonProfiles.HFProfile(formulas, stoich_weights, HFCP_PATH)
         self.HFProfile.get_elossProfiles(self.E0,self.tth)
 
-        # interpolate total HF profiles onto experimental eloss scale
-        self.J_total   = np.zeros((len(self.eloss),len(self.tth)))
-        self.C_total   = np.zeros((len(self.eloss),len(self.tth)))
-        self.V_total   = np.zeros((len(self.eloss),len(self.tth)))
-        self.q_vals    = np.zeros((len(self.eloss),len(self.tth)))
-        for ii in range(len(self.tth)):
-            self.J_total[:,ii] = np.interp(self.eloss, self.HFProfile.eloss,self.HFProfile.J_total[:,ii])
-            self.C_total[:,ii] = np.interp(self.eloss, self.HFProfile.eloss,self.HFProfile.C_total[:,ii])
-            self.V_total[:,ii] = np.interp(self.eloss, self.HFProfile.eloss,self.HFProfile.V_total[:,ii])
-            self.q_vals[:,ii]  = np.interp(self.eloss, self.HFProfile.eloss,self.HFProfile.q_vals[:,ii])
+        # interpolate total HF profiles onto experimental eloss scale (all columns at once)
+        ntth     = len(self.tth)
+        profiles = xrs_utilities.interp_columns(self.eloss, self.HFProfile.eloss, \
+                   np.hstack((self.HFProfile.J_total, self.HFProfile.C_total, self.HFProfile.V_total, self.HFProfile.q_vals)))
+        self.J_total   = profiles[:,0:ntth]
+        self.C_total   = profiles[:,ntth:2*ntth]
+        self.V_total   = profiles[:,2*ntth:3*ntth]
+        self.q_vals    = profiles[:,3*ntth:4*ntth]
 
         # initialize double dicts for {'element1':{'edge1','edge2',...}, 'element2':{'edge1','edge2',...} }
         self.C_edges = {}
@@ -117,8 +115,7 @@ class HF_dataset:
                     if key in formula:
                         # cp core-edge profile
                         atom_profile = self.HFProfile.FormulaProfiles[formula].AtomProfiles[key]
-                        for jj in range(len(self.tth)):
-                            self.C_edges[key][edge][:,jj] = np.interp(self.eloss,atom_profile.eloss,atom_profile.CperShell[edge_keyword][:,jj])
+                        self.C_edges[key][edge] = xrs_utilities.interp_columns(self.eloss,atom_profile.eloss,atom_profile.CperShell[edge_keyword])
                     else:
                         print('Could not find ' + key + ' in any of the provided formulas.')
 
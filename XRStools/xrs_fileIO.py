@@ -15,6 +15,18 @@ __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import numpy as np
 import array as arr
 import collections
+import time
+import os
+import re
+import json
+import mmap
+import hashlib
+import h5py
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # no advisory file locks (e.g. Windows), see BiggsDatabase
 
 # # try to import the fast PyMCA parsers
 # try:
@@ -54,9 +66,14 @@ SHOW_LOADED_FILES = False  # this is useful when you want to take home a limited
                            # that ones for home. This without having to bring home the 
                            # whole shift
 
+EDF_READER_THREADS = 4     # number of threads used to read a stack of EDF-files
+
 def SpecRead(filename,nscan):
     """Parses a SPEC file and returns a specified scan.
 
+    The SPEC file is accessed through its index (see SpecIndex), i.e. it is
+    only parsed once and the scan is read by seeking to its block.
+
     Args:
       * filename (string): SPEC file name (inlc. path)
       * nscan (int): Number of the desired scan.
@@ -67,38 +84,276 @@ def SpecRead(filename,nscan):
       * counters (dict): all counters in a dictionary with the counter names as keys.
 
     """
-    scannid   = '#S'
-    countid   = '#L'
-    motorid   = '#P'
-    data      = []
-    motors    = []
-    counterss = []    
-    f = open(filename,'r')
-    while True:
-        line = f.readline()
-        if not line: break
-        if line[0:2] == scannid:
-            if int(line.split()[1]) == nscan:
-                line = '##'+line
-                while line and line[0:2]!='#S':
-                    line = f.readline() 
-                    if not line:
-                        break                    
-                    if line[0:2] == countid:
-                        cline = '  '+line[2:]
-                        counterss = [n.strip() for n in [_f for _f in cline.split('  ')[1:] if _f]]
-                    if line[0:2] == motorid:
-                        motors.append([float(n) for n in line.strip().split()[1:]])                    
-                    if line[0] != '#':
-                        data.append([float(n) for n in line.strip().split()])
-    data.pop(-1) # the trailing empty line                    
-    f.close()
-    # put the data into a dictionary with entries from the counterss
-    counters = {}
-    for n in range(len(counterss)):
-        counters[counterss[n].lower()] = [row[n] for row in data] # data[:,n]
+    index = get_spec_index(filename)
+    data, motor_dict, counters, lables = index.read_scan(nscan)
+    motors = index.read_motor_lines(nscan)
     return data, motors, counters
 
+SPEC_INDEX_POSTFIX = '.xrsidx' # the index of a SPEC file is stored next to it with this postfix
+SPEC_INDEX_VERSION = 1
+_spec_line_re      = re.compile(br'^#(S|L|F|P\d*|O\d*)[ \t]', re.M)
+
+class SpecIndex:
+    """ **SpecIndex**
+
+    Byte-offset index of a SPEC file: position of each '#S', '#L' and '#P' line
+    and the end of each scan, plus the motor names of the file headers ('#O').
+
+    The SPEC file is parsed once, the index is persisted next to it (if the
+    directory is writable) and, when the file grows, only the new part (starting
+    at the last, possibly unfinished scan) is parsed. Single scans are then read
+    by seeking directly to their block.
+
+    Args:
+      * filename (string): SPEC file name (incl. path).
+      * persist (boolean): If 'True', the index is stored in filename+SPEC_INDEX_POSTFIX.
+
+    """
+    def __init__(self, filename, persist=True):
+        self.filename = os.path.abspath(filename)
+        self.persist  = persist
+        self.reset()
+        if persist:
+            self.load()
+        self.update()
+
+    def reset(self):
+        self.size    = 0    # number of bytes of the SPEC file that are indexed
+        self.resume  = 0    # offset at which indexing has to resume
+        self.signature = None
+        self.headers = []   # one dict per file header: offset of '#F' and motor names
+        self.scans   = collections.OrderedDict() # scan number -> dict of offsets
+
+    def get_signature(self):
+        f = open(self.filename, 'rb')
+        head = f.read(4096)
+        f.close()
+        return hashlib.sha1(head).hexdigest()
+
+    def load(self):
+        """ Reads the persisted index, if there is a valid one. """
+        try:
+            f = open(self.filename + SPEC_INDEX_POSTFIX, 'r')
+            stored = json.load(f)
+            f.close()
+        except (IOError, OSError, ValueError):
+            return
+        if stored.get('version') != SPEC_INDEX_VERSION:
+            return
+        self.size      = stored['size']
+        self.resume    = stored['resume']
+        self.signature = stored['signature']
+        self.headers   = stored['headers']
+        self.scans     = collections.OrderedDict( (int(n), info) for n, info in stored['scans'] )
+
+    def save(self):
+        """ Persists the index next to the SPEC file (silently skipped if not writable). """
+        stored = { 'version':SPEC_INDEX_VERSION, 'size':self.size, 'resume':self.resume, \
+                   'signature':self.signature, 'headers':self.headers, 'scans':list(self.scans.items()) }
+        try:
+            tmp = self.filename + SPEC_INDEX_POSTFIX + '.%d.tmp' % os.getpid()
+            f = open(tmp, 'w')
+            json.dump(stored, f)
+            f.close()
+            os.rename(tmp, self.filename + SPEC_INDEX_POSTFIX)
+        except (IOError, OSError):
+            pass
+
+    def update(self):
+        """ Extends the index to the current end of the SPEC file. """
+        size = os.path.getsize(self.filename)
+        if size == self.size:
+            return
+        signature = self.get_signature()
+        if size < self.size or (self.signature is not None and signature != self.signature):
+            # the file was truncated or replaced: start from scratch
+            self.reset()
+        self.signature = signature
+
+        # the last scan (or header) may have been incomplete, re-index it
+        for number in [n for n, info in self.scans.items() if info['S'] >= self.resume]:
+            del self.scans[number]
+        while self.headers and self.headers[-1]['F'] >= self.resume:
+            self.headers.pop()
+
+        f  = open(self.filename, 'rb')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            current = None
+            motor_names = None
+            for match in _spec_line_re.finditer(mm, self.resume):
+                kind   = match.group(1)
+                offset = match.start()
+                if kind == b'S':
+                    if current is not None:
+                        current['end'] = offset
+                    number  = int(mm[offset:mm.find(b'\n', offset)].split()[1])
+                    current = { 'S':offset, 'L':None, 'P':[], 'end':size, 'header':len(self.headers)-1 }
+                    motor_names = None
+                    self.resume = offset
+                    if number not in self.scans: # first occurrence wins, as in PyMca
+                        self.scans[number] = current
+                elif kind == b'F':
+                    if current is not None:
+                        current['end'] = offset
+                        current = None
+                    self.headers.append({ 'F':offset, 'names':[] })
+                    motor_names = self.headers[-1]['names']
+                    self.resume = offset
+                elif kind.startswith(b'O'):
+                    if motor_names is not None:
+                        line = mm[offset:mm.find(b'\n', offset)].decode('ascii', 'replace')
+                        motor_names.extend(_split_spec_names(line))
+                elif kind == b'L':
+                    if current is not None:
+                        current['L'] = offset
+                elif kind.startswith(b'P'):
+                    if current is not None:
+                        current['P'].append(offset)
+        finally:
+            mm.close()
+            f.close()
+        self.size = size
+        if self.persist:
+            self.save()
+
+    def get_scan_numbers(self):
+        """ Returns the numbers of all indexed scans. """
+        return list(self.scans.keys())
+
+    def read_scans(self, nscans, motors_only=False):
+        """ **read_scans**
+
+        Reads many scans in one pass over the SPEC file (ordered by offset).
+
+        Args:
+          * nscans (list): Scan numbers.
+          * motors_only (boolean): If 'True', only the '#P' lines are read and
+            data and counters are returned empty.
+
+        Returns:
+          * scans (list): One tuple (data, motors, counters, lables) per requested
+            scan, in the same format as returned by PyMcaSpecRead_my.
+
+        """
+        self.update()
+        for nscan in nscans:
+            if int(nscan) not in self.scans:
+                raise KeyError('Scan %d not found in %s.' % (int(nscan), self.filename))
+        order  = sorted(range(len(nscans)), key=lambda ii: self.scans[int(nscans[ii])]['S'])
+        result = [None]*len(nscans)
+        f = open(self.filename, 'rb')
+        try:
+            for ii in order:
+                info = self.scans[int(nscans[ii])]
+                if info['header'] >= 0:
+                    names = self.headers[info['header']]['names']
+                else:
+                    names = []
+                if motors_only:
+                    lines = []
+                    for offset in info['P']:
+                        f.seek(offset)
+                        lines.append(f.readline())
+                else:
+                    f.seek(info['S'])
+                    lines = f.read(info['end'] - info['S']).splitlines()
+                result[ii] = _parse_spec_block(lines, names)
+        finally:
+            f.close()
+        return result
+
+    def read_motor_lines(self, nscan):
+        """ Returns the motor positions of a scan as a list, one entry per '#P' line. """
+        self.update()
+        info = self.scans[int(nscan)]
+        motors = []
+        f = open(self.filename, 'rb')
+        try:
+            for offset in info['P']:
+                f.seek(offset)
+                motors.append([float(n) for n in f.readline().split()[1:]])
+        finally:
+            f.close()
+        return motors
+
+    def read_scan(self, nscan):
+        """ Returns (data, motors, counters, lables) of a single scan. """
+        return self.read_scans([nscan])[0]
+
+def _split_spec_names(line):
+    """ Splits a '#O' or '#L' line into names (separated by two or more spaces). """
+    return [n.strip() for n in re.split(r'\s{2,}', line.split(None, 1)[1].strip()) if n.strip()] \
+           if len(line.split(None, 1)) > 1 else []
+
+def _parse_spec_block(lines, motor_names):
+    lables    = []
+    positions = []
+    rows      = []
+    for line in lines:
+        if line[:2] == b'#L':
+            lables = _split_spec_names(line.decode('ascii', 'replace'))
+        elif line[:2] == b'#P':
+            positions.extend(float(n) for n in line.split()[1:])
+        elif line[:1] not in (b'#', b'@') and line.strip():
+            # rows are converted one by one : a scan still being written can end
+            # with an unfinished line, a bad token only drops its own row
+            try:
+                rows.append([float(n) for n in line.split()])
+            except ValueError:
+                continue
+    # the number of columns is given by the labels (or by the first row), rows
+    # of another length (e.g. the last line of a growing scan) are dropped
+    ncols = len(lables) if lables else (len(rows[0]) if rows else 0)
+    rows  = [row for row in rows if len(row) == ncols]
+    if rows:
+        data = np.array(rows, dtype=float)
+    else:
+        data = np.zeros((0, ncols))
+    counters = {}
+    for cou, lable in enumerate(lables):
+        if cou < data.shape[1]:
+            counters[lable.lower()] = data[:,cou]
+    motors = collections.OrderedDict(zip(motor_names, positions))
+    return data, motors, counters, lables
+
+_spec_indices = {}
+
+def get_spec_index(filename):
+    """
+    Returns the (shared) SpecIndex of a SPEC file, brought up to date.
+    """
+    key = os.path.abspath(filename)
+    if key not in _spec_indices:
+        _spec_indices[key] = SpecIndex(key)
+    else:
+        _spec_indices[key].update()
+    return _spec_indices[key]
+
+def IndexedSpecRead(filename, nscan):
+    """
+    Returns data, motors, counters, and labels of a scan using the SPEC index.
+
+    Args:
+      * filename (string): SPEC file name (incl. path).
+      * nscan (int): Number of the desired scan.
+
+    Returns:
+      * data (np.array): array of the data (scan points x counters).
+      * motors (dict): motor positions with the motor names as keys.
+      * counters (dict): all counters with the (lower case) counter names as keys.
+      * lables (list): counter names as in the SPEC file.
+
+    """
+    return get_spec_index(filename).read_scan(nscan)
+
+def IndexedSpecReadMany(filename, nscans, motors_only=False):
+    """
+    Returns a list of (data, motors, counters, labels), one for each of the scans
+    'nscans', reading the SPEC file in a single pass.
+    """
+    return get_spec_index(filename).read_scans(list(nscans), motors_only=motors_only)
+
 def myEdfRead(filename):
     """
     Returns EDF-data, if PyMCA is not installed (this is slow).
@@ -109,14 +364,14 @@ def myEdfRead(filename):
     predata = []
     for entry in f:
         counter += 1
-        if entry.strip().split()[0] == '}':
+        if entry.strip().split()[0] == b'}':
             break
     for entry in f[:counter]:
-        if entry.strip().split()[0] == 'Dim_1':
+        if entry.strip().split()[0] == b'Dim_1':
             dim1 = int(entry.strip().split()[2])
-        if entry.strip().split()[0] == 'Dim_2':
+        if entry.strip().split()[0] == b'Dim_2':
             dim2 = int(entry.strip().split()[2])
-        if entry.strip().split()[0] == 'Size':
+        if entry.strip().split()[0] == b'Size':
             size = int(entry.strip().split()[2])
     length = 0
     for line in f:
@@ -130,6 +385,111 @@ def myEdfRead(filename):
     f.close()
     return data
 
+# EDF DataType keywords and the according numpy types
+EDF_DATATYPES = {
+    'unsignedbyte'    : np.uint8,
+    'unsignedchar'    : np.uint8,
+    'signedbyte'      : np.int8,
+    'signedchar'      : np.int8,
+    'unsignedshort'   : np.uint16,
+    'unsignedshortinteger': np.uint16,
+    'signedshort'     : np.int16,
+    'signedshortinteger': np.int16,
+    'unsignedinteger' : np.uint32,
+    'unsignedint'     : np.uint32,
+    'unsignedlong'    : np.uint32,
+    'signedinteger'   : np.int32,
+    'signedint'       : np.int32,
+    'signedlong'      : np.int32,
+    'unsigned64'      : np.uint64,
+    'signed64'        : np.int64,
+    'floatvalue'      : np.float32,
+    'float'           : np.float32,
+    'realvalue'       : np.float32,
+    'doublevalue'     : np.float64,
+    'double'          : np.float64,
+}
+
+EDF_BLOCKSIZE = 512
+
+def EdfHeaderRead(filename):
+    """
+    Parses only the header block of an EDF-file.
+
+    Args:
+      * filename (string): EDF file name (incl. path).
+
+    Returns:
+      * header (dict): header keywords and their (string) values.
+      * offset (int): byte offset of the binary payload.
+
+    """
+    header = {}
+    f = open(filename,'rb')
+    block = f.read(EDF_BLOCKSIZE)
+    start = block.find(b'{')
+    if start < 0:
+        f.close()
+        raise ValueError('%s is not an EDF-file (no header found).' % filename)
+    # the header is padded to a multiple of 512 bytes and closed by '}\n'
+    end = block.find(b'}\n', start)
+    while end < 0:
+        chunk = f.read(EDF_BLOCKSIZE)
+        if not chunk:
+            f.close()
+            raise ValueError('%s: unterminated EDF header.' % filename)
+        block += chunk
+        end   = block.find(b'}\n', start)
+    f.close()
+    for line in block[start+1:end].decode('ascii', 'replace').split(';'):
+        if '=' in line:
+            key, value = line.split('=', 1)
+            header[key.strip()] = value.strip()
+    return header, end + 2
+
+def NumpyEdfRead(filename, mmap=False):
+    """
+    Returns EDF-data without PyMCA or FabIO.
+
+    Only the header block is parsed, the binary payload is mapped
+    directly into a numpy array according to the DataType, ByteOrder,
+    Dim_1 and Dim_2 keywords of the header.
+
+    Args:
+      * filename (string): EDF file name (incl. path).
+      * mmap (boolean): If 'True', a read-only np.memmap of the file is
+        returned instead of reading the data into memory.
+
+    Returns:
+      * data (np.array): 2D image of shape (Dim_2, Dim_1) in the native
+        data type of the file.
+
+    """
+    header, offset = EdfHeaderRead(filename)
+    dim1  = int(header['Dim_1'])
+    dim2  = int(header.get('Dim_2', 1))
+    dtype = np.dtype(EDF_DATATYPES[header.get('DataType', 'UnsignedShort').lower()])
+    if header.get('ByteOrder', 'LowByteFirst') == 'HighByteFirst':
+        dtype = dtype.newbyteorder('>')
+    else:
+        dtype = dtype.newbyteorder('<')
+    if 'Size' in header:
+        size = int(header['Size'])
+        if size < dim1*dim2*dtype.itemsize:
+            raise ValueError('%s: Size keyword too small for Dim_1 x Dim_2.' % filename)
+    if mmap:
+        return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(dim2,dim1))
+    f = open(filename,'rb')
+    f.seek(offset)
+    data = np.fromfile(f, dtype=dtype, count=dim1*dim2)
+    f.close()
+    if data.size != dim1*dim2:
+        raise ValueError('%s: file is truncated.' % filename)
+    data = data.reshape((dim2,dim1))
+    if not dtype.isnative:
+        data = data.astype(dtype.newbyteorder('='))
+    return data
+
 def PyMcaSpecRead_my(filename,nscan):
     """
     Returns data, counter-names, and EDF-files using PyMCA.
@@ -204,8 +564,7 @@ def ReadScanFromFile(fname):
     """
     try:
         print( 'Trying to load scan from file.')
-        scanname = 'Scan%03d' % scannumber
-        scan     = np.load(fname)
+        scan     = np.load(fname, allow_pickle=True)
         data     = list(scan['data'])
         motors   = list(scan['motors'])
         counters = scan['counters'].item()
@@ -259,8 +618,8 @@ def ReadEdfImages_TwoImages(ccdcounter,num_pix_x,num_pix_y,path,EdfPrefix_h,EdfP
             edfmats[m,0:num_pix_y//2,:] = edfmatsv[m,:,:]
             edfmats[m,num_pix_y//2:,:]  = edfmatsh[m,:,:]
         else:
-            edfmatsh[m,:,:] = myEdfRead(edfnameh)
-            edfmatsv[m,:,:] = myEdfRead(edfnamev)
+            edfmatsh[m,:,:] = NumpyEdfRead(edfnameh)
+            edfmatsv[m,:,:] = NumpyEdfRead(edfnamev)
             edfmats[m,0:num_pix_y//2,:] = edfmatsv[m,:,:]
             edfmats[m,num_pix_y//2:,:]  = edfmatsh[m,:,:]
     return edfmats
@@ -271,7 +630,7 @@ def EdfRead(fname):
         edfmat = PyMcaEdfRead(fname)
     else:
         # print "NOT using pymca " 
-        edfmat = myEdfRead(fname)
+        edfmat = NumpyEdfRead(fname)
     return edfmat
 
 def ReadEdf_justFirstImage(ccdcounter,  path, EdfPrefix, EdfName, EdfPostfix):
@@ -284,65 +643,101 @@ def ReadEdf_justFirstImage(ccdcounter,  path, EdfPrefix, EdfName, EdfPostfix):
         edfmat = PyMcaEdfRead(fname)
     else:
         print( "NOT using pymca " )
-        edfmat = myEdfRead(fname)
+        edfmat = NumpyEdfRead(fname)
     return edfmat
 
-def ReadEdfImages(ccdcounter, num_pix_x, num_pix_y, path, EdfPrefix, EdfName, EdfPostfix):
+def ReadEdfStack(fnames, dtype=None, nthreads=None, reader=None, verbose=True):
     """
-    Reads a series of EDF-images and returs them in a 3D Numpy array
-    (horizontal and vertical Maxipix images in different files).
+    Reads a list of EDF-images into one preallocated 3D Numpy array.
+
+    The first image fixes the frame shape and (unless 'dtype' is given)
+    the data type of the stack, so that 16/32-bit detector data are not
+    inflated to float64. The remaining images are decoded by a bounded
+    pool of threads, each writing directly into its slot of the stack.
+
+    Args:
+      * fnames (list): EDF file names (incl. path), one per frame.
+      * dtype (np.dtype): Data type of the stack, native type of the files if 'None'.
+      * nthreads (int): Number of reader threads, EDF_READER_THREADS if 'None'.
+      * reader (function): Function returning the image of a file name,
+        PyMcaEdfRead or NumpyEdfRead (depending on use_PyMca) if 'None'.
+      * verbose (boolean): If 'True', the reading throughput is printed.
+
+    Returns:
+      * edfmats (np.array): Stack of images of shape (len(fnames), Dim_2, Dim_1).
+
     """
-    edfmats = PrepareEdfMatrix(len(ccdcounter),num_pix_x,num_pix_y)
-    for m in range(len(ccdcounter)):
-        ccdnumber = ccdcounter[m]
-        fname   = path + EdfPrefix + EdfName + '_' + "%04d" % ccdnumber + EdfPostfix
-        print( " for file ", fname)
-        if use_PyMca == True:
-            print( " using pymca " )
-            edfmats[m,:,:] = PyMcaEdfRead(fname)
-        else:
-            print( "NOT using pymca " )
-            edfmats[m,:,:] = myEdfRead(fname)
+    if reader is None:
+        reader = PyMcaEdfRead if use_PyMca else NumpyEdfRead
+    if nthreads is None:
+        nthreads = EDF_READER_THREADS
+    t0 = time.time()
+    first = np.asarray(reader(fnames[0]))
+    if dtype is None:
+        dtype = first.dtype
+    edfmats = np.empty((len(fnames),)+first.shape, dtype=dtype)
+    edfmats[0] = first
+
+    def read_one(m):
+        if SHOW_LOADED_FILES : print( " LEGGO ", fnames[m])
+        edfmats[m] = reader(fnames[m])
+
+    if nthreads > 1 and len(fnames) > 2:
+        pool = ThreadPoolExecutor(max_workers=nthreads)
+        try:
+            # list() re-raises the first reading error, if any
+            list(pool.map(read_one, range(1, len(fnames))))
+        finally:
+            pool.shutdown()
+    else:
+        for m in range(1, len(fnames)):
+            read_one(m)
+
+    dt = time.time() - t0
+    if verbose and dt > 0.0:
+        print( 'Read %d EDF-files in %.2f s (%.1f frames/s).' % (len(fnames), dt, len(fnames)/dt) )
     return edfmats
 
-def ReadEdfImages_my(ccdcounter, path, EdfPrefix, EdfName, EdfPostfix):
+def ReadEdfImages(ccdcounter, num_pix_x, num_pix_y, path, EdfPrefix, EdfName, EdfPostfix, dtype=np.float64, nthreads=None):
     """
     Reads a series of EDF-images and returs them in a 3D Numpy array
     (horizontal and vertical Maxipix images in different files).
+    The stack is float64 (callers scale it in place), dtype=None keeps
+    the native type of the files.
     """
-
-    fname   = path + EdfPrefix + EdfName + "%04d" % ccdcounter[0] + EdfPostfix
-    xyShape = np.shape(myEdfRead(fname))
-    edfmats = PrepareEdfMatrix(len(ccdcounter),xyShape[1],xyShape[0])
-    for m in range(len(ccdcounter)):
-        ccdnumber = ccdcounter[m]
-        fname   = path + EdfPrefix + EdfName + "%04d" % ccdnumber + EdfPostfix
-        if SHOW_LOADED_FILES : print( " LEGGO ", fname)
-        edfmats[m,:,:] = myEdfRead(fname)
-
+    fnames  = [path + EdfPrefix + EdfName + '_' + "%04d" % ccdnumber + EdfPostfix for ccdnumber in ccdcounter]
+    edfmats = ReadEdfStack(fnames, dtype=dtype, nthreads=nthreads)
+    if edfmats.shape[1:] != (num_pix_y, num_pix_x):
+        print( 'WARNING: EDF-images have shape %s, expected %s.' % (str(edfmats.shape[1:]), str((num_pix_y, num_pix_x))) )
     return edfmats
 
-def ReadEdfImages_PyMca(ccdcounter, path, EdfPrefix, EdfName, EdfPostfix):
+def ReadEdfImages_my(ccdcounter, path, EdfPrefix, EdfName, EdfPostfix, dtype=np.float64, nthreads=None):
     """
     Reads a series of EDF-images and returs them in a 3D Numpy array
     (horizontal and vertical Maxipix images in different files).
+    The stack is float64 (callers scale it in place), dtype=None keeps
+    the native type of the files.
     """
-    fname   = path + EdfPrefix + EdfName + "%04d" % ccdcounter[0] + EdfPostfix
+    fnames  = [path + EdfPrefix + EdfName + "%04d" % ccdnumber + EdfPostfix for ccdnumber in ccdcounter]
+    return ReadEdfStack(fnames, dtype=dtype, nthreads=nthreads, reader=NumpyEdfRead)
 
-    xyShape = np.shape(PyMcaEdfRead(fname))
-    edfmats = PrepareEdfMatrix(len(ccdcounter),xyShape[1],xyShape[0])
-    for m in range(len(ccdcounter)):
-        ccdnumber = ccdcounter[m]
-        fname   = path + EdfPrefix + EdfName + "%04d" % ccdnumber + EdfPostfix
-        if SHOW_LOADED_FILES :  print( " LEGGO ", fname)
-        edfmats[m,:,:] = PyMcaEdfRead(fname)
-    return edfmats
+def ReadEdfImages_PyMca(ccdcounter, path, EdfPrefix, EdfName, EdfPostfix, dtype=np.float64, nthreads=None):
+    """
+    Reads a series of EDF-images and returs them in a 3D Numpy array
+    (horizontal and vertical Maxipix images in different files).
+    The stack is float64 (callers scale it in place), dtype=None keeps
+    the native type of the files.
+    """
+    fnames  = [path + EdfPrefix + EdfName + "%04d" % ccdnumber + EdfPostfix for ccdnumber in ccdcounter]
+    return ReadEdfStack(fnames, dtype=dtype, nthreads=nthreads, reader=PyMcaEdfRead)
 
 def readbiggsdata(filename,element):
     """
     Reads Hartree-Fock Profile of element 'element' from values tabulated 
     by Biggs et al. (Atomic Data and Nuclear Data Tables 16, 201-309 (1975))
     as provided by the DABAX library (http://ftp.esrf.eu/pub/scisoft/xop2.3/DabaxFiles/ComptonProfiles.dat).
+    The table is taken from the compiled database (see BiggsDatabase), the text
+    file is only parsed once.
     input:
     filename = path to the ComptonProfiles.dat file (the file should be distributed with this package)
     element  = string of element name
@@ -356,40 +751,206 @@ def readbiggsdata(filename,element):
     bindingen  = binding energies of the accorting shells
     colnames   = strings of column names as used in the file
     """
+    return get_biggs_database(filename).get_table(element)
+
+def readbiggsdata_all(filename):
+    """
+    Parses all elements of the Biggs table in one pass. Returns an ordered
+    dictionary with the element symbols as keys and tuples (data, occupation,
+    bindingen, colnames) as values (see readbiggsdata).
+    """
     elementid = '#S'
     sizeid    = '#N'
     occid     = '#UOCCUP'
     bindingid = '#UBIND'
     colnameid = '#L'
-    data = []
+    tables  = collections.OrderedDict()
+    current = None
     f = open(filename,'r')
-    istrue = True
-    while istrue:
-        line = f.readline()
+    for line in f:
         if line[0:2] == elementid:
-            if line.split()[-1] == element:
-                line = f.readline()
-                while line[0:2] != elementid:
-                    if line[0:2] == sizeid:
-                        arraysize = int(line.split()[-1])
-                        line = f.readline()
-                    if line[0:7] == occid:
-                        occupation = line.split()[1:]
-                        line = f.readline()
-                    if line[0:6] == bindingid:
-                        bindingen = line.split()[1:]    
-                        line = f.readline()
-                    if line[0:2] == colnameid:
-                        colnames = line.split()[1:]
-                        line = f.readline()
-                    if line[0]== ' ':
-                        data.append([float(n) for n in line.strip().split()])
-                        #data = np.zeros((31,arraysize))
-                        line = f.readline()
-                break
-    length = len(data)
-    data = (np.reshape(np.array(data),(length,arraysize)))
-    return data, occupation, bindingen, colnames
+            current = { 'element':line.split()[-1], 'data':[], 'arraysize':None, \
+                        'occupation':[], 'bindingen':[], 'colnames':[] }
+            tables[current['element']] = current
+        elif current is None:
+            continue
+        elif line[0:2] == sizeid:
+            current['arraysize'] = int(line.split()[-1])
+        elif line[0:7] == occid:
+            current['occupation'] = line.split()[1:]
+        elif line[0:6] == bindingid:
+            current['bindingen'] = line.split()[1:]
+        elif line[0:2] == colnameid:
+            current['colnames'] = line.split()[1:]
+        elif line[0:1] == ' ' and line.strip():
+            current['data'].append([float(n) for n in line.strip().split()])
+    f.close()
+    for element in tables:
+        table = tables[element]
+        data  = np.reshape(np.array(table['data']),(len(table['data']),table['arraysize']))
+        tables[element] = (data, table['occupation'], table['bindingen'], table['colnames'])
+    return tables
+
+BIGGS_DB_VERSION = 1
+BIGGS_DB_POSTFIX = '.h5' # compiled database, in the user's cache directory
+
+class _DatabaseLock:
+    """
+    Advisory lock on '<dbname>.lock', shared for readers and exclusive for
+    writers, so that several processes (process pools, MPI ranks) never open
+    the same HDF5 file for writing at once. Does nothing without fcntl.
+    """
+    def __init__(self, dbname, shared=False):
+        self.lockname = dbname + '.lock'
+        self.shared   = shared
+        self.fd       = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.fd = os.open(self.lockname, os.O_RDWR | os.O_CREAT, 0o666)
+            fcntl.flock(self.fd, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+class BiggsDatabase:
+    """ **BiggsDatabase**
+
+    Compiled (HDF5) version of the Biggs Compton profile table. It is created on
+    first use from the text file, in the user's cache directory (never in the
+    installed package), and holds the parsed tables of all elements.
+    Derived profiles (e.g. the interpolated pz profiles of xrs_ComptonProfiles)
+    can be stored in it as well, they are added as they are computed.
+    All accesses to the file go through a _DatabaseLock; without file locking
+    (no fcntl) the derived profiles are kept in memory only.
+    The database is rebuilt if the text file changes. If the cache directory is
+    not writable everything is kept in memory only.
+
+    Args:
+      * filename (string): Path to the ComptonProfiles.dat file.
+
+    """
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self.dbname   = None
+        self.tables   = {}
+        self.profiles = {}
+        stat = os.stat(self.filename)
+        self.stamp = (stat.st_size, int(stat.st_mtime))
+        if not self.load():
+            self.compile()
+
+    def get_dbname(self):
+        cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        cache_name = hashlib.sha1(self.filename.encode('utf-8')).hexdigest()[:16] + BIGGS_DB_POSTFIX
+        return os.path.join(cache_dir, 'xrstools', cache_name)
+
+    def load(self):
+        """ Reads the tables from an up to date compiled database, returns 'False' if there is none. """
+        dbname = self.get_dbname()
+        try:
+            with _DatabaseLock(dbname, shared=True):
+                with h5py.File(dbname, 'r') as h5:
+                    if h5.attrs.get('version') != BIGGS_DB_VERSION or \
+                       tuple(h5.attrs.get('source_stamp', ())) != self.stamp:
+                        return False
+                    for element, group in h5['tables'].items():
+                        self.tables[element] = ( group['data'][()],
+                                                 [_h5str(n) for n in group.attrs['occupation']],
+                                                 [_h5str(n) for n in group.attrs['bindingen']],
+                                                 [_h5str(n) for n in group.attrs['colnames']] )
+        except (IOError, OSError, KeyError):
+            self.tables = {}
+            return False
+        self.dbname = dbname
+        return True
+
+    def compile(self):
+        """ Parses the text file and writes the compiled database. """
+        self.tables   = readbiggsdata_all(self.filename)
+        self.profiles = {}
+        dbname  = self.get_dbname()
+        tmpname = dbname + '.%d.tmp' % os.getpid()
+        try:
+            if not os.path.isdir(os.path.dirname(dbname)):
+                os.makedirs(os.path.dirname(dbname))
+            with _DatabaseLock(dbname):
+                with h5py.File(tmpname, 'w') as h5:
+                    h5.attrs['version']      = BIGGS_DB_VERSION
+                    h5.attrs['source_stamp'] = np.array(self.stamp)
+                    tables = h5.create_group('tables')
+                    for element, (data, occupation, bindingen, colnames) in self.tables.items():
+                        group = tables.create_group(element)
+                        group['data'] = data
+                        group.attrs['occupation'] = np.array(occupation, dtype=np.bytes_)
+                        group.attrs['bindingen']  = np.array(bindingen, dtype=np.bytes_)
+                        group.attrs['colnames']   = np.array(colnames, dtype=np.bytes_)
+                    h5.create_group('profiles')
+                os.rename(tmpname, dbname)
+            self.dbname = dbname
+        except (IOError, OSError):
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
+    def get_table(self, element):
+        """ Returns (data, occupation, bindingen, colnames) for an element (copies). """
+        if element not in self.tables:
+            raise ValueError('Element %s not found in %s.' % (element, self.filename))
+        data, occupation, bindingen, colnames = self.tables[element]
+        return data.copy(), list(occupation), list(bindingen), list(colnames)
+
+    def get_profile(self, key):
+        """ Returns the stored profile (data, dict of lists) under key or 'None'. """
+        if key not in self.profiles and self.dbname is not None:
+            try:
+                with _DatabaseLock(self.dbname, shared=True):
+                    with h5py.File(self.dbname, 'r') as h5:
+                        if key in h5['profiles']:
+                            group = h5['profiles'][key]
+                            self.profiles[key] = ( group['data'][()], \
+                                dict( (name, [_h5str(v) for v in values]) for name, values in group.attrs.items() ) )
+            except (IOError, OSError, KeyError):
+                pass
+        return self.profiles.get(key)
+
+    def put_profile(self, key, data, lists):
+        """ Stores a profile (array data plus a dict of lists) under key. """
+        self.profiles[key] = (data, lists)
+        if self.dbname is None or fcntl is None:
+            return
+        try:
+            data = np.asarray(data)
+            with _DatabaseLock(self.dbname):
+                with h5py.File(self.dbname, 'a') as h5:
+                    if key in h5['profiles']:
+                        del h5['profiles'][key]
+                    group = h5['profiles'].create_group(key)
+                    group['data'] = data
+                    for name, values in lists.items():
+                        group.attrs[name] = np.array([str(v) for v in values], dtype=np.bytes_)
+        except (IOError, OSError, KeyError):
+            pass
+
+def _h5str(value):
+    if isinstance(value, bytes):
+        return value.decode('ascii')
+    return str(value)
+
+_biggs_databases = {}
+
+def get_biggs_database(filename):
+    """
+    Returns the (shared) BiggsDatabase for the Biggs table 'filename'.
+    """
+    key = os.path.abspath(filename)
+    stat = os.stat(key)
+    if key not in _biggs_databases or _biggs_databases[key].stamp != (stat.st_size, int(stat.st_mtime)):
+        _biggs_databases[key] = BiggsDatabase(key)
+    return _biggs_databases[key]
 
 
 
@@ -136,89 +136,49 @@ class oneD_imaging(xrs_read.read_id20):
                     miny = np.amin(roiyinds)
 
                     if self.recenterings is not None:
+                            ## the shifts are applied only on the bounding box of the roi
                             if self.recenterings[ii].shape ==(2,2):
                                     ## to be refined by comparaison : zb,xb is the gol for new baricenter
                                     [[zb, za],[xb,xa]] = self.recenterings[ii]
                                     sx = xb-xa
                                     sz = zb-za
-                            else:
-                                    ## good shift is known in advance
-                                    sz,sx = self.recenterings[ii]
+                                    print( " SHIFTO DI " , sz, sx)
 
-                            if sx != 0.0:
-                                    print( " SHIFTO DI " , sx)
-                                    isx = int(1000+sx)-1000
-                                    dsx = sx-isx
-                                    edfmats2use = (1.0-dsx) * np.roll(edfmats , isx , axis=-1)   + dsx *  np.roll(edfmats , isx+1 , axis=-1)
-                            if sz != 0.0:
-                                    isz = int(1000+sz)-1000
-                                    dsz = sz-isz
-                                    edfmats2use = (1.0-dsz) * np.roll(edfmats2use , isz , axis=-2)   + dsz *  np.roll(edfmats2use , isz+1 , axis=-1)
-
-                            tmp = np.zeros_like(edfmats2use)
-                            tmp[:,roixinds,roiyinds] = edfmats2use[:,roixinds,roiyinds]
-
-                            print( " ENERGIA adesso "  , tmp.sum())
-                            print( " ENERGIA prima  "  ,edfmats[:,roixinds,roiyinds] .sum())
-                            if self.recenterings[ii].shape ==(2,2):
+                                    tmp = roi_inset( edfmats, roixinds, roiyinds, sz, sx )
+                                    print( " ENERGIA adesso "  , tmp.sum())
+                                    print( " ENERGIA prima  "  ,edfmats[:,roixinds,roiyinds] .sum())
 
-                                    dimz,dimy,dimx = tmp.shape
-                                    BX = (tmp*np.arange(dimx)).sum()/tmp.sum()
+                                    BX, BY = roi_inset_baricenter( tmp, minx, miny )
                                     print( " original barix for zone ", ii, " : " , xa)
                                     print( " actual / goal  : ", BX, xb)
                                     sx = xb-xa + xb-BX
-                                    if sx != 0.0:
-                                            print( " SHIFTO DI " , sx)
-                                            isx = int(1000+sx)-1000
-                                            dsx = sx-isx
-                                            edfmats2use = (1.0-dsx) * np.roll(edfmats , isx , axis=-1)   + dsx *  np.roll(edfmats , isx+1 , axis=-1)
-
-                                    tmp = np.zeros_like(edfmats2use)
-                                    tmp[:,roixinds,roiyinds] = edfmats2use[:,roixinds,roiyinds]
+                                    print( " SHIFTO DI " , sx)
 
+                                    tmp = roi_inset( edfmats, roixinds, roiyinds, 0.0, sx )
                                     print( "E ENERGIA adesso "  , tmp.sum())
-                                    dimz,dimy,dimx = tmp.shape
-                                    BX = (tmp*np.arange(dimx)).sum()/tmp.sum()
-
+                                    BX, BY = roi_inset_baricenter( tmp, minx, miny )
                                     print( " original barix for zone ", ii, " : " , xa)
                                     print( " NOW actual / goal  : ", BX, xb)
 
                                     #############################################################
 
-                                    BY = (tmp*(np.arange(dimy)[:,None])).sum()/tmp.sum()
                                     print( " original bariy for zone ", ii, " : " , za  )
                                     print( " actual / goal  : ", BY, zb)
                                     sz = zb-za + zb-BY
-                                    if sz != 0.0:
-                                            print( " SHIFTO DI " , sz)
-                                            isz = int(1000+sz)-1000
-                                            dsz = sz-isz
-
-                                            edfmats2use = (1.0-dsz) * np.roll(edfmats2use , isz , axis=-2)   + dsz *  np.roll(edfmats2use , isz+1 , axis=-2)
+                                    print( " SHIFTO DI " , sz)
 
                                     shifts = np.array([sz,sx]) 
                                     self.recenterings[ii] = shifts
+                            else:
+                                    ## good shift is known in advance
+                                    sz,sx = self.recenterings[ii]
 
-                                    tmp = np.zeros_like(edfmats2use)
-                                    tmp[:,roixinds,roiyinds] = edfmats2use[:,roixinds,roiyinds]
-
-                                    print( "E ENERGIA adesso "  , tmp.sum())
-                                    dimz,dimy,dimx = tmp.shape
-                                    BX = (tmp*np.arange(dimx)).sum()/tmp.sum()
-                                    BY = (tmp*(np.arange(dimy)[:,None])).sum()/tmp.sum()
-
-                                    print( " original barix for zone ", ii, " : " , xa, za)
-                                    print( " NOW actual / goal  : ", BX, xb ," and ", BY, zb )
-
-                                                        
+                            inset = roi_inset( edfmats, roixinds, roiyinds, sz, sx )
+                            print( "E ENERGIA adesso "  , inset.sum())
                     else:
-                        edfmats2use = edfmats
-                                        
+                            inset = roi_inset( edfmats, roixinds, roiyinds )
+
                     axesrange = [0,roiyinds[-1],position[-1],position[0]]
-                    inset = np.zeros([edfmats2use.shape[0],
-                                      np.amax(roixinds)+1-minx,
-                                      np.amax(roiyinds)+1-miny  ])
-                    inset [:,roixinds-minx, roiyinds-miny ] =edfmats2use[:, roixinds , roiyinds ]
 
 
 
@@ -622,6 +582,43 @@ class image:
         pass
 
 
+def roi_inset(edfmats, roixinds, roiyinds, sz=0.0, sx=0.0):
+    """
+    Returns the stack edfmats restricted to the bounding box of the roi (zero outside the roi pixels),
+    after a shift of sz pixels along the rows and sx pixels along the columns, with linear
+    interpolation and periodic boundaries as np.roll. Only the pixels needed for the box are read.
+    """
+    minx, maxx = np.amin(roixinds), np.amax(roixinds)
+    miny, maxy = np.amin(roiyinds), np.amax(roiyinds)
+    isx = int(1000+sx)-1000
+    dsx = sx-isx
+    isz = int(1000+sz)-1000
+    dsz = sz-isz
+    # one more row and column before the box, for the interpolation
+    rows = (np.arange(minx-1, maxx+1) - isz) % edfmats.shape[-2]
+    cols = (np.arange(miny-1, maxy+1) - isx) % edfmats.shape[-1]
+    window = edfmats[:, rows[:,None], cols[None,:]]
+    if sx != 0.0:
+        window = (1.0-dsx) * window[:,:,1:] + dsx * window[:,:,:-1]
+    else:
+        window = window[:,:,1:]
+    if sz != 0.0:
+        window = (1.0-dsz) * window[:,1:] + dsz * window[:,:-1]
+    else:
+        window = window[:,1:]
+    inset = np.zeros([edfmats.shape[0], maxx+1-minx, maxy+1-miny])
+    inset[:, roixinds-minx, roiyinds-miny] = window[:, roixinds-minx, roiyinds-miny]
+    return inset
+
+def roi_inset_baricenter(inset, minx, miny):
+    """
+    Baricenter (column, row), in detector pixels, of an inset returned by roi_inset.
+    """
+    dimz,dimy,dimx = inset.shape
+    BX = (inset*(miny+np.arange(dimx))).sum()/inset.sum()
+    BY = (inset*((minx+np.arange(dimy))[:,None])).sum()/inset.sum()
+    return BX, BY
+
 def interpolate_image(oldx,oldy,oldIM,newx,newy):
     """
     2d interpolation
@@ -260,7 +260,7 @@ class Hydra:
         """
         self.roi_obj = roiobj
 
-    def load_scan( self, scan_numbers, scan_type='generic', direct=True, scaling=None, method='sum' ):
+    def load_scan( self, scan_numbers, scan_type='generic', direct=True, scaling=None, method='sum', chunk_size=None, cache=None, workers=None ):
         """**load_scan**
 
         Load a single or multiple scans.
@@ -271,8 +271,15 @@ class Hydra:
 
         Args:
               * scan_numbers (int or list): Integer or iterable of scan numbers to be loaded.
-              * scan_type            (str): String describing the scan to be loaded (e.g. 'edge1' or 'K-edge').
+              * scan_type    (str or list): String describing the scan to be loaded (e.g. 'edge1' or 'K-edge'),
+                or a list with one such string per scan.
               * direct           (boolean): Flag, 'True' if the EDF-files should be deleted after loading/integrating the scan.
+              * chunk_size           (int): If given, EDF-files are read and reduced in chunks of this many
+                files instead of loading the whole scan into memory (only with direct=True).
+              * cache   (xrs_scans.ScanCache): Cache of reduced scans; scans found in it are not re-read,
+                others are stored in it (only with direct=True).
+              * workers              (int): If given, the scans are distributed over this many local
+                processes (only with direct=True).
 
 
         """
@@ -289,21 +296,18 @@ class Hydra:
             print('Please run the get_compensation_factor method first for pixel-wise compensation.')
             return
 
-        # go throught list of scan_numbers and load scans
-        for number in numbers:
+        # load the scans (serially or over a pool of processes)
+        scans = xrs_scans.load_scans( self.path, self.SPECfname, self.EDFprefix, self.EDFname, self.EDFpostfix, numbers, \
+                scan_type=scan_type, workers=workers, direct=direct, roi_obj=self.roi_obj, scaling=scaling, \
+                en_column=self.en_column, moni_column=self.moni_column, method=method, \
+                cenom_dict=self.cenom_dict, comp_factor=self.comp_factor, chunk_size=chunk_size, cache=cache )
+
+        # go throught list of scan_numbers and store the scans
+        for number, scan in zip(numbers, scans):
 
             # create a name for each scan
             scan_name = 'Scan%03d' % number
 
-            # create an instance of the Scan class
-            scan = xrs_scans.Scan()
-
-            # load the scan
-            scan.load( self.path, self.SPECfname, self.EDFprefix, self.EDFname, self.EDFpostfix, number, \
-                direct=direct, roi_obj=self.roi_obj, scaling=scaling, scan_type=scan_type, \
-                en_column=self.en_column, moni_column=self.moni_column, method=method, \
-                cenom_dict=self.cenom_dict, comp_factor=self.comp_factor )
-
             # add it to the scans dict
             self.scans[scan_name] = scan
 
@@ -311,7 +315,7 @@ class Hydra:
             if not number in self.scan_numbers:
                 self.scan_numbers.extend([number])
 
-    def load_loop( self, beg_nums, num_of_regions, direct=True, method='sum' ):
+    def load_loop( self, beg_nums, num_of_regions, direct=True, method='sum', chunk_size=None, cache=None, workers=None ):
         """ **load_loop**
 
         Loads a whole loop of scans based on their starting numbers and
@@ -320,6 +324,7 @@ class Hydra:
         Args:
         beg_nums      (list): List of scan numbers of the first scans in each loop.
         num_of_regions (int): Number of scans in each loop.
+        workers        (int): If given, the scans are distributed over this many local processes.
 
         """
 
@@ -334,10 +339,7 @@ class Hydra:
 
         type_names = type_names*len(beg_nums)
 
-        for n in range(len(type_names)):
-            number = []
-            number.append(numbers[n])
-            self.load_scan( number, type_names[n], direct=True, method=method )
+        self.load_scan( numbers, type_names, direct=True, method=method, chunk_size=chunk_size, cache=cache, workers=workers )
 
     def delete_scan( self, scan_numbers ):
         """ **delete_scan**
@@ -547,26 +549,12 @@ class Hydra:
             self.E0      = np.mean(self.cenom_dict[first_key][self.cenom_dict[first_key] > 0.0])
             for key,ii in zip(sorted(self.cenom_dict), range(len(self.cenom_dict))):
                 print ('Pixel-by-pixel compensation for ' + key +'.')
-                signal = np.zeros(len(master_eloss))
-                error  = np.zeros(len(master_eloss))
-                for dim1 in range(self.cenom_dict[key].shape[0]):
-                    for dim2 in range(self.cenom_dict[key].shape[1]):
-                        x = ( self.energy - self.cenom_dict[key][dim1, dim2] )*1.0e3
-                        # signals
-                        y = self.raw_signals[key][:, dim1, dim2]
-                        #print "Y AMAX", signal.max()
-                        #rbfi    = Rbf( x, y, function='linear' )
-                        rbfi = interp1d(x, y,bounds_error=False, fill_value=0.0)
-                        #print "rbf AMAX", Rbf( x, y, function='linear' )
-                        #signal += rbfi( master_eloss )
-                        signal += rbfi( master_eloss )
-                        #print "SIGNAL AMAX", signal.max()
-                        # errors
-                        y = self.raw_errors[key][:, dim1, dim2]
-                        rbfi    = Rbf( x, y, function='linear' )
-                        error  += rbfi( master_eloss )**2
-                self.signals[:,ii] = signal
-                self.errors[:,ii]  = np.sqrt(error)
+                # shift all pixels of the ROI onto the master eloss scale at once
+                signal, error = xrs_utilities.interp_linear_shifted( self.energy*1.0e3, \
+                                    self.raw_signals[key], self.cenom_dict[key]*1.0e3, master_eloss, \
+                                    yerr=self.raw_errors[key], fill_value=0.0 )
+                self.signals[:,ii] = np.sum( signal, axis=1 )
+                self.errors[:,ii]  = np.sqrt( np.sum( error**2, axis=1 ) )
             self.eloss = master_eloss
 
         # 'row'
@@ -818,12 +806,7 @@ class Hydra:
         fname = self.path + self.SPECfname
 
         # go through the scans, find the EDF-files and copy them
-        for nscan in numbers:
-            if use_PyMca:
-                data, motors, counters = xrs_fileIO.PyMcaSpecRead(fname,nscan)
-            else:
-                data, motors, counters = xrs_fileIO.SpecRead(fname,nscan)
-
+        for data, motors, counters, lables in xrs_fileIO.IndexedSpecReadMany(fname,numbers):
             for m in range(len(counters['ccdno'])):
                 ccdnumber = counters['ccdno'][m]
                 edfname   = self.path + self.EDFprefix + self.EDFname + "%04d" % ccdnumber + self.EDFpostfix
@@ -1611,7 +1594,7 @@ class Fourc:
 		"""
 		self.roi_obj = roiobj
 
-	def load_scan( self, scan_numbers, direct=True, comp_factor=None, scan_type='generic', scaling=None, method='sum', rot_angles=None, clean_edf_stack=False ):
+	def load_scan( self, scan_numbers, direct=True, comp_factor=None, scan_type='generic', scaling=None, method='sum', rot_angles=None, clean_edf_stack=False, chunk_size=None, cache=None, workers=None ):
 		""" **load_scan**
 
 		Loads given scans and applies the dispersion compensation.
@@ -1624,6 +1607,12 @@ class Fourc:
 				the global compensation factor will be used. If provided, the global
 				compensation factor will be overwritten.
 			scan_type            (str): String describing the scan to be loaded.
+			chunk_size           (int): If given, EDF-files are read and reduced in
+				chunks of this many files (only with direct=True).
+			cache (xrs_scans.ScanCache): Cache of reduced scans (only with
+				direct=True).
+			workers              (int): If given, the scans are distributed over
+				this many local processes (only with direct=True).
 
 		Note:
 			If a compensation factor is passed to this function, the classes 'globel'
@@ -1638,22 +1627,19 @@ class Fourc:
 		else:
 			numbers = scan_numbers
 
-		# load scan/scans
-		for number in numbers:
+		# load scan/scans, first column in SPEC file will be scanned motor
+		scans = xrs_scans.load_scans( self.path, self.SPECfname, self.EDFprefix, self.EDFname, \
+			self.EDFpostfix, numbers, scan_type=scan_type, workers=workers, direct=direct, \
+			roi_obj=self.roi_obj, scaling=scaling, en_column=self.en_column, \
+			moni_column=self.moni_column, method=method, cenom_dict=self.cenom_dict,\
+			comp_factor=comp_factor,rot_angles=rot_angles, clean_edf_stack=clean_edf_stack, \
+			chunk_size=chunk_size, cache=cache )
+
+		for number, scan in zip(numbers, scans):
 
 			# create a name for each scan
 			scan_name = 'Scan%03d' % number
 
-			# create an instance of the Scan class
-			scan      = xrs_scans.Scan()
-
-			# load scan, first column in SPEC file will be scanned motor
-			scan.load( self.path, self.SPECfname, self.EDFprefix, self.EDFname, \
-				self.EDFpostfix, number, direct=direct, roi_obj=self.roi_obj, \
-				scaling=scaling, scan_type=scan_type, en_column=self.en_column, \
-				moni_column=self.moni_column, method=method, cenom_dict=self.cenom_dict,\
-				comp_factor=comp_factor,rot_angles=rot_angles, clean_edf_stack=clean_edf_stack )
-
 			# assign one dictionary entry to each scan
 			self.scans[scan_name] = scan
 			if not number in self.scan_numbers:
@@ -2034,12 +2020,7 @@ class Fourc:
 		fname = self.path + self.SPECfname
 
 		# find EDF-file names and copy them
-		for nscan in numbers:
-			if use_PyMca:
-				data, motors, counters = xrs_fileIO.PyMcaSpecRead(fname,nscan)
-			else:
-				data, motors, counters = xrs_fileIO.SpecRead(fname,nscan)
-
+		for data, motors, counters, lables in xrs_fileIO.IndexedSpecReadMany(fname,numbers):
 			for m in range(len(counters['ccdno'])):
 				ccdnumber = counters['ccdno'][m]
 				edfname   = self.path + self.EDFprefix + self.EDFname + "%04d" % ccdnumber + self.EDFpostfix
@@ -2320,10 +2301,7 @@ class read_id20:
 
     def read_just_first_scanimage(self,scannumber):
         fn = self.path + self.filename
-        if use_PyMca == True:
-            data, motors, counters, lables = xrs_fileIO.PyMcaSpecRead_my(fn,scannumber)
-        else:
-            data, motors, counters = xrs_fileIO.SpecRead(fn,scannumber)
+        data, motors, counters, lables = xrs_fileIO.IndexedSpecRead(fn,scannumber)
 
         edfmat  =  xrs_fileIO.ReadEdf_justFirstImage(counters['ccdno'],
                                                      self.path,
@@ -2353,10 +2331,7 @@ class read_id20:
 
         # load SPEC-file
         fn = self.path + self.filename
-        if use_PyMca == True:
-            data, motors, counters, lables = xrs_fileIO.PyMcaSpecRead_my(fn,scannumber)
-        else:
-            data, motors, counters = xrs_fileIO.SpecRead(fn,scannumber)
+        data, motors, counters, lables = xrs_fileIO.IndexedSpecRead(fn,scannumber)
 
         # load EDF-files
         if not self.single_image:
@@ -2411,7 +2386,7 @@ class read_id20:
         # load SPEC-file
         fn = self.path + self.filename
         # print( " READING ", fn, scannumber)
-        data, motors, counters = xrs_utilities.specread(fn,scannumber)
+        data, motors, counters = xrs_fileIO.SpecRead(fn,scannumber)
 
         if not self.single_image:
             # initiate arrays for the edf-files
@@ -2626,7 +2601,7 @@ class read_id20:
         for scan in self.scans:
             if len(self.scans[scan].edfmats):
                 print ("integrating "+scan)
-                self.scans[scan].applyrois(self.roi_obj.indices)
+                self.scans[scan].applyrois(self.roi_obj.indices,roi_obj=self.roi_obj)
 
     def getrawdata_pixelwise(self):
         """
@@ -2651,13 +2626,14 @@ class read_id20:
             sum[:] += edfmats.sum(axis=0)
         return sum
 
-    def loadscandirect(self,scannumbers,scantype='generic',fromtofile=False,scaling=None):
+    def loadscandirect(self,scannumbers,scantype='generic',fromtofile=False,scaling=None,cache=None):
         """
         Loads a scan without saving the edf files in matrices.
         scannumbers = integer or list of integers defining the scannumbers from the SPEC file
         scantype    = string describing the scan to be loaded (e.g. 'edge1' or 'K-edge')
         fromtofile  = boolean flag, 'True' if the scan should be saved in a pickle-file (this is developmental)
         scaling     = list of scaling factors to be applied, one for each ROI defined
+        cache       = instance of xrs_scans.ScanCache, reduced scans found in it are not re-read
         """
         # make sure scannumbers are iterable (list)
         if not isinstance(scannumbers,list):
@@ -2671,6 +2647,22 @@ class read_id20:
             return
         for number in scannums:
             scanname = 'Scan%03d' % number
+            if cache is not None:
+                cache_key = cache.get_key(self.path + self.filename, number, roi_obj=self.roi_obj, method='sum', \
+                                          scaling=scaling, edf=self.path + self.EDF_PREFIX + self.edfName + self.EDF_POSTFIX)
+                entry = cache.get(cache_key)
+                if entry is not None:
+                    print( 'Loading reduced scan No. %03d from cache.' % number )
+                    counters = entry['counters']
+                    onescan  = xrs_scans.scan([],number,counters[self.encolumn],counters[self.monicolumn],\
+                                              counters,entry['motors'],entry['data'],scantype)
+                    onescan.signals = entry['signals']
+                    onescan.errors  = entry['errors']
+                    onescan.edfmats = []
+                    self.scans[scanname] = onescan
+                    if not number in self.scannumbers:
+                        self.scannumbers.extend([number])
+                    continue
             data, motors, counters, edfmats = self.readscan(number,fromtofile)
             # can assign some things here already (even if maybe redundant)
             monitor   = counters[self.monicolumn]
@@ -2680,11 +2672,14 @@ class read_id20:
 
             onescan = xrs_scans.scan(edfmats,number,energy,monitor,counters,motors,data,scantype)
 
-            onescan.applyrois(self.roi_obj.indices,scaling=scaling)
+            onescan.applyrois(self.roi_obj.indices,scaling=scaling,roi_obj=self.roi_obj)
 
             print( 'Deleting -- EDF-files of Scan No. %03d' % number )
             onescan.edfmats = [] # delete the edfmats
             self.scans[scanname] = onescan
+            if cache is not None:
+                cache.put(cache_key, {'signals':onescan.signals, 'errors':onescan.errors, 'data':data, \
+                                      'counters':counters, 'motors':motors})
 
     def loadloopdirect(self,begnums,numofregions,fromtofile=False,scaling=None):
         """
@@ -2933,9 +2928,10 @@ class read_id20:
         else:
             numbers = scannumbers
         fn = self.path + self.filename
+        spec_scans = xrs_fileIO.IndexedSpecReadMany(fn,numbers)
         if not self.single_image:
             for n in range(len(numbers)):
-                data, motors, counters = xrs_utilities.specread(fn,numbers[n])
+                data, motors, counters, lables = spec_scans[n]
                 for m in range(len(counters['ccdno'])):
                     ccdnumber = counters['ccdno'][m]
                     edfnameh   = self.path + self.EDF_PREFIXh + self.filename + '_' + "%04d" % ccdnumber + self.EDF_POSTFIX
@@ -2944,7 +2940,7 @@ class read_id20:
                     shutil.copy2(edfnamev, destdir)
         if self.single_image:
             for n in range(len(numbers)):
-                data, motors, counters = xrs_utilities.specread(fn,numbers[n])
+                data, motors, counters, lables = spec_scans[n]
                 for m in range(len(counters['ccdno'])):
                     ccdnumber = counters['ccdno'][m]
                     edfname   = self.path + self.EDF_PREFIX + self.filename + '_' + "%04d" % ccdnumber + self.EDF_POSTFIX
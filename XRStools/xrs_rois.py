@@ -43,6 +43,7 @@ import numpy as np
 import copy
 import h5py
 import os
+import hashlib
 import matplotlib.pyplot as plt
 
 # commented the *import because otherwise sphinx documents all the symbol of other packages 
@@ -56,6 +57,7 @@ from . import math_functions
 from matplotlib.widgets import Cursor, Button
 from scipy.ndimage import measurements
 from scipy import signal
+from scipy import sparse
 
 
 def h5_assign_force(h5group, name, item):
@@ -164,6 +166,45 @@ def get_geo_informations(shape):
     return geo_informations[shape]
 
 
+class roi_integration_plan:
+    """
+    Precompiled recipe for applying the ROIs of a roi_object to detector images.
+
+    For each ROI (in sorted key order) the bounding box slices into the
+    detector image and the normalized weights (M/M.max()) are computed once,
+    so that a whole stack of images can be reduced with batched numpy operations.
+
+    Args:
+      * red_rois (dict): Reduced ROIs ( key : [ corner, mask ] ) of a roi_object.
+    """
+    def __init__(self, red_rois):
+        self.keys      = sorted(red_rois)
+        self.positions = {}
+        self.slices    = {}
+        self.weights   = {}
+        for key in self.keys:
+            pos, M = red_rois[key]
+            S = M.shape
+            self.positions[key] = pos
+            self.slices[key]    = (slice( pos[0], pos[0]+(S[0]) ), slice( pos[1], pos[1]+(S[1]) ))
+            self.weights[key]   = M/M.max()
+        self.signature = red_rois_signature(red_rois)
+
+def red_rois_signature(red_rois):
+    """
+    Returns a hex digest of the content of a red_rois dictionary (keys, corners
+    and mask values), used to detect ROIs that were replaced or edited in place
+    behind the back of a roi_object. The masks are small bounding boxes, so
+    hashing them costs far less than reducing a stack of images.
+    """
+    digest = hashlib.sha1()
+    for key in sorted(red_rois):
+        pos, M = red_rois[key]
+        M = np.ascontiguousarray(M)
+        digest.update( repr( (key, [int(p) for p in pos], M.shape, M.dtype.str) ).encode('utf-8') )
+        digest.update( M.tobytes() )
+    return digest.hexdigest()
+
 class roi_object:
     """
     Container class to hold all relevant information about given ROIs.
@@ -178,10 +219,130 @@ class roi_object:
         self.y_indices      = [] # list of numpy arrays of y-indices (for each ROI)
         self.masks          = [] # 3D numpy array with slices of zeros and ones (same size as detector image) for each roi
         self.input_image    = [] # 2D imput image that was used to define the ROIs
-        
+        self._integration_plan = None # cached roi_integration_plan, see get_integration_plan()
+        self._projectors       = {}   # cached sparse projectors, see get_projector()
+
+    def invalidate_cache(self):
+        """ **invalidate_cache**
+        Drops everything that was precomputed from the current ROIs. The caches
+        are also checked against the content of red_rois (see red_rois_signature),
+        so that ROIs replaced or edited in place are never served stale.
+        """
+        self._integration_plan = None
+        self._projectors       = {}
+
+    def get_integration_plan(self):
+        """ **get_integration_plan**
+        Returns the (cached) roi_integration_plan of the current ROIs.
+        """
+        plan = getattr(self, '_integration_plan', None)
+        if plan is None or plan.signature != red_rois_signature(self.red_rois):
+            plan = roi_integration_plan(self.red_rois)
+            self._integration_plan = plan
+        return plan
+
+    def get_hash(self):
+        """ **get_hash**
+        Returns a hex digest identifying the current ROIs (keys, corners and masks).
+        """
+        return red_rois_signature(self.red_rois)
+
+    def get_projector(self, image_shape=None, normalize=True):
+        """ **get_projector**
+        Returns a (cached) sparse matrix projecting flattened detector images onto the ROIs.
+        The cache is rebuilt whenever the keys, corners or mask values of red_rois change.
+
+        The matrix has one row per ROI (in sorted key order, see get_roi_keys) and one
+        column per detector pixel, so that the ROI sums of a whole stack of images are
+        obtained as a single sparse matrix product::
+
+            signals = projector.dot( edfmats.reshape(len(edfmats), -1).T ).T
+
+        Args:
+          * image_shape (tuple) : Shape of the detector images (default is the shape of
+            the roi_matrix).
+          * normalize (boolean) : If 'True', each ROI mask M is weighted as M/M.max(),
+            otherwise the raw mask values are used.
+
+        Returns:
+          * projector (scipy.sparse.csr_matrix) : (number of ROIs) x (number of pixels).
+        """
+        if image_shape is None:
+            image_shape = np.shape(self.roi_matrix)
+        image_shape = tuple(int(n) for n in image_shape)
+        if len(image_shape) != 2:
+            raise ValueError('An image_shape is needed to build the projector of ROIs without roi_matrix.')
+
+        signature = red_rois_signature(self.red_rois)
+        projectors = getattr(self, '_projectors', None)
+        if projectors is None:
+            projectors = self._projectors = {}
+        cached = projectors.get((image_shape, normalize))
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        rows    = []
+        columns = []
+        weights = []
+        for n, key in enumerate(sorted(self.red_rois)):
+            pos, M = self.red_rois[key]
+            M = np.asarray(M)
+            if not M.size or not M.any():
+                continue
+            iy, ix = np.nonzero(M)
+            w      = M[iy, ix].astype(float)
+            if normalize:
+                w /= M.max()
+            iy = iy + int(pos[0])
+            ix = ix + int(pos[1])
+            inside = (iy >= 0) & (iy < image_shape[0]) & (ix >= 0) & (ix < image_shape[1])
+            rows.append(np.full(np.count_nonzero(inside), n))
+            columns.append(np.ravel_multi_index((iy[inside], ix[inside]), image_shape))
+            weights.append(w[inside])
+
+        if rows:
+            rows, columns, weights = np.concatenate(rows), np.concatenate(columns), np.concatenate(weights)
+        projector = sparse.csr_matrix( (weights, (rows, columns)), \
+                                       shape=(len(self.red_rois), image_shape[0]*image_shape[1]) )
+        projectors[(image_shape, normalize)] = (signature, projector)
+        return projector
+
+    def get_roi_keys(self):
+        """ **get_roi_keys**
+        Returns the ROI keys in the order of the rows of the projector.
+        """
+        return sorted(self.red_rois)
+
+    def project(self, edfmats, normalize=True):
+        """ **project**
+        Sums all ROIs of a stack of images with one sparse matrix product.
+
+        Args:
+          * edfmats (np.array) : Stack of images (frames x detector) or a single image.
+          * normalize (boolean) : See get_projector.
+
+        Returns:
+          * signals (np.array) : (number of frames) x (number of ROIs), columns in the
+            order of get_roi_keys.
+        """
+        edfmats = np.asarray(edfmats)
+        single  = (edfmats.ndim == 2)
+        if single:
+            edfmats = edfmats[None]
+        projector = self.get_projector(edfmats.shape[1:], normalize=normalize)
+        # gather only the ROI pixels before the product, not the whole detector
+        pixels    = edfmats.reshape(len(edfmats), -1)[:, projector.indices]
+        compact   = sparse.csr_matrix( (projector.data, np.arange(projector.nnz), projector.indptr), \
+                                       shape=(projector.shape[0], projector.nnz) )
+        signals   = np.asarray(compact.dot( pixels.T )).T
+        if single:
+            return signals[0]
+        return signals
+
     def load_rois_fromMasksDict(self, masksDict, newshape=None, kind="zoom"):
         self.kind=kind
         self.red_rois = masksDict
+        self.invalidate_cache()
         if newshape is not None:
             self.roi_matrix = np.zeros(newshape)
         self.roi_matrix = convert_redmatrix_to_matrix( masksDict,self.roi_matrix , offsetX=0, offsetY=0)
@@ -249,6 +410,7 @@ class roi_object:
         self.masks          = convert_roi_matrix_to_masks(self.roi_matrix)
                 
     def append(self,roi_object):
+        self.invalidate_cache()
         orig_length = len(self.red_rois)
         self.indices.extend(roi_object.indices) # list of list of tuples (one list of tuples for each ROI)
         self.number_of_rois =+ roi_object.number_of_rois  # number of ROIs defined
@@ -294,12 +456,25 @@ class roi_object:
         Strips extra zeros out of ROIs.
 
         """
-        pass
+        for key, (pos, M) in list(self.red_rois.items()):
+            if not M.size or not M.any():
+                continue
+            iy, ix = np.nonzero(M)
+            y0, y1 = iy.min(), iy.max()+1
+            x0, x1 = ix.min(), ix.max()+1
+            if (y0, x0) == (0, 0) and (y1, x1) == M.shape:
+                continue
+            self.red_rois[key] = [ (pos[0]+y0, pos[1]+x0), M[y0:y1, x0:x1].copy() ]
+        self.invalidate_cache()
 
     def delete_empty_rois(self):
         """ **delete_empty_rois**
+        Removes ROIs without any pixel from red_rois.
         """
-        pass
+        for key, (pos, M) in list(self.red_rois.items()):
+            if not M.size or not M.any():
+                del self.red_rois[key]
+        self.invalidate_cache()
     
     def shift_rois(self,shiftVal,direction='horiz',whichroi=None):
         """
@@ -336,6 +511,7 @@ class roi_object:
                 the_indices.append(oneroi)
 
         self.indices = the_indices
+        self.invalidate_cache()
 
         self.roi_matrix     = convert_inds_to_matrix(self.indices,self.input_image.shape)
         self.red_rois       = convert_matrix_to_redmatrix(self.roi_matrix)
@@ -469,12 +645,22 @@ def convert_roi_matrix_to_masks(roi_matrix):
 
     roi_masks = np.zeros((int(np.amax(roi_matrix)),roi_matrix.shape[0],roi_matrix.shape[1]))
 
-    for ii in range(int(np.amax(roi_matrix))):
-        inds = np.where(roi_matrix[:,:] == ii+1)
-        for jj in range(len(inds[0])):
-            roi_masks[ii,inds[0][jj],inds[1][jj]] = ii+1
+    labels, inds = _label_pixels(roi_matrix)
+    roi_masks[labels-1, inds[0], inds[1]] = labels
     return roi_masks
 
+def _label_pixels(roi_matrix):
+    """
+    Returns the labels 1..n of all the pixels belonging to a ROI and their
+    coordinates, sorted by label and, inside each ROI, in row major order.
+    """
+    number_of_rois = int(np.amax(roi_matrix))
+    flat   = np.asarray(roi_matrix).ravel()
+    pixels = np.flatnonzero( (flat >= 1) & (flat <= number_of_rois) & (flat == np.floor(flat)) )
+    labels = flat[pixels].astype(int)
+    order  = np.argsort(labels, kind='mergesort')
+    return labels[order], np.unravel_index(pixels[order], np.shape(roi_matrix))
+
 def convert_matrix_rois_to_inds(roi_matrix):
     """
     Converts a 2D ROI matrix with zeros, ones, twos, ..., n's (where n is the number of ROIs) to
@@ -482,11 +668,10 @@ def convert_matrix_rois_to_inds(roi_matrix):
     """
     rois = []
     number_of_rois = int(np.amax(roi_matrix))
+    labels, inds = _label_pixels(roi_matrix)
+    bounds = np.searchsorted(labels, np.arange(1, number_of_rois+2))
     for ii in range(int(number_of_rois)):
-        inds = np.where(roi_matrix[:,:] == ii+1)
-        oneroi = []
-        for i in range(len(inds[0])):
-            oneroi.append( (inds[0][i],inds[1][i]) )        
+        oneroi = list(zip( inds[0][bounds[ii]:bounds[ii+1]], inds[1][bounds[ii]:bounds[ii+1]] ))
         rois.append(oneroi)
     return rois
 
@@ -43,6 +43,15 @@ import numpy as np
 from . import xrs_utilities, math_functions, xrs_fileIO, xrs_rois
 import h5py
 import os
+import glob
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+# shared memory is used to hand reduced scans back from worker processes (Python >= 3.8)
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
 
 from itertools import groupby
 from scipy import optimize
@@ -119,7 +128,8 @@ class Scan:
     def load( self, path, SPECfname, EDFprefix, EDFname, EDFpostfix, scan_number, \
                 direct=False, roi_obj=None, scaling=None, scan_type='generic', \
                 en_column=None, moni_column='izero', method='sum', comp_factor=None,\
-                rot_angles=None, clean_edf_stack=False, cenom_dict=None,storeInsets = False
+                rot_angles=None, clean_edf_stack=False, cenom_dict=None,storeInsets = False,
+                chunk_size=None, cache=None
     ):
         """ **load**
 
@@ -138,26 +148,44 @@ class Scan:
             direct  (boolean): If 'True', all EDF-files will be deleted after loading the scan.
             method      (str): Keyword specifying the selected choice of data treatment:
                 can be 'sum', 'row', 'pixel', or 'column'. Default is 'sum'.
+            chunk_size  (int): If given together with 'direct' and a roi_obj, the EDF-files
+                are read and reduced in chunks of this many files, so that the full stack
+                of images is never held in memory (default is 'None').
+            cache  (instance): Instance of the 'ScanCache' class. If given together with 'direct'
+                and a roi_obj, the reduced scan is taken from (or stored into) the cache.
 
         """
-        print( 'Parsing EDF- and SPEC-files of scan No. %s.' % scan_number)
-
         self.scan_number = scan_number
-
-        # load SPEC-file
         fname = os.path.join(path , SPECfname)
-        if use_PyMca == True:
-            spec_data, self.motors, self.counters, lables = xrs_fileIO.PyMcaSpecRead_my(fname,scan_number)
-        else:
-            spec_data, self.motors, self.counters = xrs_fileIO.SpecRead(fname,scan_number)
 
-        # assign values, energy only if en_column is specified, first counter in SPECfile otherwise
-        if en_column:
-            self.energy     = np.array(self.counters[en_column.lower()])
-            self.scan_motor = en_column.lower()
+        # look for the reduced scan in the cache (if applicable)
+        entry = None
+        use_cache = cache is not None and direct and isinstance( roi_obj, xrs_rois.roi_object )
+        if use_cache:
+            cache_key = cache.get_key( fname, scan_number, roi_obj=roi_obj, method=method, scaling=scaling, \
+                                       edf=os.path.join(path, EDFprefix + EDFname + EDFpostfix), en_column=en_column, \
+                                       moni_column=moni_column, rot_angles=rot_angles, clean_edf_stack=clean_edf_stack )
+            entry = cache.get( cache_key )
+
+        if entry is not None:
+            print( 'Loading reduced scan No. %s from cache.' % scan_number)
+            self.motors     = entry['motors']
+            self.counters   = entry['counters']
+            self.energy     = np.array(entry['energy'])
+            self.scan_motor = entry['scan_motor']
         else:
-            self.energy     = np.array(self.counters[lables[0].lower()])
-            self.scan_motor = lables[0].lower()
+            print( 'Parsing EDF- and SPEC-files of scan No. %s.' % scan_number)
+
+            # load SPEC-file (through the SPEC index, the file is only parsed once)
+            spec_data, self.motors, self.counters, lables = xrs_fileIO.IndexedSpecRead(fname,scan_number)
+
+            # assign values, energy only if en_column is specified, first counter in SPECfile otherwise
+            if en_column:
+                self.energy     = np.array(self.counters[en_column.lower()])
+                self.scan_motor = en_column.lower()
+            else:
+                self.energy     = np.array(self.counters[lables[0].lower()])
+                self.scan_motor = lables[0].lower()
 
         # normalization
         the_moni        = np.array(self.counters[moni_column.lower()])
@@ -175,20 +203,39 @@ class Scan:
         # assign the scan type
         self.scan_type  = scan_type
 
-        # load EDF-files
-        if use_PyMca == True:
-            self.edfmats = xrs_fileIO.ReadEdfImages_PyMca( self.counters['ccdno'], path, EDFprefix, EDFname, EDFpostfix)
+        if entry is not None:
+            self.raw_signals = entry['raw_signals']
+            self.raw_errors  = entry['raw_errors']
+            self.used_masks  = dict( (key, (pos, M)) for key, (pos, M) in roi_obj.red_rois.items() )
+            self.__signals_normalized__ = True
+
+        # stream EDF-files through the ROIs (if applicable)
+        elif chunk_size and direct and isinstance( roi_obj, xrs_rois.roi_object ):
+            fnames = [ path + EDFprefix + EDFname + "%04d" % ccdnumber + EDFpostfix for ccdnumber in self.counters['ccdno'] ]
+            self.get_raw_signals_streamed( fnames, roi_obj, method=method, scaling=scaling, rot_angles=rot_angles, \
+                                           storeInsets=storeInsets, chunk_size=chunk_size, clean_edf_stack=clean_edf_stack )
         else:
-            self.edfmats = xrs_fileIO.ReadEdfImages_my( self.counters['ccdno'], path, EDFprefix, EDFname, EDFpostfix )
+            # load EDF-files
+            if use_PyMca == True:
+                self.edfmats = xrs_fileIO.ReadEdfImages_PyMca( self.counters['ccdno'], path, EDFprefix, EDFname, EDFpostfix)
+            else:
+                self.edfmats = xrs_fileIO.ReadEdfImages_my( self.counters['ccdno'], path, EDFprefix, EDFname, EDFpostfix )
 
-        # remove totally saturated images
-        if clean_edf_stack:
-            self.edfmats = edf_cleaner(self.edfmats, 1.0e8)
+            # remove totally saturated images
+            if clean_edf_stack:
+                self.edfmats = edf_cleaner(self.edfmats, 1.0e8)
 
-        # apply ROIs (if applicable)
-        if direct and isinstance( roi_obj, xrs_rois.roi_object ):
-            self.get_raw_signals( roi_obj, method=method, scaling=scaling, rot_angles=rot_angles , storeInsets = storeInsets)
+            # apply ROIs (if applicable)
+            if direct and isinstance( roi_obj, xrs_rois.roi_object ):
+                self.get_raw_signals( roi_obj, method=method, scaling=scaling, rot_angles=rot_angles , storeInsets = storeInsets)
+
+        # store the reduced scan in the cache
+        if use_cache and entry is None and self.raw_signals:
+            cache.put( cache_key, { 'raw_signals':self.raw_signals, 'raw_errors':self.raw_errors, \
+                                    'energy':self.energy, 'scan_motor':self.scan_motor, \
+                                    'counters':self.counters, 'motors':self.motors } )
 
+        if direct and isinstance( roi_obj, xrs_rois.roi_object ):
             if method == 'row':
                 self.get_signals( method='row', comp_factor=comp_factor, scaling=scaling )
             elif method == 'sum':
@@ -308,134 +355,72 @@ class Scan:
             None if there are not EDF-files to apply the ROIs to.
 
         """
+        reduced = integrate_rois( self.edfmats, self.monitor, roi_obj, method=method, \
+                                  rot_angles=rot_angles, storeInsets=storeInsets )
+        if reduced is None:
+            return
+        self.assign_raw_signals( roi_obj, reduced, scaling=scaling )
 
+    def get_raw_signals_streamed( self, fnames, roi_obj, method='sum', scaling=None, rot_angles=None, \
+                                  storeInsets=False, chunk_size=16, clean_edf_stack=False ):
+        """ **get_raw_signals_streamed**
 
-        self.used_masks={}
+        Applies given ROIs to EDF-images that are read chunk by chunk.
 
-        if storeInsets:
-            self.insets={}
-            for key, (pos, M) in roi_obj.red_rois.items():
-                S     = M.shape
-                self.insets[key] =  np.zeros(   [  len(self.edfmats), S[0] , S[1] ],  self.edfmats.dtype   ) 
+        Same as 'get_raw_signals', but the EDF-files are read in chunks of
+        'chunk_size' frames, each chunk is reduced against the ROIs and
+        discarded before the next one is read. The peak memory is thus set
+        by the chunk size and not by the length of the scan.
 
+        Args:
+            fnames      (list): EDF file names (incl. path), one per scan point.
+            roi_obj (instance): Instance of the 'XRStools.xrs_rois.roi_object' class defining the ROIs.
+            method    (string): Keyword specifying the selected choice of data treatment:
+                can be 'sum', 'row', 'pixel', or 'column'. Default is 'sum'.
+            scaling (np.array): Array of float-type scaling factors (factor for each ROI).
+            chunk_size   (int): Number of EDF-files read and reduced at once.
+            clean_edf_stack (boolean): If 'True', totally saturated images are replaced
+                (within each chunk).
 
-        for ii in range(len(self.edfmats)):
-            for key, (pos, M) in roi_obj.red_rois.items():
-                S     = M.shape
-                inset = (slice( pos[0], pos[0]+(S[0]) ), slice( pos[1], pos[1]+(S[1]) ))
-                self.used_masks[key] = (   pos, M )
-                if storeInsets:
-                    self.insets[key][ii] = self.edfmats[ii, inset[0], inset[1]] * (M/M.max())
+        """
+        # native type of the files (e.g. uint16) unless the stack is cleaned,
+        # edf_cleaner averages neighbouring images in place
+        dtype = np.float64 if clean_edf_stack else None
+        chunks = []
+        for start in range(0, len(fnames), chunk_size):
+            edfmats = xrs_fileIO.ReadEdfStack( fnames[start:start+chunk_size], dtype=dtype, verbose=False )
+            if clean_edf_stack:
+                edfmats = edf_cleaner( edfmats, 1.0e8 )
+            reduced = integrate_rois( edfmats, self.monitor[start:start+chunk_size], roi_obj, method=method, \
+                                      rot_angles=rot_angles, storeInsets=storeInsets )
+            del edfmats
+            if reduced is None:
+                return
+            chunks.append( reduced )
 
-                
-        # sum
-        if method == 'sum':
-            print('selected method is \'sum\': summing up pixels from each ROI.')
-            signals = {} # dict (one entry per ROI, with vector (one entry per energy point))
-            errors  = {} # sqrt of the sum of counts
-            for key, (pos, M) in roi_obj.red_rois.items():
-                signals[key] = np.zeros((len(self.energy)))
-                errors[key]  = np.zeros((len(self.energy)))
-
-            for ii in range(len(self.edfmats)):
-                ind = 0
-                for key, (pos, M) in roi_obj.red_rois.items():
-                    S     = M.shape
-                    inset = (slice( pos[0], pos[0]+(S[0]) ), slice( pos[1], pos[1]+(S[1]) ))
-                    
-                    signals[key][ii] = np.sum( self.edfmats[ii, inset[0], inset[1]] * (M/M.max()))
-                    errors[key][ii]  = np.sqrt(signals[key][ii])
-                    signals[key][ii] /= self.monitor[ii]
-                    errors[key][ii]  /= self.monitor[ii]
-                    ind += 1
-
-        # row
-        elif method == 'row':
-            print('selected method is \'row\': summing over non-dispersive direction for each ROI.')
-            signals = {} # dict (one entry per ROI, with 2D matrix (energy vs row))
-            errors  = {} # sqrt of the sum of counts
-            rot_angles_dict = {} # put possible rotation angles into dict
-            counter = 0
-            for key, (pos, M) in sorted(roi_obj.red_rois.items()):
-                signals[key] = np.zeros((len(self.energy), M.shape[0]))
-                errors[key]  = np.zeros((len(self.energy), M.shape[0]))
-                if rot_angles is not None:
-                    rot_angles_dict[key] = rot_angles[counter]
-                    counter += 1
-
-            for ii in range(len(self.edfmats)):
-                ind = 0
-                for key, (pos, M) in roi_obj.red_rois.items():
-                    S     = M.shape
-                    inset = (slice( pos[0], pos[0]+(S[0]) ), slice( pos[1], pos[1]+(S[1]) ))
-                    
-                    
-                    # rotate raw_signals and raw_errors if method is 'line' and angles are provided
-                    if rot_angles:
-                        if len(roi_obj.red_rois) is not len(rot_angles):
-                            print('Only %d rotation angles provided for %d ROIs. Will end here.'%(len(rot_angles), len(self.raw_signals)))
-                            return
-
-                        # rotate images before summation
-                        orig_slice    = self.edfmats[ii, inset[0], inset[1]] * (M/M.max())
-                        slice_for_sum = ndimage.interpolation.rotate( orig_slice, rot_angles_dict[key],\
-                                        reshape=False, order=0, mode='constant' )
-                    else:
-                        slice_for_sum = self.edfmats[ii, inset[0], inset[1]] * (M/M.max())
-                    signals[key][ii,:] = np.sum( slice_for_sum , axis=1)
-                    errors[key][ii,:]  = np.sqrt(signals[key][ii,:])
-                    signals[key][ii,:] /= self.monitor[ii]
-                    errors[key][ii,:]  /= self.monitor[ii]
-                    ind += 1
-
-        # column
-        elif method == 'column':
-            print('selected method is \'column\': summing over dispersive direction for each ROI.')
-            signals = {} # dict (one entry per ROI, with 2D matrix (energy vs row))
-            errors  = {} # sqrt of the sum of counts
-            for key, (pos, M) in roi_obj.red_rois.items():
-                signals[key] = np.zeros((len(self.energy), M.shape[1]))
-                errors[key]  = np.zeros((len(self.energy), M.shape[1]))
-
-            for ii in range(len(self.edfmats)):
-                ind = 0
-                for key, (pos, M) in roi_obj.red_rois.items():
-                    S     = M.shape
-                    inset = (slice( pos[0], pos[0]+(S[0]) ), slice( pos[1], pos[1]+(S[1]) ))
-
-                    
-                    signals[key][ii,:] = np.sum( self.edfmats[ii, inset[0], inset[1]] * (M/M.max()), axis=0)
-                    errors[key][ii,:]  = np.sqrt( signals[key][ii,:] )
-                    signals[key][ii,:] /= self.monitor[ii]
-                    errors[key][ii,:]  /= self.monitor[ii]
-                    ind += 1
-
-        # pixel
-        elif method == 'pixel' or method == 'pixel2':
-            print('selected method is \'pixel\': returning ROI pixel-by-pixel.')
-            signals = {} # dict (one entry per ROI, with 3D matrix (energy vs pixel_0 vs pixel_1))
-            errors  = {} # sqrt of the sum of counts
-            for key, (pos, M) in roi_obj.red_rois.items():
-                signals[key] = np.zeros((len(self.energy), M.shape[0], M.shape[1]))
-                errors[key]  = np.zeros((len(self.energy), M.shape[0], M.shape[1]))
-
-            for ii in range(len(self.edfmats)):
-                ind = 0
-                for key, (pos, M) in roi_obj.red_rois.items():
-                    S     = M.shape
-                    inset = (slice( pos[0], pos[0]+(S[0]) ), slice( pos[1], pos[1]+(S[1]) ))
-
-                    
-                    signals[key][ii,:,:] = self.edfmats[ii, inset[0], inset[1]] * (M/M.max())
-                    errors[key][ii,:,:]  = np.sqrt( signals[key][ii,:,:]  )
-                    signals[key][ii,:,:] /= self.monitor[ii]
-                    errors[key][ii,:,:]  /= self.monitor[ii]
-                    ind += 1
-
-        # unknown method
-        else:
-            print( 'Unknown integration method. Use either \'sum\', \'row\', or \'pixel\'.' )
-            return
+        # stitch the chunks back together along the scan direction
+        reduced = tuple( dict( (key, np.concatenate([chunk[ii][key] for chunk in chunks])) \
+                               for key in chunks[0][ii] ) for ii in range(3) )
+        self.assign_raw_signals( roi_obj, reduced, scaling=scaling )
+
+    def assign_raw_signals( self, roi_obj, reduced, scaling=None ):
+        """ **assign_raw_signals**
+
+        Stores the output of 'integrate_rois' as raw_signals and raw_errors.
+
+        Args:
+            roi_obj (instance): Instance of the 'XRStools.xrs_rois.roi_object' class defining the ROIs.
+            reduced    (tuple): Dictionaries of signals, errors and insets as returned by 'integrate_rois'.
+            scaling (np.array): Array of float-type scaling factors (factor for each ROI).
+
+        """
+        signals, errors, insets = reduced
+
+        self.used_masks = {}
+        for key, (pos, M) in roi_obj.red_rois.items():
+            self.used_masks[key] = ( pos, M )
+        if insets:
+            self.insets = insets
 
         # set normalization 
         self.__signals_normalized__ = True
@@ -969,6 +954,273 @@ class Scan:
         return np.array(resolutions), np.mean(resolutions), np.std(resolutions)
 
 
+class ScanCache:
+    """ **ScanCache**
+
+    On-disk cache of reduced scans (one HDF5 file per entry).
+
+    Entries are keyed on the SPEC-file (name, size and modification time),
+    the scan number, the ROIs, the integration method, the scaling and any
+    further reduction option, so that re-running an analysis only re-reads
+    scans whose inputs changed. When the cache grows beyond 'max_size' bytes,
+    the least recently used entries are deleted.
+
+    Args:
+        directory   (str): Directory holding the cache files (created if needed).
+        max_size    (int): Maximum size of the cache in bytes (default is 2 GB).
+
+    Attributes:
+        hits        (int): Number of successful look-ups.
+        misses      (int): Number of failed look-ups.
+
+    """
+    def __init__( self, directory, max_size=2*1024**3 ):
+        self.directory = directory
+        self.max_size  = max_size
+        self.hits      = 0
+        self.misses    = 0
+        if not os.path.isdir( directory ):
+            os.makedirs( directory )
+
+    def get_key( self, spec_fname, scan_number, roi_obj=None, method='sum', scaling=None, **options ):
+        """ **get_key**
+
+        Returns the cache key (hex string) of a reduced scan.
+
+        Args:
+            spec_fname  (str): Path to the SPEC-file.
+            scan_number (int): Scan number.
+            roi_obj (instance): Instance of the 'XRStools.xrs_rois.roi_object' class.
+            method      (str): Integration method.
+            scaling (np.array): Scaling factors (one per ROI).
+            options  (kwargs): Further options that change the reduced data.
+
+        """
+        stat = os.stat( spec_fname )
+        if scaling is not None:
+            scaling = np.asarray( scaling, dtype=float ).tolist()
+        roi_hash = roi_obj.get_hash() if roi_obj is not None else None
+        description = repr( ( os.path.abspath(spec_fname), stat.st_size, stat.st_mtime, int(scan_number), \
+                              roi_hash, method, scaling, sorted( (k, repr(v)) for k, v in options.items() ) ) )
+        return hashlib.sha1( description.encode('utf-8') ).hexdigest()
+
+    def get_fname( self, key ):
+        return os.path.join( self.directory, key + '.h5' )
+
+    def get( self, key ):
+        """ **get**
+
+        Returns the dictionary stored under 'key', or None if there is no such entry.
+
+        """
+        fname = self.get_fname( key )
+        if not os.path.isfile( fname ):
+            self.misses += 1
+            return None
+        try:
+            h5 = h5py.File( fname, 'r' )
+            try:
+                entry = _read_cache_group( h5 )
+            finally:
+                h5.close()
+        except (IOError, OSError, KeyError):
+            # unreadable (e.g. truncated) entry: drop it
+            print( 'Removing broken cache entry %s.' % fname )
+            os.remove( fname )
+            self.misses += 1
+            return None
+        os.utime( fname, None ) # mark as recently used
+        self.hits += 1
+        return entry
+
+    def put( self, key, entry ):
+        """ **put**
+
+        Stores a dictionary (of arrays, strings, numbers and nested dictionaries)
+        under 'key' and evicts old entries if the cache is too large.
+
+        """
+        fname = self.get_fname( key )
+        tmp   = fname + '.%d.tmp' % os.getpid()
+        h5    = h5py.File( tmp, 'w' )
+        try:
+            _write_cache_group( h5, entry )
+        finally:
+            h5.close()
+        os.rename( tmp, fname )
+        self.evict()
+
+    def evict( self ):
+        """ **evict**
+
+        Deletes least recently used entries until the cache fits into max_size.
+
+        """
+        files = [ (os.path.getmtime(f), os.path.getsize(f), f) for f in glob.glob( os.path.join(self.directory, '*.h5') ) ]
+        total = sum( f[1] for f in files )
+        for mtime, size, fname in sorted( files ):
+            if total <= self.max_size:
+                break
+            os.remove( fname )
+            total -= size
+
+    def stats( self ):
+        """ **stats**
+
+        Returns a dictionary with the number of hits, misses, entries and the size (bytes) of the cache.
+
+        """
+        files = glob.glob( os.path.join(self.directory, '*.h5') )
+        return { 'hits':self.hits, 'misses':self.misses, 'entries':len(files), \
+                 'size':sum( os.path.getsize(f) for f in files ) }
+
+def _write_cache_group( h5group, entry ):
+    for name, value in entry.items():
+        if value is None:
+            continue
+        name = str(name).replace( '/', '%2F' ) # counter names may contain slashes
+        if isinstance( value, dict ):
+            _write_cache_group( h5group.create_group( name ), value )
+        elif isinstance( value, (list, tuple) ) and len(value) and np.ndim(value[0]) \
+                 and len( set( np.shape(v) for v in value ) ) > 1:
+            # ragged lists (e.g. motor positions from SpecRead)
+            group = h5group.create_group( name )
+            group.attrs['ragged_list'] = True
+            for ii, v in enumerate( value ):
+                group['%05d' % ii] = np.asarray( v )
+        elif isinstance( value, str ):
+            h5group[name] = np.bytes_( value )
+        else:
+            h5group[name] = np.asarray( value )
+
+def _read_cache_group( h5group ):
+    entry = {}
+    for name, item in h5group.items():
+        name = name.replace( '%2F', '/' )
+        if isinstance( item, h5py.Group ):
+            if item.attrs.get( 'ragged_list', False ):
+                entry[name] = [ item[k][()] for k in sorted(item) ]
+            else:
+                entry[name] = _read_cache_group( item )
+        else:
+            value = item[()]
+            if isinstance( value, bytes ):
+                value = value.decode( 'utf-8' )
+            entry[name] = value
+    return entry
+
+def load_scans( path, SPECfname, EDFprefix, EDFname, EDFpostfix, scan_numbers, scan_type='generic', \
+                workers=None, **kwargs ):
+    """ **load_scans**
+
+    Loads a list of scans, either one after the other or distributed over a
+    pool of 'workers' local processes.
+
+    In parallel mode each worker parses and reduces whole scans (EDF-files are
+    deleted after application of the ROIs, i.e. only 'direct=True' is supported);
+    the reduced arrays are handed back through shared memory (if available)
+    instead of being pickled. The first scan is loaded in the calling process so
+    that all scans share the same monitor normalization as in serial mode.
+
+    Args:
+        path        (str): Absolute path to directory in which the SPEC-file is located.
+        SPECfname   (str): SPEC-file name.
+        EDFprefix   (str): Prefix for the EDF-files.
+        EDFname     (str): Filename of the EDF-files.
+        EDFpostfix  (str): Postfix for the EDF-files.
+        scan_numbers (list): Scan numbers of the scans to be loaded.
+        scan_type  (str or list): Scan type for all scans or one scan type per scan
+            (a list must have the length of scan_numbers, otherwise ValueError is raised).
+        workers     (int): Number of worker processes, scans are loaded serially if 'None' or 1.
+        kwargs           : Keyword arguments passed on to Scan.load.
+
+    Returns:
+        A list of instances of the 'Scan' class in the order of scan_numbers.
+
+    """
+    if isinstance( scan_type, list ):
+        if len(scan_type) != len(scan_numbers):
+            raise ValueError( 'One scan_type per scan is needed: got %d scan types for %d scans.' % (len(scan_type), len(scan_numbers)) )
+        scan_types = scan_type
+    else:
+        scan_types = [scan_type]*len(scan_numbers)
+    load_args = ( path, SPECfname, EDFprefix, EDFname, EDFpostfix )
+
+    if workers and workers > 1 and len(scan_numbers) > 1 and not kwargs.get('direct', False):
+        print( 'Parallel loading requires direct=True, loading scans serially.' )
+        workers = None
+
+    scans = []
+    for number, stype in zip( scan_numbers, scan_types ):
+        # load serially (always the first scan, to fix the monitor normalization)
+        if scans and workers and workers > 1:
+            break
+        scan = Scan()
+        scan.load( *(load_args + (number,)), scan_type=stype, **kwargs )
+        scans.append( scan )
+
+    if len(scans) < len(scan_numbers):
+        if shared_memory is not None:
+            resource_tracker.ensure_running() # the workers register their blocks with our tracker
+        jobs = [ ( load_args, number, stype, kwargs, dict(Scan.normalizationDict) ) \
+                 for number, stype in zip( scan_numbers[len(scans):], scan_types[len(scans):] ) ]
+        with ProcessPoolExecutor( max_workers=workers ) as executor:
+            for scan in executor.map( _load_scan_worker, jobs ):
+                _scan_from_shared_memory( scan )
+                scans.append( scan )
+
+    return scans
+
+def _load_scan_worker( job ):
+    load_args, number, scan_type, kwargs, normalization = job
+    Scan.normalizationDict.update( normalization )
+    scan = Scan()
+    scan.load( *(load_args + (number,)), scan_type=scan_type, **kwargs )
+    return _scan_to_shared_memory( scan )
+
+class _SharedArray:
+    """ Array placed in a shared memory block by a worker process. """
+    def __init__( self, array ):
+        array = np.ascontiguousarray( array )
+        shm   = shared_memory.SharedMemory( create=True, size=max(array.nbytes, 1) )
+        np.ndarray( array.shape, dtype=array.dtype, buffer=shm.buf )[...] = array
+        self.name  = shm.name
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        shm.close()
+
+    def get( self ):
+        """ Returns a copy of the array and releases the shared memory block. """
+        shm   = shared_memory.SharedMemory( name=self.name )
+        array = np.ndarray( self.shape, dtype=np.dtype(self.dtype), buffer=shm.buf ).copy()
+        shm.close()
+        shm.unlink()
+        return array
+
+def _scan_to_shared_memory( scan ):
+    if shared_memory is None:
+        return scan
+    for attr in ['raw_signals', 'raw_errors']:
+        arrays = getattr( scan, attr )
+        for key in arrays:
+            if isinstance( arrays[key], np.ndarray ):
+                arrays[key] = _SharedArray( arrays[key] )
+    for attr in ['signals', 'errors']:
+        if isinstance( getattr( scan, attr ), np.ndarray ):
+            setattr( scan, attr, _SharedArray( getattr( scan, attr ) ) )
+    return scan
+
+def _scan_from_shared_memory( scan ):
+    for attr in ['raw_signals', 'raw_errors']:
+        arrays = getattr( scan, attr )
+        for key in arrays:
+            if isinstance( arrays[key], _SharedArray ):
+                arrays[key] = arrays[key].get()
+    for attr in ['signals', 'errors']:
+        if isinstance( getattr( scan, attr ), _SharedArray ):
+            setattr( scan, attr, getattr( scan, attr ).get() )
+    return scan
+
 class scan:
     """
     Container class, holding information of single scans performed with 2D detectors. 
@@ -994,23 +1246,28 @@ class scan:
         self.cenom_pw   = []
         self.signals_pw_interp = []
 
-    def applyrois(self,indices,scaling=None):
+    def applyrois(self,indices,scaling=None,roi_obj=None):
         """
         Sums up intensities found in the ROIs of each detector image
         and stores it into the self.signals attribute.
-        roi_object = instance of the 'rois' class redining the ROIs
+        indices    = list of pixel indices of each ROI (attribute of the xrs_rois class)
         scaling    = numpy array of numerical scaling factors (has to be one for each ROIs)
+        roi_obj    = optional instance of the 'roi_object' class, if given all ROIs are summed
+                     at once with its sparse projector instead of looping over 'indices'
         """
-        data = np.zeros((len(self.edfmats),len(indices)))
-        for n in range(len(indices)): # each roi
-            for m in range(len(self.edfmats)): # each energy point along the scan
-                for l in range(len(indices[n])): # each pixel on the detector
-                    data[m,n] += self.edfmats[m,indices[n][l][0],indices[n][l][1]]
+        if roi_obj is not None:
+            data = roi_obj.project(self.edfmats)
+        else:
+            data = np.zeros((len(self.edfmats),len(indices)))
+            for n in range(len(indices)): # each roi
+                for m in range(len(self.edfmats)): # each energy point along the scan
+                    for l in range(len(indices[n])): # each pixel on the detector
+                        data[m,n] += self.edfmats[m,indices[n][l][0],indices[n][l][1]]
         self.signals = np.array(data)
         self.errors  = np.sqrt(data)
         if np.any(scaling):
-            assert len(scaling) == len(indices) # make sure, there is one scaling factor for each roi
-            for ii in range(len(indices)):
+            assert len(scaling) == data.shape[1] # make sure, there is one scaling factor for each roi
+            for ii in range(data.shape[1]):
                 self.signals[:,ii] *= scaling[ii]
                 self.errors[:,ii]  *= scaling[ii]
 
@@ -1183,10 +1440,11 @@ class offDiaDataSet:
         self.masterRCmotor= np.array([])
 
     def filterDetErrors(self,threshold=3000000):
-        inds = np.where(self.signalMatrix >= threshold)
-        for ii in range(len(inds[0])):
-            self.signalMatrix[inds[0][ii], inds[1][ii]] = 0.0
-            self.signalMatrix[inds[0][ii], inds[1][ii]] = np.interp(inds[0][ii], [inds[0][ii]-1,inds[0][ii]+1] , [self.signalMatrix[inds[0][ii], inds[1][ii]-1],self.signalMatrix[inds[0][ii], inds[1][ii]+1]])
+        """ **filterDetErrors**
+        Replaces detector errors (signals >= threshold) by interpolation between
+        their neighbours along the rocking curve (see repair_glitches).
+        """
+        repair_glitches( self.signalMatrix, threshold )
 
     def normalizeSignals(self):
         self.signalMatrix /= self.I0Matrix
@@ -1197,132 +1455,24 @@ class offDiaDataSet:
         self.RCmonitor    *= np.mean(self.I0Matrix)
 
     def alignRCmonitor(self):
-        # check if data exists
-        if not np.any(self.RCmonitor):
-            print('Please load some data first.')
-            return
-        #x = np.arange(len(self.motorMatrix.T[:,0]))
-
-        #RCmonitor   = self.RCmonitor#[:,diagonal_inds[0]:-diagonal_inds[1]]
-        #motorMatrix = self.motorMatrix#[:,diagonal_inds[0]:-diagonal_inds[1]]
-        #signalMatrix= self.signalMatrix#[:,diagonal_inds[0]:-diagonal_inds[1]]
-
-        RCposition = []
-        RCmax = []
-        for ii in range(len(self.RCmonitor)):
-            x = self.motorMatrix[ii,:]
-            y = self.RCmonitor[ii,:]
-            try:
-                guess = [x[np.where(y == np.amax(y))[0]][0], 0.01, 1.0, np.amax(y), 1.]
-                popt, pcov = optimize.curve_fit(math_functions.pearson7_forcurvefit, x, y,p0=guess) 
-                RCposition.append(popt[0])
-            except: 
-                RCposition.append(xrs_utilities.find_center_of_mass(x,y))
-            RCmax.append(np.amax(y))
-
-        RCmax = np.array(RCmax)
-        RCmax /= np.mean(RCmax)
-
-        # possibly correct for deviations from Bragg's law
-        #RCfit = np.polyval(np.polyfit(self.energy,self.RCposition),self.energy)
-        #for ii in range(len(RCfit)):
-
-        master_phi = self.motorMatrix[10,:]-RCposition[10]
-        signalMatrix = np.zeros((len(self.energy),len(master_phi)))
-        errorMatrix  = np.zeros((len(self.energy),len(master_phi)))
-        RCmonitor    = np.zeros((len(self.energy),len(master_phi)))
-        for ii in range(len(self.energy)):
-            signalMatrix[ii,:] = np.interp(master_phi,self.motorMatrix[ii,:]-RCposition[ii],self.signalMatrix[ii,:])*RCmax[ii]
-            errorMatrix[ii,:]  = np.interp(master_phi,self.motorMatrix[ii,:]-RCposition[ii],self.errorMatrix[ii,:])*RCmax[ii]
-            RCmonitor[ii,:]    = np.interp(master_phi,self.motorMatrix[ii,:]-RCposition[ii],self.RCmonitor[ii,:])*RCmax[ii]
-
-        self.alignedSignalMatrix = signalMatrix
-        self.alignedErrorMatrix  = errorMatrix
-        self.masterRCmotor       = master_phi
-        self.alignedRCmonitor    = RCmonitor
+        """ **alignRCmonitor**
+        Aligns the data matrices according to the positions of Pearson VII fits of
+        the Rocking-Curve monitor (see align_offDiaDataSets).
+        """
+        align_offDiaDataSets( [self], method='pearson7' )
 
     def alignRCmonitor2(self):
-        # check if data exists
-        if not np.any(self.RCmonitor):
-            print('Please load some data first.')
-            return
-        #x = np.arange(len(self.motorMatrix.T[:,0]))
-
-        #RCmonitor   = self.RCmonitor#[:,diagonal_inds[0]:-diagonal_inds[1]]
-        #motorMatrix = self.motorMatrix#[:,diagonal_inds[0]:-diagonal_inds[1]]
-        #signalMatrix= self.signalMatrix#[:,diagonal_inds[0]:-diagonal_inds[1]]
-
-        RCposition = []
-        for ii in range(len(self.RCmonitor)):
-            x = self.motorMatrix[ii,:]
-            y = self.RCmonitor[ii,:]
-            #try:
-            #    guess = [x[np.where(y == np.amax(y))[0]][0], 0.01, 1.0, np.amax(y), 1.]
-            #    popt, pcov = optimize.curve_fit(math_functions.pearson7_forcurvefit, x, y,p0=guess) 
-            #    RCposition.append(popt[0])
-            #except: 
-            RCposition.append(xrs_utilities.find_center_of_mass(x,y))
-
-        # possibly correct for deviations from Bragg's law
-        #RCfit = np.polyval(np.polyfit(self.energy,self.RCposition),self.energy)
-        #for ii in range(len(RCfit)):
-
-        master_phi = self.motorMatrix[10,:]-RCposition[10]
-        signalMatrix = np.zeros((len(self.energy),len(master_phi)))
-        errorMatrix  = np.zeros((len(self.energy),len(master_phi)))
-        RCmonitor    = np.zeros((len(self.energy),len(master_phi)))
-        for ii in range(len(self.energy)):
-            signalMatrix[ii,:] = np.interp(master_phi,self.motorMatrix[ii,:]-RCposition[ii],self.signalMatrix[ii,:])
-            errorMatrix[ii,:]  = np.interp(master_phi,self.motorMatrix[ii,:]-RCposition[ii],self.errorMatrix[ii,:])
-            RCmonitor[ii,:]    = np.interp(master_phi,self.motorMatrix[ii,:]-RCposition[ii],self.RCmonitor[ii,:])
-
-        self.alignedSignalMatrix = signalMatrix
-        self.alignedErrorMatrix  = errorMatrix
-        self.masterRCmotor       = master_phi
-        self.alignedRCmonitor    = RCmonitor
+        """ **alignRCmonitor2**
+        Aligns the data matrices according to the centers of mass of the
+        Rocking-Curve monitor (see align_offDiaDataSets).
+        """
+        align_offDiaDataSets( [self], method='com' )
 
     def alignRCmonitorCC(self,repeat=2):
         """ **alignRCmonitorCC**
         Use cross-correlation to align data matrix according to the Rockin-Curve monitor.
         """
-        # check if data exists
-        if not np.any(self.RCmonitor):
-            print('Please load some data first.')
-            return
-
-        signalMatrix = np.zeros((len(self.energy),len(self.motorMatrix[0,:])))
-        errorMatrix  = np.zeros((len(self.energy),len(self.motorMatrix[0,:])))
-        RCmonitor    = np.zeros((len(self.energy),len(self.motorMatrix[0,:])))
-
-        # first iteration
-        for ii in range(len(self.RCmonitor)):
-            x0 = self.RCmonitor[0,:]
-            x  = self.RCmonitor[ii,:]
-            y  = np.correlate(x0,x,mode='same')
-            ind = np.where(y == np.amax(y))[0]
-            if ii == 0:
-                master_phi = self.motorMatrix[ii,:] - self.motorMatrix[ii,ind]
-
-            signalMatrix[ii,:] = np.interp(master_phi,self.motorMatrix[ii,:]-self.motorMatrix[ii,ind],self.signalMatrix[ii,:])
-            errorMatrix[ii,:]  = np.interp(master_phi,self.motorMatrix[ii,:]-self.motorMatrix[ii,ind],self.errorMatrix[ii,:])
-            RCmonitor[ii,:]    = np.interp(master_phi,self.motorMatrix[ii,:]-self.motorMatrix[ii,ind],self.RCmonitor[ii,:])
-
-        # further iterations
-        if repeat:
-            for jj in range(repeat):
-                for ii in range(len(RCmonitor)):
-                    x0 = RCmonitor[0,:]
-                    x  = RCmonitor[ii,:]
-                    y  = np.correlate(x0,x,mode='same')
-                    ind = np.where(y == np.amax(y))[0]
-                    signalMatrix[ii,:] = np.interp(master_phi,master_phi-master_phi[ind],self.signalMatrix[ii,:])
-                    errorMatrix[ii,:]  = np.interp(master_phi,master_phi-master_phi[ind],self.errorMatrix[ii,:])
-                    RCmonitor[ii,:]    = np.interp(master_phi,master_phi-master_phi[ind],self.RCmonitor[ii,:])
-
-        self.alignedSignalMatrix = signalMatrix
-        self.alignedErrorMatrix  = errorMatrix
-        self.masterRCmotor       = master_phi
-        self.alignedRCmonitor    = RCmonitor
+        align_offDiaDataSets( [self], method='cc', repeat=repeat )
 
     def deglitchSignalMatrix(self,startpoint,stoppoint,threshold):
         signalMatrix = self.alignedSignalMatrix
@@ -2104,6 +2254,215 @@ def findRCscans(scans):
             RCscans.append(scans[key])
     return RCscans
 
+def repair_glitches( matrix, threshold ):
+    """ **repair_glitches**
+    Replaces all elements >= threshold by linear interpolation between the
+    nearest good elements of the same row (by the nearest good element at the
+    ends of a row, by 0.0 if the whole row is bad). Isolated glitches get the
+    mean of their left and right neighbours.
+
+    Args:
+      * matrix (np.array): 2D array, repaired in place.
+      * threshold (float): Values >= threshold are glitches.
+
+    Returns:
+      * matrix (np.array): The repaired array.
+    """
+    bad = matrix >= threshold
+    if not np.any( bad ):
+        return matrix
+    ncols = matrix.shape[1]
+    cols  = np.arange( ncols )[None,:]
+    # column of the nearest good element on the left and on the right
+    left  = np.maximum.accumulate( np.where( bad, -1, cols ), axis=1 )
+    right = ncols - 1 - np.maximum.accumulate( np.where( bad, -1, ncols - 1 - cols )[:,::-1], axis=1 )[:,::-1]
+    rr, cc = np.nonzero( bad )
+    jl, jr = left[rr, cc], right[rr, cc]
+    has_l, has_r = jl >= 0, jr < ncols
+    y_l = np.where( has_l, matrix[rr, np.maximum( jl, 0 )], 0.0 )
+    y_r = np.where( has_r, matrix[rr, np.minimum( jr, ncols-1 )], 0.0 )
+    both  = has_l & has_r
+    slope = np.zeros( len(rr) )
+    slope[both] = ( y_r[both] - y_l[both] ) / ( jr[both] - jl[both] )
+    values = np.where( both, slope * ( cc - jl ) + y_l, np.where( has_l, y_l, y_r ) )
+    matrix[rr, cc] = values
+    return matrix
+
+def rc_peak_positions( motorMatrix, RCmonitor, method='pearson7', maxiter=200, ftol=1.49012e-8 ):
+    """ **rc_peak_positions**
+    Peak positions of all rocking curves (rows of RCmonitor, measured at the
+    motor positions of the same rows of motorMatrix) at once.
+
+    Args:
+      * motorMatrix (np.array): Motor positions (one rocking curve per row).
+      * RCmonitor (np.array): Rocking curve monitor signal (same shape).
+      * method (str): 'pearson7' for a Levenberg-Marquardt fit of a Pearson VII
+        function (with background), done for all rows together, rows for which
+        the fit fails get the center of mass; 'com' for the center of mass
+        (first moment) only.
+      * maxiter (int): Maximum number of Levenberg-Marquardt iterations.
+      * ftol (float): Relative decrease of the sum of squares below which a
+        fit is considered to be converged.
+
+    Returns:
+      * positions (np.array): One peak position per row.
+    """
+    x = np.asarray( motorMatrix, dtype=float )
+    y = np.asarray( RCmonitor, dtype=float )
+
+    # center of mass, as xrs_utilities.find_center_of_mass for each row
+    deno = np.trapz( y, x, axis=1 )
+    num  = np.trapz( y*x, x, axis=1 )
+    com  = np.zeros( len(y) )
+    com[deno != 0.0] = num[deno != 0.0] / deno[deno != 0.0]
+    if method == 'com':
+        return com
+    if method != 'pearson7':
+        raise ValueError( 'Unknown method for the rocking curve positions: ' + str(method) )
+
+    # same start as the former per row curve_fit
+    rows = np.arange( len(y) )
+    P    = np.zeros( (len(y), 5) )
+    P[:,0] = x[rows, np.argmax( y, axis=1 )]
+    P[:,1] = 0.01
+    P[:,2] = 1.0
+    P[:,3] = np.amax( y, axis=1 )
+    P[:,4] = 1.0
+
+    with np.errstate( all='ignore' ):
+        model, J = _pearson7_and_jacobian( x, P )
+        cost   = ( (y - model)**2 ).sum( axis=1 )
+        lam    = np.full( len(y), 1.0e-3 )
+        active = np.isfinite( cost )
+        for it in range( maxiter ):
+            ia = np.nonzero( active )[0]
+            if not len( ia ):
+                break
+            Ja  = J[ia]
+            JTJ = np.einsum( 'rni,rnj->rij', Ja, Ja )
+            g   = np.einsum( 'rni,rn->ri', Ja, y[ia] - model[ia] )
+            D   = np.maximum( np.diagonal( JTJ, axis1=1, axis2=2 ), np.finfo(float).tiny )
+            A   = JTJ + ( lam[ia,None] * D )[:,:,None] * np.eye( 5 )
+            try:
+                delta = np.linalg.solve( A, g[...,None] )[...,0]
+            except np.linalg.LinAlgError:
+                delta = np.einsum( 'rij,rj->ri', np.linalg.pinv( A ), g )
+            Pn = P[ia] + delta
+            mn, Jn = _pearson7_and_jacobian( x[ia], Pn )
+            cn = ( (y[ia] - mn)**2 ).sum( axis=1 )
+            cn[ ~( np.isfinite( cn ) & np.all( np.isfinite( Pn ), axis=1 ) & ( Pn[:,2] > 0 ) & ( Pn[:,1] != 0 ) ) ] = np.inf
+            better = cn < cost[ia]
+            ib = ia[better]
+            converged = ( cost[ib] - cn[better] ) <= ftol * cost[ib]
+            P[ib], model[ib], J[ib], cost[ib] = Pn[better], mn[better], Jn[better], cn[better]
+            lam[ib] /= 10.0
+            lam[ia[~better]] *= 10.0
+            active[ib[converged]] = False
+            active[lam > 1.0e16] = False
+
+    positions = P[:,0].copy()
+    failed = ~np.isfinite( positions ) | ~np.isfinite( cost )
+    positions[failed] = com[failed]
+    return positions
+
+def _pearson7_and_jacobian( x, P ):
+    # math_functions.pearson7 (one parameter set per row) and its derivatives
+    x0, w, m, A, bg = [ P[:,k:k+1] for k in range(5) ]
+    c   = 2.0**(1.0/m) - 1.0
+    z   = 2.0*(x-x0)/w
+    u   = 1.0 + c*z*z
+    um  = u**(-m)
+    model = A*um + bg
+    dydu  = -m*A*um/u
+    dcdm  = -(c+1.0)*np.log(2.0)/(m*m)
+    J = np.empty( x.shape + (5,) )
+    J[...,0] = dydu*2.0*c*z*(-2.0/w)
+    J[...,1] = dydu*(-2.0*c*z*z/w)
+    J[...,2] = A*um*( -np.log(u) - m*z*z*dcdm/u )
+    J[...,3] = um
+    J[...,4] = 1.0
+    return model, J
+
+def _correlate_rows( x0, x ):
+    # np.correlate(x0[r], x[r], mode='same') for all rows r at once
+    R, N = x.shape
+    off  = N//2
+    x0p  = np.zeros( (R, 2*N + off) )
+    x0p[:, off:off+N] = x0
+    windows = np.lib.stride_tricks.as_strided( x0p, shape=(R, N, N), \
+                                               strides=(x0p.strides[0], x0p.strides[1], x0p.strides[1]), writeable=False )
+    return np.einsum( 'rkn,rn->rk', windows, x )
+
+def align_offDiaDataSets( datasets, method='pearson7', repeat=2, ref_row=10 ):
+    """ **align_offDiaDataSets**
+    Aligns the signal, error and rocking curve monitor matrices of several
+    offDiaDataSets (e.g. all ROIs of an ixs_offDiagonal.offDiagonal) according
+    to their rocking curve monitors. The rows of all data sets are treated
+    together: the peak positions (or cross-correlations) are computed for all
+    rows at once and the three matrices are resampled in a single pass.
+
+    Args:
+      * datasets (list): Instances of offDiaDataSet.
+      * method (str): 'pearson7' (Pearson VII fit, intensities normalised to the
+        mean monitor maximum, as alignRCmonitor), 'com' (center of mass, as
+        alignRCmonitor2) or 'cc' (cross-correlation with the first row, as
+        alignRCmonitorCC).
+      * repeat (int): Number of further cross-correlation iterations ('cc' only).
+      * ref_row (int): Row whose motor positions define the common motor scale
+        ('pearson7' and 'com').
+    """
+    datasets = list( datasets )
+    for dataset in datasets:
+        if not np.any( dataset.RCmonitor ):
+            print('Please load some data first.')
+            return
+
+    bounds  = np.cumsum( [0] + [ len(dataset.RCmonitor) for dataset in datasets ] )
+    motor   = np.vstack( [ dataset.motorMatrix  for dataset in datasets ] ).astype( float )
+    moni    = np.vstack( [ dataset.RCmonitor    for dataset in datasets ] ).astype( float )
+    signal  = np.vstack( [ dataset.signalMatrix for dataset in datasets ] ).astype( float )
+    error   = np.vstack( [ dataset.errorMatrix  for dataset in datasets ] ).astype( float )
+    nrows   = np.diff( bounds )
+    rows    = np.arange( len(moni) )
+
+    if method in ( 'pearson7', 'com' ):
+        positions = rc_peak_positions( motor, moni, method=method )
+        master    = [ dataset.motorMatrix[ref_row,:] - positions[b0+ref_row] for dataset, b0 in zip( datasets, bounds ) ]
+        aligned   = xrs_utilities.interp_rows( np.repeat( master, nrows, axis=0 ), motor - positions[:,None], \
+                                               [ signal, error, moni ] )
+        if method == 'pearson7':
+            RCmax = np.amax( moni, axis=1 )
+            for b0, b1 in zip( bounds[:-1], bounds[1:] ):
+                RCmax[b0:b1] /= np.mean( RCmax[b0:b1] )
+            aligned = [ matrix * RCmax[:,None] for matrix in aligned ]
+
+    elif method == 'cc':
+        first = bounds[:-1]
+        owner = np.repeat( first, nrows )
+        # first iteration: correlation with the raw monitor of the first row
+        ind     = np.argmax( _correlate_rows( moni[owner], moni ), axis=1 )
+        master  = [ motor[b0,:] - motor[b0, ind[b0]] for b0 in first ]
+        masters = np.repeat( master, nrows, axis=0 )
+        aligned = xrs_utilities.interp_rows( masters, motor - motor[rows, ind][:,None], [ signal, error, moni ] )
+        # further iterations: the first row is re-aligned first, the others
+        # are then correlated with it
+        for jj in range( repeat or 0 ):
+            ind0 = np.argmax( _correlate_rows( aligned[2][first], aligned[2][first] ), axis=1 )
+            new0 = xrs_utilities.interp_rows( masters[first], masters[first] - masters[first, ind0][:,None], \
+                                              [ signal[first], error[first], moni[first] ] )
+            ind  = np.argmax( _correlate_rows( new0[2][np.searchsorted( first, owner )], aligned[2] ), axis=1 )
+            aligned = xrs_utilities.interp_rows( masters, masters - masters[rows, ind][:,None], [ signal, error, moni ] )
+            for matrix, matrix0 in zip( aligned, new0 ):
+                matrix[first] = matrix0
+    else:
+        raise ValueError( 'Unknown alignment method: ' + str(method) )
+
+    for dataset, master_phi, b0, b1 in zip( datasets, master, bounds[:-1], bounds[1:] ):
+        dataset.alignedSignalMatrix = aligned[0][b0:b1]
+        dataset.alignedErrorMatrix  = aligned[1][b0:b1]
+        dataset.alignedRCmonitor    = aligned[2][b0:b1]
+        dataset.masterRCmotor       = master_phi
+
 def sum_scans_to_group( group, method='sum', interp=False ):
     """ **sum_scans_to_group**
 
@@ -2135,6 +2494,94 @@ def sum_scans_to_group( group, method='sum', interp=False ):
 
     return summed_group
 
+def integrate_rois( edfmats, monitor, roi_obj, method='sum', rot_angles=None, storeInsets=False ):
+    """ **integrate_rois**
+
+    Applies the ROIs of a roi_object to a stack of EDF-images.
+
+    The ROIs are applied to the whole stack at once, using the bounding boxes
+    and normalized weights of the (cached) integration plan of the roi_object.
+
+    Args:
+        edfmats (np.array): Stack of EDF-images (scan points x detector).
+        monitor (np.array): Monitor signal, one value per image.
+        roi_obj (instance): Instance of the 'XRStools.xrs_rois.roi_object' class defining the ROIs.
+        method    (string): Keyword specifying the selected choice of data treatment:
+            can be 'sum', 'row', 'pixel', or 'column'. Default is 'sum'.
+        rot_angles  (list): Rotation angles (one per ROI) used with method 'row'.
+        storeInsets (boolean): If 'True', the masked ROI insets of each image are returned, too.
+
+    Returns:
+        signals, errors, insets: dictionaries (one entry per ROI) of monitor normalized
+        signals, Poisson errors, and insets. None for an unknown method.
+
+    """
+    if method not in ['sum', 'row', 'column', 'pixel', 'pixel2']:
+        print( 'Unknown integration method. Use either \'sum\', \'row\', or \'pixel\'.' )
+        return None
+
+    if method == 'row' and rot_angles and len(roi_obj.red_rois) != len(rot_angles):
+        print('Only %d rotation angles provided for %d ROIs. Will end here.'%(len(rot_angles), len(roi_obj.red_rois)))
+        return None
+
+    if method == 'sum':
+        print('selected method is \'sum\': summing up pixels from each ROI.')
+    elif method == 'row':
+        print('selected method is \'row\': summing over non-dispersive direction for each ROI.')
+    elif method == 'column':
+        print('selected method is \'column\': summing over dispersive direction for each ROI.')
+    else:
+        print('selected method is \'pixel\': returning ROI pixel-by-pixel.')
+
+    plan    = roi_obj.get_integration_plan()
+    monitor = np.asarray(monitor, dtype=float)
+    signals = {} # dict (one entry per ROI)
+    errors  = {} # sqrt of the sum of counts
+    insets  = {}
+
+    # sum: all ROIs at once with the sparse projector of the roi_object
+    if method == 'sum':
+        sums = roi_obj.project( edfmats )
+
+    for counter, key in enumerate(plan.keys):
+        W     = plan.weights[key]
+        inset = plan.slices[key]
+        stack = edfmats[:, inset[0], inset[1]]
+
+        if storeInsets:
+            insets[key] = (stack * W).astype(edfmats.dtype)
+
+        # sum: vector (one entry per energy point)
+        if method == 'sum':
+            signal = sums[:,counter]
+            norm   = monitor
+
+        # row: 2D matrix (energy vs row)
+        elif method == 'row':
+            if rot_angles:
+                # rotate images before summation
+                rotated = ndimage.interpolation.rotate( stack * W, rot_angles[counter], axes=(2,1),\
+                                reshape=False, order=0, mode='constant' )
+                signal  = np.sum( rotated, axis=2 )
+            else:
+                signal  = np.einsum('nij,ij->ni', stack, W)
+            norm = monitor[:,None]
+
+        # column: 2D matrix (energy vs column)
+        elif method == 'column':
+            signal = np.einsum('nij,ij->nj', stack, W)
+            norm   = monitor[:,None]
+
+        # pixel: 3D matrix (energy vs pixel_0 vs pixel_1)
+        else:
+            signal = stack * W
+            norm   = monitor[:,None,None]
+
+        signals[key] = signal / norm
+        errors[key]  = np.sqrt( signal ) / norm
+
+    return signals, errors, insets
+
 def edf_cleaner(edfmats, threshold, dim1_range=[60,190], dim2_range=[10,1286] ):
     """ **clean_edf_stack**
 
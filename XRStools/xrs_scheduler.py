@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# Filename: xrs_scheduler.py
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+#/*##########################################################################
+#
+# The XRStools software package for XRS spectroscopy
+#
+# Copyright (c) 2013-2014 European Synchrotron Radiation Facility
+#
+# This file is part of the XRStools XRS spectroscopy package developed at
+# the ESRF by the DEC and Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "Christoph J. Sahle - ESRF"
+__contact__ = "christoph.sahle@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+
+import multiprocessing
+
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
+
+TAG_TASK   = 11 # writer -> worker: index of the next task (-1 to stop)
+TAG_RESULT = 12 # worker -> writer: (index, result), (None, None) when ready
+
+class TaskScheduler:
+    """ **TaskScheduler**
+
+    Distributes independent tasks (scans, ROIs, ...) dynamically over MPI ranks
+    or, when mpi4py is absent or only one rank is running, over a local
+    multiprocessing pool.
+
+    With MPI, rank 0 is the single writer: it hands out the next task to whichever
+    rank becomes free (so that long and short scans balance out) and collects all
+    results. The other ranks only compute. Locally, the pool is fed one task at a
+    time for the same reason and the calling process collects the results.
+
+    Args:
+      * comm (MPI communicator): Communicator to be used, default is MPI.COMM_WORLD (if available).
+      * workers (int): Number of local processes used when not running under MPI,
+        tasks are executed serially if 'None' or 1.
+
+    """
+    def __init__( self, comm=None, workers=None ):
+        if comm is None and MPI is not None:
+            comm = MPI.COMM_WORLD
+        self.comm    = comm
+        self.workers = workers
+        if comm is not None:
+            self.rank   = comm.Get_rank()
+            self.nprocs = comm.Get_size()
+        else:
+            self.rank   = 0
+            self.nprocs = 1
+
+    def is_writer( self ):
+        """ Returns 'True' for the rank which collects the results and writes the output. """
+        return self.rank == 0
+
+    def barrier( self ):
+        """ Synchronizes all ranks (no-op without MPI). """
+        if self.nprocs > 1:
+            self.comm.Barrier()
+
+    def bcast( self, obj ):
+        """ Returns the writer's obj on all ranks. """
+        if self.nprocs > 1:
+            return self.comm.bcast( obj, root=0 )
+        return obj
+
+    def map( self, func, tasks, context=None ):
+        """ **map**
+
+        Executes func(context, task) for all tasks.
+
+        Args:
+          * func (function): Module level function (it has to be picklable for the local pool).
+          * tasks (list): List of (picklable) tasks.
+          * context: Object passed as first argument to func; with MPI every rank uses
+            its own, locally it is sent once to each worker process.
+
+        Returns:
+          * results (list): The results in the order of the tasks on the writer rank,
+            'None' on all other ranks.
+
+        """
+        tasks = list( tasks )
+        if self.nprocs > 1:
+            if self.is_writer():
+                return self._dispatch( len(tasks) )
+            self._work( func, tasks, context )
+            return None
+
+        if self.workers and self.workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool( processes=min(self.workers, len(tasks)), \
+                                         initializer=_init_pool_worker, initargs=(func, context) )
+            try:
+                # chunksize 1: every worker gets a new task as soon as it is free
+                results = list( pool.imap( _run_pool_task, tasks, chunksize=1 ) )
+            finally:
+                pool.close()
+                pool.join()
+            return results
+
+        return [ func( context, task ) for task in tasks ]
+
+    def _dispatch( self, ntasks ):
+        results = [None]*ntasks
+        status  = MPI.Status()
+        next_task = 0
+        running   = self.nprocs - 1
+        while running:
+            index, result = self.comm.recv( source=MPI.ANY_SOURCE, tag=TAG_RESULT, status=status )
+            if index is not None:
+                results[index] = result
+            if next_task < ntasks:
+                self.comm.send( next_task, dest=status.Get_source(), tag=TAG_TASK )
+                next_task += 1
+            else:
+                self.comm.send( -1, dest=status.Get_source(), tag=TAG_TASK )
+                running -= 1
+        return results
+
+    def _work( self, func, tasks, context ):
+        self.comm.send( (None, None), dest=0, tag=TAG_RESULT )
+        while True:
+            index = self.comm.recv( source=0, tag=TAG_TASK )
+            if index < 0:
+                break
+            self.comm.send( (index, func( context, tasks[index] )), dest=0, tag=TAG_RESULT )
+
+_pool_func    = None
+_pool_context = None
+
+def _init_pool_worker( func, context ):
+    global _pool_func, _pool_context
+    _pool_func    = func
+    _pool_context = context
+
+def _run_pool_task( task ):
+    return _pool_func( _pool_context, task )
@@ -43,6 +43,8 @@ __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import os
 import math
 import copy
+import collections
+import hashlib
 
 import numpy as np
 import array as arr
@@ -137,16 +139,7 @@ def tauphoto(Z, energy, logtablefile=os.path.join(data_installation_dir,'logtabl
 
     en = np.array([])
     en = np.append(en,energy)
-    logtable = np.loadtxt(logtablefile)
-    # find the right places in logtable
-    if not isinstance(Z,int):
-        Z = element(Z)
-    try:
-        ind = list(logtable[:,0]).index(Z)
-    except:
-        print( 'no such element in logtable.dat')
-
-    c = np.array(logtable[ind:ind+5,:]) # 5 lines that corresponds to the element
+    c = get_logtable_coefficients(Z,logtablefile) # 5 lines that corresponds to the element
     tau_i = np.zeros((4, len(en)))
     for ii in range(4):
         for jj in range(4):
@@ -176,16 +169,7 @@ def sigmainc(Z, energy, logtablefile=os.path.join(data_installation_dir,'logtabl
 
     en = np.array([])
     en = np.append(en,energy)
-    logtable = np.loadtxt(logtablefile)
-    # find the right places in logtable
-    if not isinstance(Z,int):
-        Z = element(Z)
-    try:
-        ind = list(logtable[:,0]).index(Z)
-    except:
-        print( 'no such element in logtable.dat')
-
-    c = np.array(logtable[ind:ind+5,:]) # 5 lines that corresponds to the element
+    c = get_logtable_coefficients(Z,logtablefile) # 5 lines that corresponds to the element
     sigmai=0
     for jj in range(4):
         sigmai = sigmai + c[jj+1,5]*np.log(energy)**(jj)
@@ -800,6 +784,213 @@ def nonzeroavg(y=None):
     yavg = yavg * y.shape[1]
     return(yavg)
 
+def interp_linear_shifted( x, y, shifts, x_new, yerr=None, fill_value=0.0 ):
+    """ **interp_linear_shifted**
+    Linear interpolation of many curves that share one abscissa up to a shift.
+
+    Column k of y is given on the grid x - shifts[k] and is resampled onto
+    x_new. All columns are treated at once (sorted-grid search on x), the
+    result is the same as building scipy's interp1d(x - shifts[k], y[:,k],
+    bounds_error=False, fill_value=fill_value) for each column.
+
+    Args:
+     * x      (np.array): Common abscissa (does not need to be sorted).
+     * y      (np.array): Ordinates, one column per curve (len(x) x N).
+     * shifts (np.array): Shift of the abscissa of each column (N values).
+     * x_new  (np.array): Abscissa to interpolate onto.
+     * yerr   (np.array): Optional errors of y (same shape as y), these are
+       propagated through the interpolation.
+     * fill_value (float): Value for points outside the range of a curve.
+
+    Returns:
+     * y_new (np.array): Interpolated curves (len(x_new) x N).
+     * err_new (np.array): Propagated errors (only if yerr is given; zero
+       outside the range of a curve).
+    """
+    x      = np.asarray( x, dtype=float )
+    x_new  = np.asarray( x_new, dtype=float )
+    shifts = np.asarray( shifts, dtype=float ).ravel()
+    order  = np.argsort( x, kind='mergesort' )
+    x      = x[order]
+    y      = np.asarray( y, dtype=float ).reshape( len(x), -1 )[order]
+
+    # position of the new points on the (unshifted) grid of each column
+    q    = x_new[:,None] + shifts[None,:]
+    hi   = np.clip( np.searchsorted( x, q ), 1, len(x)-1 )
+    lo   = hi - 1
+    t    = ( q - x[lo] ) / ( x[hi] - x[lo] )
+    cols = np.arange( y.shape[1] )[None,:]
+    outside = ( q < x[0] ) | ( q > x[-1] )
+
+    y_lo  = y[lo, cols]
+    y_new = y_lo + t * ( y[hi, cols] - y_lo )
+    y_new[outside] = fill_value
+    if yerr is None:
+        return y_new
+
+    yerr    = np.asarray( yerr, dtype=float ).reshape( len(x), -1 )[order]
+    err_new = np.sqrt( ( (1.0-t) * yerr[lo, cols] )**2 + ( t * yerr[hi, cols] )**2 )
+    err_new[outside] = 0.0
+    return y_new, err_new
+
+def interp_columns( x_new, x, y ):
+    """ **interp_columns**
+    Linear interpolation of many curves that share one abscissa.
+
+    All columns of y are resampled onto x_new at once, the result is the same
+    as np.interp(x_new, x, y[:,k]) for each column k (including the constant
+    extrapolation beyond the ends of x).
+
+    Args:
+     * x_new (np.array): Abscissa to interpolate onto.
+     * x     (np.array): Common abscissa of the curves (increasing).
+     * y     (np.array): Ordinates, one column per curve (len(x) x N).
+
+    Returns:
+     * y_new (np.array): Interpolated curves (len(x_new) x N).
+    """
+    x_new = np.asarray( x_new, dtype=float )
+    x     = np.asarray( x, dtype=float )
+    y     = np.asarray( y, dtype=float ).reshape( len(x), -1 )
+    if len(x) == 1:
+        return np.repeat( y, len(x_new), axis=0 )
+
+    # x[lo] <= x_new < x[lo+1] (as in np.interp)
+    lo    = np.clip( np.searchsorted( x, x_new, side='right' ) - 1, 0, len(x)-2 )
+    hi    = lo + 1
+    y_lo  = y[lo]
+    y_hi  = y[hi]
+    slope = ( y_hi - y_lo ) / ( x[hi] - x[lo] )[:,None]
+    with np.errstate( invalid='ignore' ):
+        y_new = slope * ( x_new - x[lo] )[:,None] + y_lo
+        # same fall back as np.interp for infinite slopes
+        bad = np.isnan( y_new )
+        if np.any( bad ):
+            alt = slope * ( x_new - x[hi] )[:,None] + y_hi
+            y_new[bad] = alt[bad]
+            same = bad & np.isnan( y_new ) & ( y_lo == y_hi )
+            y_new[same] = y_lo[same]
+    exact = ( x_new == x[lo] )
+    y_new[exact]            = y_lo[exact]
+    y_new[x_new <  x[0]]    = y[0]
+    y_new[x_new >= x[-1]]   = y[-1]
+    y_new[np.isnan(x_new)]  = np.nan
+    return y_new
+
+def interp_rows( x_new, xp, fps ):
+    """ **interp_rows**
+    Linear interpolation of many curves, each row with its own abscissa.
+
+    Row r of every array in fps is given on xp[r] and is resampled onto
+    x_new (or x_new[r]). The bracketing indices and weights are found once
+    and used for all arrays, the result is the same as
+    np.interp(x_new, xp[r], fp[r]) for each row r and each fp.
+
+    Args:
+     * x_new (np.array): Abscissa to interpolate onto, shared by all rows
+       (M) or one per row (R x M).
+     * xp    (np.array): Abscissae of the rows, each one increasing (R x N).
+     * fps   (list): Arrays of ordinates (each R x N).
+
+    Returns:
+     * list of the interpolated arrays (each R x M).
+    """
+    xp    = np.asarray( xp, dtype=float )
+    R, N  = xp.shape
+    x_new = np.broadcast_to( np.asarray( x_new, dtype=float ), ( R, np.shape(x_new)[-1] ) )
+    fps   = [ np.asarray( fp, dtype=float ).reshape( R, N ) for fp in fps ]
+    if N == 1:
+        return [ np.repeat( fp, x_new.shape[1], axis=1 ) for fp in fps ]
+
+    # xp[lo] <= x_new < xp[lo+1] (as in np.interp), one search per row
+    lo   = np.array( [ np.searchsorted( xrow, qrow, side='right' ) for xrow, qrow in zip( xp, x_new ) ], dtype=int ).reshape( x_new.shape ) - 1
+    lo   = np.clip( lo, 0, N-2 )
+    hi   = lo + 1
+    rows = np.arange( R )[:,None]
+    x_lo = xp[rows, lo]
+    dx   = x_new - x_lo
+    step = xp[rows, hi] - x_lo
+    exact  = ( dx == 0 )
+    below  = x_new <  xp[:,:1]
+    above  = x_new >= xp[:,-1:]
+    nan    = np.isnan( x_new )
+
+    results = []
+    for fp in fps:
+        y_lo  = fp[rows, lo]
+        y_hi  = fp[rows, hi]
+        slope = ( y_hi - y_lo ) / step
+        with np.errstate( invalid='ignore' ):
+            y_new = slope * dx + y_lo
+            # same fall back as np.interp for infinite slopes
+            bad = np.isnan( y_new )
+            if np.any( bad ):
+                alt = slope * ( x_new - xp[rows, hi] ) + y_hi
+                y_new[bad] = alt[bad]
+                same = bad & np.isnan( y_new ) & ( y_lo == y_hi )
+                y_new[same] = y_lo[same]
+        y_new[exact] = y_lo[exact]
+        y_new[below] = np.broadcast_to( fp[:,:1],  y_new.shape )[below]
+        y_new[above] = np.broadcast_to( fp[:,-1:], y_new.shape )[above]
+        y_new[nan]   = np.nan
+        results.append( y_new )
+    return results
+
+def linear_deposit( fpos, weights, nbins, power=1 ):
+    """ **linear_deposit**
+    Histogram with linear sharing of each contribution between two bins.
+
+    Weight weights[n] at the fractional bin position fpos[n] = i + f goes
+    (1-f)**power * weights[n] to bin i and f**power * weights[n] to bin i+1.
+    The contributions are summed in the order of the input, the result is the
+    same as the element by element loop doing the two '+=' for each n.
+
+    Args:
+     * fpos    (np.array): Fractional bin positions (>= 0 and < nbins-1, other
+       positions have to be masked out by the caller).
+     * weights (np.array): Weights (same length as fpos), a scalar is
+       broadcasted.
+     * nbins   (int): Number of bins of the histogram.
+     * power   (int): Power of the sharing factors, 2 to propagate variances.
+
+    Returns:
+     * hist (np.array): The histogram (nbins).
+    """
+    fpos    = np.asarray( fpos, dtype=float ).ravel()
+    weights = np.broadcast_to( np.asarray( weights, dtype=float ), fpos.shape ).ravel()
+    ipos    = fpos.astype( int )
+    f       = fpos - ipos
+    if power == 1:
+        w_lo, w_hi = (1-f)*weights, f*weights
+    else:
+        w_lo, w_hi = (1-f)**power*weights, f**power*weights
+    # interleaved, so that each bin gets its contributions in the input order
+    bins = np.stack( [ ipos, ipos+1 ], axis=1 ).ravel()
+    wgts = np.stack( [ w_lo, w_hi ], axis=1 ).ravel()
+    return np.bincount( bins, weights=wgts, minlength=nbins )[:nbins]
+
+def linear_deposit_average( fpos, values, norms, nbins ):
+    """ **linear_deposit_average**
+    Weighted average of values rebinned with linear_deposit.
+
+    Args:
+     * fpos   (np.array): Fractional bin positions (see linear_deposit).
+     * values (np.array): Quantities to be rebinned.
+     * norms  (np.array): Normalisation weights (e.g. counts or norms of the
+       contributions), rebinned in the same way.
+     * nbins  (int): Number of bins.
+
+    Returns:
+     * average (np.array): Rebinned values divided by the rebinned norms (zero
+       where the latter is not positive).
+     * norm_hist (np.array): Rebinned norms.
+    """
+    hist      = linear_deposit( fpos, values, nbins )
+    norm_hist = linear_deposit( fpos, norms, nbins )
+    good      = norm_hist > 0
+    hist[good] = hist[good] / norm_hist[good]
+    return hist, norm_hist
+
 def fermi(rs):
     """ **fermi**
     Calculates the plasmon energy (in eV), Fermi energy (in eV), Fermi 
@@ -1117,14 +1308,30 @@ def pz2e1(w2,pz,th):
       * w1 (np.array): incident energy in [keV]
     """
     pz  = np.array(pz)
+    tck = pz2e1_spline(w2,th)
+    w1  = tck(pz)
+    return w1
+
+def pz2e1_spline(w2,th):
+    """Returns the spline used by pz2e1 to map the pz scale onto the incident energy.
+
+    The spline only depends on the scattered photon energy and the scattering
+    angle, so it can be reused for any pz scale.
+
+    Args:
+      * w2 (float): scattered photon energy in [keV]
+      * th (float): scattering angle two theta in [deg]
+
+    Returns:
+      * tck (scipy.interpolate.UnivariateSpline): incident energy in [keV] as function of pz in [a.u.]
+    """
     w   = np.array(np.arange(np.array(w2)/4.0,4.0*np.array(w2),np.array(w2)/5000.0))
     p   = e2pz(w,w2,th)[0]
     if ( p[1]-p[0] <0) :
         tck = interpolate.UnivariateSpline(p[::-1],w[::-1])
     else:
         tck = interpolate.UnivariateSpline(p,w)
-    w1  = tck(pz)
-    return w1
+    return tck
 
 def e2pz(w1,w2,th):
     """Calculates the momentum scale and the relativistic Compton cross section 
@@ -2300,40 +2507,8 @@ def readbiggsdata(filename,element):
       * bindingen  = binding energies of the accorting shells
       * colnames   = strings of column names as used in the file
     """
-    elementid = '#S'
-    sizeid    = '#N'
-    occid     = '#UOCCUP'
-    bindingid = '#UBIND'
-    colnameid = '#L'
-    data = []
-    f = open(filename,'r')
-    istrue = True
-    while istrue:
-        line = f.readline()
-        if line[0:2] == elementid:
-            if line.split()[-1] == element:
-                line = f.readline()
-                while line[0:2] != elementid:
-                    if line[0:2] == sizeid:
-                        arraysize = int(line.split()[-1])
-                        line = f.readline()
-                    if line[0:7] == occid:
-                        occupation = line.split()[1:]
-                        line = f.readline()
-                    if line[0:6] == bindingid:
-                        bindingen = line.split()[1:]    
-                        line = f.readline()
-                    if line[0:2] == colnameid:
-                        colnames = line.split()[1:]
-                        line = f.readline()
-                    if line[0]== ' ':
-                        data.append([float(n) for n in line.strip().split()])
-                        #data = np.zeros((31,arraysize))
-                        line = f.readline()
-                break
-    length = len(data)
-    data = (np.reshape(np.array(data),(length,arraysize)))
-    return data, occupation, bindingen, colnames
+    from . import xrs_fileIO
+    return xrs_fileIO.readbiggsdata(filename,element)
 
 def makepzprofile(element,filename=os.path.join(data_installation_dir,'ComptonProfiles.dat')):
     """
@@ -2615,6 +2790,78 @@ def element(z):
 
 #os.path.join(data_installation_dir,'data/logtable.dat')
 
+# parsed log-log absorption tables (see get_logtable)
+_logtables = {}
+
+def get_logtable(logtablefile=os.path.join(data_installation_dir,'logtable.dat')):
+    """ **get_logtable**
+    Returns the log-log absorption table, the file is read only once.
+
+    Args:
+      * logtablefile (string): path and filename of the table.
+
+    Returns:
+      * table (dict): 5x6 np.array of coefficients for each atomic number.
+    """
+    key = os.path.abspath(logtablefile)
+    if key not in _logtables:
+        logtable = np.loadtxt(logtablefile)
+        table    = {}
+        for ind in range(0,len(logtable)-4,5): # 5 lines per element
+            table.setdefault(int(logtable[ind,0]), logtable[ind:ind+5,:])
+        _logtables[key] = table
+    return _logtables[key]
+
+def get_logtable_coefficients(Z,logtablefile=os.path.join(data_installation_dir,'logtable.dat')):
+    """ **get_logtable_coefficients**
+    Returns the 5x6 coefficients of the log-log absorption table for element Z
+    (atomic number or element symbol).
+    """
+    if not isinstance(Z,int):
+        Z = element(Z)
+    table = get_logtable(logtablefile)
+    if Z not in table:
+        print( 'no such element in logtable.dat')
+        raise ValueError('Element ' + str(Z) + ' not found in ' + logtablefile)
+    return np.array(table[Z])
+
+def myprho_elements(energy,Zs,logtablefile=os.path.join(data_installation_dir,'logtable.dat')):
+    """ **myprho_elements**
+    Calculates the photoelectric, elastic, and inelastic absorption of 
+    several elements for all energies at once (see myprho).
+
+    Args:
+      * energy (np.array): energy scale in [keV].
+      * Zs (list): atomic numbers or element symbols.
+
+    Returns:
+      * murho (np.array): absorption coefficients normalized by the density (len(Zs) x len(energy) x 3).
+      * rho (np.array): densities of the elements.
+      * m (np.array): atomic masses of the elements.
+    """
+    en = np.array([])
+    en = np.append(en,energy)
+    c  = np.array([get_logtable_coefficients(Z,logtablefile) for Z in Zs]) # (elements x 5 x 6)
+    le = np.log(en)[None,:] # logarithm of the energy
+
+    # log-log fits of all columns of the table, (elements x energies) each
+    def fit(column):
+        return np.exp(c[:,1,column][:,None]+le*(c[:,2,column][:,None]+le*(c[:,3,column][:,None]+le*c[:,4,column][:,None])))
+
+    # photoelectric absorption between the absorption edges
+    edge1 = c[:,0,1][:,None]
+    edge2 = c[:,0,2][:,None]
+    edge3 = c[:,0,3][:,None]
+    mu    = np.zeros((len(Zs),len(en),3))
+    mu[:,:,0] = np.where(en<edge1, fit(0), np.where(en<edge2, fit(1), np.where(en<=edge3, fit(2), fit(3))))
+    mu[:,:,1] = fit(4) # elastic absorption
+    mu[:,:,2] = fit(5) # inelastic abssorption
+    #
+    m = c[:,0,4] # atomic mass
+    murho = mu*0.602252/m[:,None,None] # mu/rho
+    rho = c[:,0,5]
+    return murho, rho, m
+
 def myprho(energy,Z,logtablefile=os.path.join(data_installation_dir,'logtable.dat') ):
     """Calculates the photoelectric, elastic, and inelastic absorption of 
     an element Z 
@@ -2632,45 +2879,19 @@ def myprho(energy,Z,logtablefile=os.path.join(data_installation_dir,'logtable.da
       * m (float): atomic mass in UNITS?
 
     """
-    en = np.array([])
-    en = np.append(en,energy) 
-    logtable = np.loadtxt(logtablefile)
-    # find the right places in logtable
-    if not isinstance(Z,int):
-        Z = element(Z)
-    try:
-        ind = list(logtable[:,0]).index(Z)
-    except:
-        print( 'no such element in logtable.dat')
-    c     = np.array(logtable[ind:ind+5,:]) # 5 lines that corresponds to the element
-    le    = np.log(en) # logarithm of the energy
-    mr    = np.exp(c[1,3]+le*(c[2,3]+le*(c[3,3]+le*c[4,3])))  # extract mu from loglog table
-    i     = np.where(en<=c[0,3])
-    l     = le[i]
-    mr[i] = np.exp(c[1,2]+l*(c[2,2]+l*(c[3,2]+l*c[4,2])))
-    i     = np.where(en<c[0,2])
-    l     = le[i]
-    mr[i] = np.exp(c[1,1]+l*(c[2,1]+l*(c[3,1]+l*c[4,1])))
-    i     = np.where(en<c[0,1])
-    l     = le[i]
-    # mu
-    mu      = np.zeros((len(mr),3))
-    mu[:,0] = mr
-    mu[i,0] = np.exp(c[1,0]+l*(c[2,0]+l*(c[3,0]+l*c[4,0]))) # photoelectric absorption
-    mu[:,1] = np.exp(c[1,4]+le*(c[2,4]+le*(c[3,4]+le*c[4,4]))) # elastic absorption
-    mu[:,2] = np.exp(c[1,5]+le*(c[2,5]+le*(c[3,5]+le*c[4,5]))) # inelastic abssorption
-    #
-    m = c[0,4] # atomic mass
-    murho = mu*0.602252/m # mu/rho
-    rho = c[0,5]
-    return murho, rho, m
+    murho, rho, m = myprho_elements(energy,[Z],logtablefile)
+    return murho[0], rho[0], m[0]
+
+# number of compound absorption curves kept in memory (see mpr)
+MPR_MEMO_SIZE = 256
+_mpr_memo = collections.OrderedDict()
 
 def mpr(energy,compound):
     """Calculates the photoelectric, elastic, and inelastic absorption of 
     a chemical compound.
 
     Calculates the photoelectric, elastic, and inelastic absorption of a
-    chemical compound.
+    chemical compound. The last MPR_MEMO_SIZE results are kept in memory.
 
     Args:
       * energy (np.array): energy scale in [keV].
@@ -2684,16 +2905,24 @@ def mpr(energy,compound):
     """
     en   = np.array([])
     en   = np.append(en,energy) # turn energy into an iterable array
+    key  = (compound, en.shape, hashlib.sha1(np.ascontiguousarray(en)).hexdigest())
+    if key in _mpr_memo:
+        result = _mpr_memo.pop(key)
+    else:
+        result = _mpr(en,compound)
+        while len(_mpr_memo) >= MPR_MEMO_SIZE:
+            _mpr_memo.popitem(last=False)
+    _mpr_memo[key] = result
+    mr, rhov, mv = result
+    return mr.copy(), rhov.copy(), mv.copy()
+
+def _mpr(en,compound):
     z,w  = parseformula(compound)
-    mr   = np.zeros((len(en),3)) # 1. photoelectric absorption, 2. elastic absorption, 3. inelastic absorption
-    rhov = np.zeros((len(z),1))
-    mv   = np.zeros((len(z),1))
-    for i in range(len(z)):
-        tmp,rho,m = myprho(en,z[i])
-        m         = m*w[i] # weigh atomic masses by stoichiometry.
-        mv[i]     = m
-        rhov[i]   = rho
-        mr       += tmp*m # sum up individual mu/rho
+    # 1. photoelectric absorption, 2. elastic absorption, 3. inelastic absorption for all elements
+    tmp, rho, m = myprho_elements(en,z)
+    mv   = (m*np.array(w,dtype=float)).reshape((len(z),1)) # weigh atomic masses by stoichiometry.
+    rhov = rho.reshape((len(z),1))
+    mr   = np.sum(tmp*mv[:,:,None],0) # sum up individual mu/rho
     mtot = sum(mv)
     mr   = mr/mtot
     mr      = np.sum(mr,1)
@@ -3229,19 +3458,12 @@ def TTsolver1D(el_energy, hkl=[6,6,0], crystal='Si', R=1.0, dev=np.arange(-50.0,
     else:
         # deviation parameter
         abb8   = -2.0*np.sin(2.0*np.arcsin(lam/(2.0*dsp)))*dev
-        # dev axis (complex)
-        YY = np.zeros([nstep],"D")
-        # small step size
-        ministep = tdepth/10000.0
-        ssrk     = ministep/2
-        xpoints  = np.arange(np.max([-10.0*tdepth, -thick]),0, ministep)
-        for xpos in xpoints[:-1]:
-            Yp0  = odefctn_CN( YY,              xpos+0*ssrk, abb0, abb1, abb7, abb8, lex, sgbeta, y0, c1)
-            Yp1  = odefctn_CN( YY+1.0*ssrk*Yp0, xpos+1*ssrk, abb0, abb1, abb7, abb8, lex, sgbeta, y0, c1)
-            Yp2  = odefctn_CN( YY+1.0*ssrk*Yp1, xpos+1*ssrk, abb0, abb1, abb7, abb8, lex, sgbeta, y0, c1)
-            Ypb  = odefctn_CN( YY+2.0*ssrk*Yp2, xpos+2*ssrk, abb0, abb1, abb7, abb8, lex, sgbeta, y0, c1)
-            YY   =  YY  + ministep*(  Yp0 + 2.0*(Yp1+Yp2) + Ypb  )/6.0
-            refl = YY.real*YY.real+YY.imag*YY.imag
+        # integrate from the depth to the surface for all deviation angles at once
+        # (up to the last point of the tdepth/10000 grid of the former RK4 loop)
+        xstart = np.max([-10.0*tdepth, -thick])
+        xend   = np.arange(xstart, 0, tdepth/10000.0)[-1]
+        YY     = tt_integrate(xstart, xend, abb0, abb1, abb7, abb8, lex, sgbeta, y0, c1)
+        refl   = YY.real*YY.real+YY.imag*YY.imag
 
     # deviation in degree
     dev = dev/4.848136811e-06/3600.0 
@@ -3274,7 +3496,84 @@ def odefctn_CN(yCN,t,abb0,abb1,abb7,abb8N,lex,sgbeta,y0,c1):
     fcomp = 1.0/(complex(0,-lex)) * (-2.0*((abb0*(abb8N + abb7*sgbeta*t) + abb1) + complex(0,y0))*(yCN) + c1*(1.0 + yCN* yCN) )
     return fcomp
 
+def tt_integrate(xstart, xend, abb0, abb1, abb7, abb8, lex, sgbeta, y0, c1, rtol=1.0e-8, atol=1.0e-10, first_step=None):
+    """ **tt_integrate**
+    Integrates the Takagi-Taupin equation (see odefctn) through the depth of the
+    crystal for all values of the deviation parameter at once.
+
+    The reflected amplitudes of all deviation angles are treated as one complex
+    vector ODE, which is solved with an adaptive, error controlled Runge-Kutta
+    method (DOP853 of scipy.integrate.solve_ivp).
+
+    Args:
+      * xstart (float): Depth where the integration starts [m] (negative).
+      * xend (float): Depth where the integration ends [m] (surface).
+      * abb0, abb1, abb7, lex, sgbeta, y0, c1: Parameters of the equation (see taupgen).
+      * abb8 (np.array): Deviation parameters (one per deviation angle).
+      * rtol, atol (float): Relative and absolute tolerance of the integration.
+      * first_step (float): Initial step size [m], default is a tenth of the extinction length.
+
+    Returns:
+      * amplitude (np.array): Complex reflected amplitude at xend for each value of abb8.
+    """
+    abb8 = np.asarray( abb8, dtype=float ).ravel()
+    if first_step is None:
+        first_step = np.abs(lex)/10.0
+
+    # d amplitude/dx = (A + B*x)*amplitude + C*(1 + amplitude**2)
+    fac = 1.0/(complex(0,-lex))
+    A   = fac*(-2.0)*((abb0*abb8 + abb1) + complex(0,y0))
+    B   = fac*(-2.0)*abb0*abb7*sgbeta
+    C   = fac*c1
+    def rhs( x, amplitude ):
+        return (A + B*x)*amplitude + C*(1.0 + amplitude*amplitude)
+
+    # rejected trial steps may overflow
+    with np.errstate( over='ignore', invalid='ignore' ):
+        solution = integrate.solve_ivp( rhs, (xstart, xend), np.zeros(len(abb8), dtype=complex), \
+                                        method='DOP853', rtol=rtol, atol=atol, first_step=first_step )
+    if not solution.success:
+        raise RuntimeError( 'Integration of the Takagi-Taupin equation failed: ' + solution.message )
+    return solution.y[:,-1]
+
+# reflectivity curves already calculated by taupgen
+TAUPGEN_CACHE_SIZE = 64
+_taupgen_cache = collections.OrderedDict()
+
 def taupgen(e, hkl = [6,6,0], crystals = 'Si', R = 1.0, dev = np.arange(-50.0,150.0,1.0), alpha = 0.0):
+    """
+    % TAUPGEN          Calculates the reflectivity curves of bent crystals
+    %
+    % function [refl,e,dev]=taupgen_new(e,hkl,crystals,R,dev,alpha);
+    %
+    %              e = fixed nominal energy in keV
+    %            hkl = reflection order vector, e.g. [1 1 1]
+    %       crystals = crystal string, e.g. 'si' or 'ge'
+    %              R = bending radius in meters
+    %            dev = deviation parameter for which the 
+    %                  curve will be calculated (vector) (optional)
+    %          alpha = asymmetry angle 
+    % based on a FORTRAN program of Michael Krisch
+    % Translitterated to Matlab by Simo Huotari 2006, 2007
+    % The Takagi-Taupin equation is integrated for all deviation angles at
+    % once (see tt_integrate), the last TAUPGEN_CACHE_SIZE results are kept
+    % in memory.
+    """
+    dev = np.array( dev, dtype=float )
+    key = ( crystals.lower(), tuple( int(index) for index in hkl ), float(e), float(R), float(alpha), tuple( dev.ravel().tolist() ) )
+    if key in _taupgen_cache:
+        result = _taupgen_cache.pop( key )
+    else:
+        result = _taupgen( e, hkl, crystals, R, dev, alpha )
+        if result is None:
+            return
+        while len( _taupgen_cache ) >= TAUPGEN_CACHE_SIZE:
+            _taupgen_cache.popitem( last=False )
+    _taupgen_cache[key] = result
+    refl, e, dev, e0 = result
+    return refl.copy(), e.copy(), dev.copy(), e0
+
+def _taupgen(e, hkl = [6,6,0], crystals = 'Si', R = 1.0, dev = np.arange(-50.0,150.0,1.0), alpha = 0.0):
     """
     % TAUPGEN          Calculates the reflectivity curves of bent crystals
     %
@@ -3391,75 +3690,20 @@ def taupgen(e, hkl = [6,6,0], crystals = 'Si', R = 1.0, dev = np.arange(-50.0,15
     #   a spectrometer based on a spherical diced analyzer crystal with a 1-m bending radius in nearly backscattering conditions utilizing a strain gradient beta
     sgbeta = abb6*(abb2*(abb3 - abb4 + abb5))
 
-    nstep=len(dev)
-    eta  = np.zeros_like(dev)
-    abb8z = np.zeros_like(dev)
-    refl  = np.zeros_like(dev)
-    refl1 = np.zeros_like(dev)
-    refl2 = np.zeros_like(dev)
-
-    OLDMETHOD = 1
-
-    if OLDMETHOD :
-            for l in range(nstep):
-                    # actual value of the deviation angle
-                    # dev[l] = ystart + (l - 1)*ystep
-
-                    # deviation parameter
-                    abb8   = -2.0*np.sin(2.0*thetab)*dev[l]
-                    eta[l] = (dev[l]*np.sin(2.0*thetab)+np.abs(chi0.real)/2.0*(1.0-gamma))/(np.abs(cpol)*np.sqrt(np.abs(gamma))*np.sqrt(chih*chih))
-                    eta[l] = eta[l].real
-
-                    ndiff = 2
-                    xend = 0
-                    x = np.max([-10.0*tdepth, -thick])
-                    y = np.array([0.0, 0.0])
-                    h = xend
-                    abb8z[l] = abb8
+    # deviation parameters
+    abb8 = -2.0*np.sin(2.0*thetab)*dev
 
-                    # in this point call the subroutine
-                    #     [T,Y] = ODE23(ODEFUN,TSPAN,Y0,OPTIONS,P1,P2,...) passes the additional
-                    #    parameters P1,P2,... to the ODE function as ODEFUN(T,Y,P1,P2...), and to
-                    #    all functions specified in OPTIONS. Use OPTIONS = [] as a place holder if
-                    #    no options are set.   
-                    #print 'the fucking shape of y is ', np.shape(y)
-                    T = np.arange(x,xend,1e-8)
-                    Y = odeint(odefctn,y,T,args=(abb0,abb1,abb7,abb8,lex,sgbeta,y0,c1)) 
-
-                    # normalized reflectivity at this point
-                    refl[l] = np.sum(Y[-1,:]**2.0)
-                    refl1[l] = Y[-1,0]
-                    refl2[l] = Y[-1,1]
-
-    else:
-            YY = np.zeros([nstep],"D")
-            for l in range(nstep):
-                    abb8   = -2.0*np.sin(2.0*thetab)*dev[l]
-                    eta[l] = ((dev[l]*np.sin(2.0*thetab)+np.abs(chi0.real)/2.0*(1.0-gamma))/
-                              (np.abs(cpol)*np.sqrt(np.abs(gamma))*np.sqrt(chih*chih)))
-                    eta[l] = eta[l].real
-                    abb8z[l] = abb8
-
-
-            xend = 0
-            x = np.max([-10.0*tdepth, -thick])
-            ministep = tdepth/1000.0 ## when delta/beta is 100 we have still 10
-            xpoints = np.arange(x,0, ministep)
-            substep_RungeKutta = ministep/2
-            ssrk  = substep_RungeKutta
-
-            for xpos in xpoints[:-1]:
-                    Yp0 = odefctn_CN( YY, xpos+0*ssrk ,      abb0,abb1,abb7,abb8z,lex,sgbeta,y0,c1)
-                    Yp1 = odefctn_CN( YY+1*ssrk*Yp0, xpos+1*ssrk ,      abb0,abb1,abb7,abb8z,lex,sgbeta,y0,c1)
-                    Yp2 = odefctn_CN( YY+1*ssrk*Yp1, xpos+1*ssrk ,      abb0,abb1,abb7,abb8z,lex,sgbeta,y0,c1)
-                    Ypb = odefctn_CN( YY+2*ssrk*Yp2, xpos+2*ssrk ,      abb0,abb1,abb7,abb8z,lex,sgbeta,y0,c1)
-
-                    YY =  YY  + ministep*(  Yp0 + 2*(Yp1+Yp2) + Ypb  )/6.0
-
-            refl1 = YY.real
-            refl2 = YY.imag
-            refl  = refl1*refl1+refl2*refl2
+    # integrate from the depth to the surface for all deviation angles at once
+    # (up to the last point of the 10 nm depth grid used so far)
+    xend = 0
+    x = np.max([-10.0*tdepth, -thick])
+    xend = np.arange(x,xend,1e-8)[-1]
+    amplitude = tt_integrate(x, xend, abb0, abb1, abb7, abb8, lex, sgbeta, y0, c1)
 
+    # normalized reflectivity
+    refl1 = amplitude.real
+    refl2 = amplitude.imag
+    refl  = refl1**2.0 + refl2**2.0
 
     de = dev * e * 1.0e6 /np.tan(thetab)
 
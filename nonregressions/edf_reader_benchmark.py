@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# Microbenchmark of the EDF readers of xrs_fileIO : NumpyEdfRead against myEdfRead,
+# PyMcaEdfRead and FabioEdfRead (the last two are skipped if PyMca5/fabio are not installed).
+# Synthetic EDF-files are written in a temporary directory, each reader must return the
+# written image (myEdfRead only knows UnsignedShort, it differs on the FloatValue files).
+# Run with : python edf_reader_benchmark.py [nfiles] [dim1] [dim2]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+from XRStools import xrs_fileIO
+
+def write_edf(filename, data, datatype, byteorder):
+    header = "{\nHeaderID = EH:000001:000000:000000 ;\nImage = 1 ;\nByteOrder = %s ;\nDataType = %s ;\n" \
+             "Dim_1 = %d ;\nDim_2 = %d ;\nSize = %d ;\n" % (byteorder, datatype, data.shape[1], data.shape[0], data.nbytes)
+    # the header block is padded with spaces to a multiple of 512 bytes and closed by '}\n'
+    nblocks = (len(header)+2)//512 + 1
+    header  = header + " "*(nblocks*512 - len(header) - 2) + "}\n"
+    f = open(filename, "wb")
+    f.write(header.encode("ascii"))
+    f.write(data.tobytes())
+    f.close()
+
+def time_reader(reader, fnames, images):
+    try:
+        t0 = time.time()
+        res = [ reader(fname) for fname in fnames ]
+        dt = time.time()-t0
+    except Exception as exc:
+        return None, "failed (%s: %s)" % (type(exc).__name__, exc)
+    same = all( np.array_equal(np.asarray(r), im) for r, im in zip(res, images) )
+    return dt, ("identical" if same else "DIFFERENT")
+
+if __name__ == "__main__":
+    nfiles = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    dim1   = int(sys.argv[2]) if len(sys.argv) > 2 else 1296
+    dim2   = int(sys.argv[3]) if len(sys.argv) > 3 else 256
+
+    readers = [ ("NumpyEdfRead", xrs_fileIO.NumpyEdfRead), ("myEdfRead", xrs_fileIO.myEdfRead) ]
+    if hasattr(xrs_fileIO, "EdfIO"):
+        readers.append( ("PyMcaEdfRead", xrs_fileIO.PyMcaEdfRead) )
+    else:
+        print( "PyMca5 not installed : PyMcaEdfRead skipped" )
+    if hasattr(xrs_fileIO, "fabio"):
+        readers.append( ("FabioEdfRead", xrs_fileIO.FabioEdfRead) )
+    else:
+        print( "fabio not installed : FabioEdfRead skipped" )
+
+    np.random.seed(0)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for datatype, byteorder, dtype in [ ("UnsignedShort", "LowByteFirst",  "<u2"),
+                                            ("FloatValue",    "HighByteFirst", ">f4") ]:
+            images = []
+            fnames = []
+            for i in range(nfiles):
+                im = (np.random.poisson(20.0, (dim2, dim1))).astype(dtype)
+                fname = os.path.join(tmpdir, "bench_%s_%04d.edf" % (datatype, i))
+                write_edf(fname, im, datatype, byteorder)
+                images.append(im)
+                fnames.append(fname)
+
+            print( "%d files of %d x %d %s (%s) :" % (nfiles, dim2, dim1, datatype, byteorder) )
+            t_ref = None
+            for name, reader in readers:
+                dt, check = time_reader(reader, fnames, images)
+                if dt is None:
+                    print( "  %-13s %s" % (name, check) )
+                    continue
+                if t_ref is None:
+                    t_ref = dt
+                print( "  %-13s %.3f s (%.0f frames/s, %.2f x NumpyEdfRead)  %s" % (name, dt, nfiles/max(dt, 1e-9), dt/max(t_ref, 1e-9), check) )
+    finally:
+        shutil.rmtree(tmpdir)
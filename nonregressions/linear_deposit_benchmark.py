@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# Microbenchmark of xrs_utilities.linear_deposit against the element by element
+# loop formerly used in fit_spectra.do_spettro_byscal (and in the numpy fallback
+# of fit_spectra.fit_spectra_roi). Run with : python linear_deposit_benchmark.py [npairs]
+
+import sys
+import time
+import numpy as np
+
+from XRStools import fit_spectra
+
+def do_spettro_byscal_loop(energie_spettro, spettro_byscal, SD_scal, energie_for_SD,  S_L1  ):
+    byscal_sum = np.zeros_like(energie_spettro)
+    Slong_L1 = np.zeros_like(SD_scal)
+    Slong_L1[:,:] = Slong_L1[:,:]+S_L1[:,None]
+    El = energie_spettro[0]
+    Eh = energie_spettro[-1] + energie_spettro[1]-energie_spettro[0]
+    NS = len(energie_spettro)
+    SD_scal = np.array(SD_scal.flat)
+    energie_for_SD = np.array(energie_for_SD.flat)
+    Slong_L1 = np.array(Slong_L1.flat)
+    for E,Scal,Sl1 in zip(  energie_for_SD  , SD_scal,  Slong_L1    ) :
+        fpos = NS*((  E-El)/(Eh-El))
+        if fpos>0 and fpos<NS-1:
+            ipos = int(fpos)
+            ipos1= ipos+1
+            f = fpos-ipos
+            byscal_sum[ipos] +=   (1-f)*Sl1
+            byscal_sum[ipos1] +=   (f)*Sl1
+            spettro_byscal[ipos] +=   (1-f)*Scal
+            spettro_byscal[ipos1] +=   (f)*Scal
+    for i in range(len(spettro_byscal)) :
+        if byscal_sum[i]>0:
+            spettro_byscal[i] = spettro_byscal[i]/byscal_sum[i]
+
+if __name__ == "__main__":
+    npairs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    nref   = 200
+
+    np.random.seed(0)
+    energie_spettro = np.linspace(0.0, 100.0, 2001)
+    energie_for_SD  = np.random.uniform(-5.0, 105.0, [nref, npairs//nref])
+    SD_scal         = np.random.uniform(0.0, 1.0, [nref, npairs//nref])
+    S_L1            = np.random.uniform(1.0, 2.0, nref)
+
+    res_loop = np.zeros_like(energie_spettro)
+    t0 = time.time()
+    do_spettro_byscal_loop(energie_spettro, res_loop, SD_scal, energie_for_SD, S_L1)
+    t_loop = time.time()-t0
+
+    res_vect = np.zeros_like(energie_spettro)
+    t0 = time.time()
+    fit_spectra.do_spettro_byscal(energie_spettro, res_vect, SD_scal, energie_for_SD, S_L1)
+    t_vect = time.time()-t0
+
+    print( "do_spettro_byscal, %d pairs : loop %.3f s, linear_deposit %.4f s, speed-up %.0f" % ( SD_scal.size, t_loop, t_vect, t_loop/t_vect ) )
+    print( "  identical results : ", np.array_equal(res_loop, res_vect) )
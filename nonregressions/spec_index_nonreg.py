@@ -0,0 +1,61 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# Nonregression of the SPEC index of xrs_fileIO (IndexedSpecRead) on a SPEC file that
+# grows during the experiment : the last scan ends with an unfinished line, later the
+# line is completed and a new scan is appended. A row with a bad token is dropped alone.
+# Run with : python spec_index_nonreg.py
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+
+from XRStools import xrs_fileIO
+
+HEADER = [ "#F growing", "#E 1", "#O0 mot_a  mot_b", "" ]
+
+def scan_lines(number, npoints):
+    lines = [ "#S %d ascan energy 0 1 %d 1" % (number, npoints-1), "#P0 1.5 2.5", "#L energy  izero  det" ]
+    lines += [ "%d %f %f" % (i, 2.0*i, 3.0*i) for i in range(npoints) ]
+    return lines
+
+def check(name, condition):
+    print( "  %-55s %s" % (name, "OK" if condition else "FAILED") )
+    return condition
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp()
+    fname  = os.path.join(tmpdir, "growing.spec")
+    ok = True
+    try:
+        # scan 1 complete, scan 2 with a bad token in one row and an unfinished last line
+        scan2 = scan_lines(2, 4)
+        scan2[4] = "1 2.0 3.O"
+        f = open(fname, "w")
+        f.write( "\n".join(HEADER + scan_lines(1, 5) + [""] + scan2) + "\n4 5" )
+        f.close()
+
+        data, motors, counters, lables = xrs_fileIO.IndexedSpecRead(fname, 1)
+        ok &= check( "complete scan : 5 x 3 data", data.shape == (5, 3) )
+        ok &= check( "complete scan : counters and motors", sorted(counters) == ["det", "energy", "izero"] and motors["mot_b"] == 2.5 )
+
+        data, motors, counters, lables = xrs_fileIO.IndexedSpecRead(fname, 2)
+        ok &= check( "unfinished last line and bad row are dropped", data.shape == (3, 3) )
+        ok &= check( "remaining rows are read", np.array_equal(data[:,0], [0, 2, 3]) )
+
+        # the scan goes on : the unfinished line is completed and a new scan starts
+        f = open(fname, "a")
+        f.write( " 6\n4 8.0 12.0\n\n" + "\n".join(scan_lines(3, 2)) + "\n" )
+        f.close()
+
+        data, motors, counters, lables = xrs_fileIO.IndexedSpecRead(fname, 2)
+        ok &= check( "completed rows are read after the file grew", np.array_equal(data[:,0], [0, 2, 3, 4, 4]) )
+        data, motors, counters, lables = xrs_fileIO.IndexedSpecRead(fname, 3)
+        ok &= check( "appended scan is indexed", data.shape == (2, 3) )
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print( "ALL OK" if ok else "FAILURES" )
+    sys.exit(0 if ok else 1)
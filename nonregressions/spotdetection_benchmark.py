@@ -0,0 +1,238 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# Comparison of spotdetection.LocalMaxima, Canny and Canny_lines against the IsMaximum loop
+# implementation they replaced (inlined below as the reference, debug prints removed).
+# The local maxima, the edges found by CercaAnelli (both modes) and the masks of
+# get_spots_mask are compared on synthetic spot images, and timed.
+# Run with : python spotdetection_benchmark.py
+
+import sys
+import time
+import numpy as np
+
+from XRStools import spotdetection
+
+def Canny_loop(Ax,Ay):
+  Angles = np.arctan2(    Ax, -Ay )
+  Angles=Angles*180/np.pi
+  Angles = np.floor( Angles/45  + 0.5)
+  slope = Ax*Ax + Ay*Ay
+  Nmarge=6
+  MaximumRatio=100.0
+  Ni=Ax.shape[0]
+  Nj=Ax.shape[1]
+  ListLocalMaxima=[]
+  for i in range( Nmarge, Ni-Nmarge):
+   for j in range( Nmarge, Nj-Nmarge):
+     if( spotdetection.IsMaximum( i,j,slope) ):
+        ListLocalMaxima.append( [i,j] )
+  steps={-5:[-1,1], -4:[-1,0],-3:[-1,-1], -2:[0,-1],-1:[1,-1],0:[1,0],1:[1,1],2:[0,1],3:[-1,1],4:[-1,0], 5:[-1,-1]}
+  EdgeList=[]
+  endpoints=[]
+  EdgePoints=np.zeros(Ax.shape  )
+  EdgePoints[:Nmarge ,:]=-1
+  EdgePoints[:,:Nmarge ]=-1
+  EdgePoints[-Nmarge:,:]=-1
+  EdgePoints[:,-Nmarge:]=-1
+  StartPoints = ListLocalMaxima
+  for starting in StartPoints:
+    EdgePointsTmp = np.zeros(Ax.shape  )
+    s0=starting[0]
+    s1=starting[1]
+    pentevalue= slope[s0, s1 ]
+    if(EdgePoints[ s0, s1  ]==0):
+      Edge=[]
+      Edge.append( [s0,s1] )
+      prendi=0
+      traccia=0
+      while(1):
+        if( slope[s0, s1 ]/pentevalue < 1.0/MaximumRatio):
+          prendi=0
+          traccia=1
+          break
+        EdgePointsTmp[ s0, s1  ]=1
+        direction = Angles[s0,s1]
+        ss =  [ steps[direction-1],  steps[direction],  steps[direction+1]]
+        pttrs = [  [s0+ss[0][0],s1+ss[0][1]], [s0+ss[1][0],s1+ss[1][1]], [s0+ss[2][0],s1+ss[2][1]]  ]
+        values =  [ [slope[ pttrs[i][0], pttrs[i][1]  ],i]  for i in range(3)  ]
+        imax=    max(values)[1]
+        s0=pttrs[imax][0]
+        s1=pttrs[imax][1]
+        if(EdgePoints[ s0, s1  ]):
+          prendi=0
+          traccia=1
+          break
+        if( EdgePointsTmp[ s0, s1  ] ):
+          prendi=1
+          traccia=1
+          Edge.reverse()
+          newedge = [ ]
+          for p in Edge :
+            if tuple(p)== (s0,s1):
+              break
+            newedge.append(p)
+          Edge = [[s0,s1]]+newedge
+          break
+        else:
+          Edge.append( [s0,s1] )
+      if(prendi):
+        endpoints.append([s0,s1])
+        EdgeList.append(Edge)
+      if traccia:
+        for p in Edge:
+          EdgePoints[p[0],p[1]]=1
+  values =  [ edge   for edge  in  EdgeList   if   len(edge)>10   ]
+  return  values
+
+def Canny_lines_loop(Ax,Ay):
+  Angles = np.arctan2(    Ax, -Ay )
+  Angles=Angles*180/np.pi
+  Angles = np.floor( Angles/45  + 0.5)
+  slope = Ax*Ax + Ay*Ay
+  Nmarge=1
+  MaximumRatio=10000.0
+  Ni=Ax.shape[0]
+  Nj=Ax.shape[1]
+  ListLocalMaxima=[]
+  for i in range( Nmarge, Ni-Nmarge):
+   for j in range( Nmarge, Nj-Nmarge):
+     if( spotdetection.IsMaximum( i,j,slope) ):
+        ListLocalMaxima.append( [i,j] )
+  steps={-5:np.array([-1,1]), -4:np.array([-1,0]),-3:np.array([-1,-1]), -2:np.array([0,-1]),-1:np.array([1,-1]),
+          0:np.array([1,0]),1:np.array([1,1]),2:np.array([0,1]),3:np.array([-1,1]),4:np.array([-1,0]), 5:np.array([-1,-1])}
+  EdgeList=[]
+  endpoints=[]
+  EdgePoints=np.zeros(Ax.shape  )
+  EdgePoints[:Nmarge ,:]=-1
+  EdgePoints[:,:Nmarge ]=-1
+  EdgePoints[-Nmarge:,:]=-1
+  EdgePoints[:,-Nmarge:]=-1
+  StartPoints = ListLocalMaxima
+  stack = []
+  for starting in StartPoints:
+    s0=starting[0]
+    s1=starting[1]
+    pentevalue= slope[s0, s1 ]
+    stack.append( [  (s0,  s1), pentevalue, 1    ] )
+  while len(stack):
+    starting, pentevalue, direction_fact = stack[-1]
+    stack=stack[:-1]
+    EdgePointsTmp = np.zeros(Ax.shape  )
+    s0=starting[0]
+    s1=starting[1]
+    pentevalue= slope[s0, s1 ]
+    if(EdgePoints[ s0, s1  ]==0):
+      Edge=[]
+      Edge.append( [s0,s1] )
+      prendi=0
+      traccia=0
+      while(1):
+        if( slope[s0, s1 ]/pentevalue < 1.0/MaximumRatio):
+          if direction_fact==1  :
+            prendi=0
+            traccia=0
+            if  len(Edge)>4:
+              stack.append( [  Edge[-4], pentevalue, -1    ])
+          else:
+            prendi= len(Edge)>5
+            traccia=1
+          break
+        EdgePointsTmp[ s0, s1  ]=1
+        direction = Angles[s0,s1]
+        ss =  np.array([ steps[direction-1],  steps[direction],  steps[direction+1]])*direction_fact
+        pttrs = [  [s0+ss[0][0],s1+ss[0][1]], [s0+ss[1][0],s1+ss[1][1]], [s0+ss[2][0],s1+ss[2][1]]  ]
+        values =  [ [slope[ pttrs[i][0], pttrs[i][1]  ],i]  for i in range(3)  ]
+        imax=    max(values)[1]
+        s0=pttrs[imax][0]
+        s1=pttrs[imax][1]
+        if(EdgePoints[ s0, s1  ]):
+          if direction_fact==-1:
+            Edge=Edge[:-10]
+            prendi=1
+            traccia=1
+            break
+          else:
+            EdgePointsTmp[:]=0
+            prendi=0
+            traccia=0
+            if  len(Edge)>10:
+              stack.append( [  Edge[-4], pentevalue, -1    ])
+            break
+        if( EdgePointsTmp[ s0, s1  ] ):
+          prendi=1
+          traccia=1
+          Edge.reverse()
+          newedge = [ ]
+          for p in Edge :
+            if tuple(p)== (s0,s1):
+              break
+            newedge.append(p)
+          Edge = [[s0,s1]]+newedge
+          break
+        else:
+          Edge.append( [s0,s1] )
+      if(prendi):
+        endpoints.append([s0,s1])
+        EdgeList.append(Edge)
+      if traccia:
+        for p in Edge:
+          EdgePoints[p[0],p[1]]=1
+  values =  [ edge   for edge  in  EdgeList   if   len(edge)>10   ]
+  return  values
+
+def spots_image(shape, nspots, rng):
+    A = np.zeros(shape)
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    for k in range(nspots):
+        cy, cx = rng.randint(20, shape[0]-20), rng.randint(20, shape[1]-20)
+        r = rng.randint(4, 12)
+        A += rng.rand()*100*np.exp(-((yy-cy)**2+(xx-cx)**2)/(2.0*r*r))
+    return A + rng.rand(*shape)
+
+def with_loop_implementation(function, *args, **kwargs):
+    """ runs function with Canny and Canny_lines of spotdetection replaced by the loop versions """
+    new = spotdetection.Canny, spotdetection.Canny_lines
+    spotdetection.Canny, spotdetection.Canny_lines = Canny_loop, Canny_lines_loop
+    try:
+        return function(*args, **kwargs)
+    finally:
+        spotdetection.Canny, spotdetection.Canny_lines = new
+
+def timed(function, *args, **kwargs):
+    t0 = time.time()
+    res = function(*args, **kwargs)
+    return res, time.time()-t0
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    ok = True
+    for shape, nspots in [ ((128,128),6), ((256,256),12), ((512,1536),40) ]:
+        A = spots_image(shape, nspots, rng)
+        print( "image %d x %d, %d spots :" % (shape[0], shape[1], nspots) )
+
+        slope = A*A
+        for Nmarge in (1, 6):
+            ref = [ [i,j] for i in range(Nmarge, shape[0]-Nmarge) for j in range(Nmarge, shape[1]-Nmarge)
+                    if spotdetection.IsMaximum(i, j, slope) ]
+            same = ( spotdetection.LocalMaxima(slope, Nmarge) == ref )
+            ok = ok and same
+            print( "  LocalMaxima Nmarge=%d : %d points, identical %s" % (Nmarge, len(ref), same) )
+
+        for lines in (False, True):
+            if lines and shape[0] > 256:
+                continue   # the loop version of Canny_lines is too slow for the large image
+            r_ref, t_ref = timed( with_loop_implementation, spotdetection.CercaAnelli, A.copy(), lines=lines )
+            r_new, t_new = timed( spotdetection.CercaAnelli, A.copy(), lines=lines )
+            same = ( r_ref == r_new )
+            ok = ok and same
+            print( "  CercaAnelli lines=%-5s : %3d edges, identical %s, loop %.2f s, new %.2f s" % (lines, len(r_new), same, t_ref, t_new) )
+
+        m_ref, t_ref = timed( with_loop_implementation, spotdetection.get_spots_mask, A.copy(), A*0, median_size=5, nofroi=12 )
+        m_new, t_new = timed( spotdetection.get_spots_mask, A.copy(), A*0, median_size=5, nofroi=12 )
+        same = np.array_equal(m_ref, m_new)
+        ok = ok and same
+        print( "  get_spots_mask          : %3d rois,  identical %s, loop %.2f s, new %.2f s" % (m_new.max(), same, t_ref, t_new) )
+
+    print( "ALL IDENTICAL" if ok else "DIFFERENCES FOUND" )
+    sys.exit(0 if ok else 1)